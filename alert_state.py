@@ -0,0 +1,158 @@
+# alert_state.py - Per-client_place alert state machine
+#
+#   ok --warning--> warning   email the alert at once
+#   warning --warning--> warning   count it; email a digest once ALERT_DIGEST_COOLDOWN has passed
+#   warning --in range--> ok   email a recovery notice
+#
+# State lives in the shared store (shared_state.py) so every worker sees the same
+# machine: a transition is decided under a cross-worker lock - only one worker
+# emails a given alert - while repeats inside the cooldown are a lock-free incr.
+# It is mirrored to the alert_state table on every transition or email, so a
+# restart neither re-fires nor forgets an alert. A batch advances each sensor
+# once (process_batch), so its cost follows the sensors in it, not the rows.
+import time
+from config import ALERT_DIGEST_COOLDOWN
+from email_service import send_alert_email, send_alert_digest_email, send_recovery_email
+from shared_state import get_state
+
+OK = 'ok'
+WARNING = 'warning'
+
+
+class AlertState:
+    __slots__ = ('state', 'since', 'last_sent', 'suppressed', 'last_warning')
+
+    def __init__(self, state=OK, since=None, last_sent=None, suppressed=0, last_warning=None):
+        self.state = state
+        self.since = since
+        self.last_sent = last_sent
+        self.suppressed = suppressed
+        self.last_warning = last_warning
+
+    def to_list(self):
+        return [self.state, self.since, self.last_sent, self.suppressed, self.last_warning]
+
+
+def _load(client_place):
+    # Import inside function to avoid circular import
+    from database import get_db_connection
+
+    conn = get_db_connection()
+    row = conn.execute(
+        "SELECT state, since, last_sent, suppressed, last_warning FROM alert_state WHERE client_place = ?",
+        (client_place,)
+    ).fetchone()
+    conn.close()
+    return AlertState(*row) if row else AlertState()
+
+
+def _save(client_place, state):
+    from database import get_db_connection
+
+    conn = get_db_connection()
+    conn.execute("""
+        INSERT OR REPLACE INTO alert_state (client_place, state, since, last_sent, suppressed, last_warning)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (client_place, state.state, state.since, state.last_sent, state.suppressed, state.last_warning))
+    conn.commit()
+    conn.close()
+
+
+def _get(client_place):
+    """Shared state of client_place, seeded from the DB mirror the first time any worker asks"""
+    shared = get_state()
+    stored = shared.get(f"alert:{client_place}")
+    if stored is None:
+        loaded = _load(client_place)
+        if shared.add(f"alert:{client_place}", loaded.to_list()):
+            return loaded
+        stored = shared.get(f"alert:{client_place}")  # another worker seeded it first
+    return AlertState(*stored)
+
+
+def _event(state, warning, now):
+    if warning:
+        if state.state == OK:
+            return 'alert'
+        if now - (state.last_sent or 0) >= ALERT_DIGEST_COOLDOWN:
+            return 'digest'
+        return 'suppressed'
+    return 'recovered' if state.state == WARNING else None
+
+
+def process_reading(client, client_name, client_place, place, temperature, humidity, warning, now=None, repeats=0):
+    """Advance client_place's state for one reading and queue whatever email is due.
+
+    client is the api_key_cache record; emails go out only if its alerts are enabled.
+    repeats counts further warning readings folded into this one (see process_batch).
+    Returns the event: 'alert', 'digest', 'recovered' or None.
+    """
+    now = now if now is not None else time.time()
+    shared = get_state()
+    event = _event(_get(client_place), warning, now)
+    if event == 'suppressed':
+        shared.incr(f"alert:{client_place}:suppressed", 1 + repeats)
+        return None
+    if event is None:
+        return None
+
+    with shared.lock(f"alert:{client_place}"):
+        # Decide again under the lock - another worker may have just made this transition.
+        # (A lock we timed out on is stale; carrying on beats dropping the alert.)
+        state = _get(client_place)
+        event = _event(state, warning, now)
+        if event == 'suppressed':
+            shared.incr(f"alert:{client_place}:suppressed", 1 + repeats)
+            return None
+        if event is None:
+            return None
+        pending = shared.incr(f"alert:{client_place}:suppressed", 0)
+        if pending:
+            shared.incr(f"alert:{client_place}:suppressed", -pending)  # keeps repeats counted meanwhile
+        suppressed = state.suppressed + pending
+        if event == 'alert':
+            state.state, state.since, state.last_sent, state.suppressed = WARNING, now, now, repeats
+            state.last_warning = warning
+        elif event == 'digest':
+            repeats, state.last_sent, state.suppressed = suppressed + 1 + repeats, now, 0
+            state.last_warning = warning
+            minutes = int((now - (state.since or now)) // 60)
+        else:
+            minutes = int((now - (state.since or now)) // 60)
+            state.state, state.since, state.last_sent, state.suppressed, state.last_warning = OK, now, now, 0, None
+        shared.set(f"alert:{client_place}", state.to_list())
+
+    _save(client_place, state)
+
+    if client['email_enabled'] == 1 and client['email']:
+        if event == 'alert':
+            send_alert_email(client_name, place, temperature, humidity, warning, client['email'])
+        elif event == 'digest':
+            send_alert_digest_email(client_name, place, temperature, humidity, warning, repeats, minutes, client['email'])
+        else:
+            send_recovery_email(client_name, place, temperature, humidity, minutes, client['email'])
+    return event
+
+
+def _severity(warning):
+    return warning.count('; ') + 1 if warning else 0
+
+
+def process_batch(client, client_name, rows, now=None):
+    """process_reading once per sensor for a batch of (client_place, place, temperature, humidity, warning) rows.
+
+    Each sensor is advanced with its worst reading (most warnings, latest on a tie,
+    or its last reading when none warned); its other warning readings count as repeats.
+    Returns {client_place: event}.
+    """
+    groups = {}  # client_place -> (worst row, warning readings)
+    for row in rows:
+        worst, warned = groups.get(row[0], (None, 0))
+        if worst is None or _severity(row[4]) >= _severity(worst[4]):
+            worst = row
+        groups[row[0]] = (worst, warned + (1 if row[4] else 0))
+    events = {}
+    for client_place, ((_, place, temperature, humidity, warning), warned) in groups.items():
+        events[client_place] = process_reading(client, client_name, client_place, place, temperature, humidity,
+                                               warning, now, repeats=max(warned - 1, 0))
+    return events
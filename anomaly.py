@@ -0,0 +1,107 @@
+# anomaly.py - Online anomaly detection for incoming readings
+# Fixed ranges (thresholds.py) miss sensors that fail inside the band, so every
+# reading also goes through three streaming checks per client_place:
+#
+#   spike      |x - EWMA mean| > ANOMALY_Z_SCORE EWMA standard deviations
+#   fast rise  change since the previous reading faster than ANOMALY_TEMP_RATE / ANOMALY_HUM_RATE per minute
+#   flatline   ANOMALY_FLATLINE identical readings in a row (a frozen sensor)
+#
+# The state is O(1) per sensor - a __slots__ record of running statistics, not a
+# window of readings - so a worker can track tens of thousands of sensors; beyond
+# ANOMALY_MAX_SENSORS the longest-tracked sensor is forgotten (it just warms up
+# again). Each worker keeps statistics for the readings it receives.
+import math
+import threading
+import time
+from config import (ANOMALY_ENABLED, ANOMALY_ALPHA, ANOMALY_Z_SCORE, ANOMALY_WARMUP, ANOMALY_MIN_STD,
+                    ANOMALY_TEMP_RATE, ANOMALY_HUM_RATE, ANOMALY_FLATLINE, ANOMALY_MAX_SENSORS)
+
+
+class SensorStats:
+    """Running statistics for one client_place"""
+
+    __slots__ = ('count', 't_mean', 't_var', 'h_mean', 'h_var', 'last_t', 'last_h', 'last_ts', 'flat')
+
+    def __init__(self, temperature, humidity, ts):
+        self.count = 1
+        self.t_mean, self.t_var = temperature, 0.0
+        self.h_mean, self.h_var = humidity, 0.0
+        self.last_t, self.last_h, self.last_ts = temperature, humidity, ts
+        self.flat = 1  # identical readings in a row, including this one
+
+
+_stats = {}  # client_place -> SensorStats
+_lock = threading.Lock()
+_counts = {'spike': 0, 'rate': 0, 'flatline': 0}
+
+
+def _z_score(value, mean, var):
+    return (value - mean) / max(math.sqrt(var), ANOMALY_MIN_STD)
+
+
+def _ewma(mean, var, value):
+    """Exponentially weighted mean and variance after one more value"""
+    diff = value - mean
+    increment = ANOMALY_ALPHA * diff
+    return mean + increment, (1 - ANOMALY_ALPHA) * (var + diff * increment)
+
+
+def check_reading(client_place, temperature, humidity, ts=None):
+    """Update client_place's statistics with one reading; returns anomaly warnings ('' if none)
+
+    Readings must be passed in arrival order; ts defaults to now. A NaN / infinite value
+    is skipped without touching the statistics - it would poison the EWMA for good.
+    """
+    if not ANOMALY_ENABLED or not (math.isfinite(temperature) and math.isfinite(humidity)):
+        return ''
+    ts = ts if ts is not None else time.time()
+    warn = []
+    with _lock:
+        stats = _stats.get(client_place)
+        if stats is None:
+            if len(_stats) >= ANOMALY_MAX_SENSORS:
+                del _stats[next(iter(_stats))]
+            _stats[client_place] = SensorStats(temperature, humidity, ts)
+            return ''
+
+        if stats.count >= ANOMALY_WARMUP:
+            z = _z_score(temperature, stats.t_mean, stats.t_var)
+            if abs(z) > ANOMALY_Z_SCORE:
+                warn.append(f"Temperature spike ({temperature}°C, z={z:.1f})")
+                _counts['spike'] += 1
+            z = _z_score(humidity, stats.h_mean, stats.h_var)
+            if abs(z) > ANOMALY_Z_SCORE:
+                warn.append(f"Humidity spike ({humidity}%, z={z:.1f})")
+                _counts['spike'] += 1
+
+        # Steps within the same minute count as a per-minute rate, so bursts don't divide by ~0
+        minutes = max(ts - stats.last_ts, 60) / 60
+        temp_rate = (temperature - stats.last_t) / minutes
+        hum_rate = (humidity - stats.last_h) / minutes
+        if abs(temp_rate) > ANOMALY_TEMP_RATE:
+            warn.append(f"Temperature changing fast ({temp_rate:+.1f}°C/min)")
+            _counts['rate'] += 1
+        if abs(hum_rate) > ANOMALY_HUM_RATE:
+            warn.append(f"Humidity changing fast ({hum_rate:+.1f}%/min)")
+            _counts['rate'] += 1
+
+        stats.flat = stats.flat + 1 if temperature == stats.last_t and humidity == stats.last_h else 1
+        if ANOMALY_FLATLINE and stats.flat >= ANOMALY_FLATLINE:
+            warn.append(f"Sensor flatlined ({stats.flat} identical readings)")
+            _counts['flatline'] += 1
+
+        stats.t_mean, stats.t_var = _ewma(stats.t_mean, stats.t_var, temperature)
+        stats.h_mean, stats.h_var = _ewma(stats.h_mean, stats.h_var, humidity)
+        stats.last_t, stats.last_h, stats.last_ts = temperature, humidity, ts
+        stats.count += 1
+    return '; '.join(warn)
+
+
+def combine(*warnings):
+    """Join range and anomaly warnings into the single stored warning string"""
+    return '; '.join(w for w in warnings if w)
+
+
+def get_stats():
+    with _lock:
+        return dict(_counts, sensors=len(_stats), enabled=ANOMALY_ENABLED)
@@ -0,0 +1,59 @@
+# api_key_cache.py - In-memory API key -> client record cache for the ingestion hot path
+# Valid keys are cached for API_KEY_CACHE_TTL and rejected keys for
+# API_KEY_NEGATIVE_TTL, so a misconfigured device can't hammer the DB.
+# database.py calls invalidate() whenever a client row changes; the change is
+# published through shared_state so the other workers drop their copies at once
+# rather than serving a deleted key until its TTL runs out.
+import threading
+import time
+from config import API_KEY_CACHE_TTL, API_KEY_NEGATIVE_TTL, API_KEY_CACHE_MAX
+from shared_state import get_state, subscribe
+
+_cache = {}  # api_key -> (expires_at, record or None)
+_lock = threading.Lock()
+
+
+def _prune(now):
+    """Drop expired entries, then rejected keys, when the cache is full"""
+    for key in [k for k, (expires, _) in _cache.items() if expires <= now]:
+        del _cache[key]
+    if len(_cache) >= API_KEY_CACHE_MAX:
+        for key in [k for k, (_, record) in _cache.items() if record is None]:
+            del _cache[key]
+
+
+def lookup(api_key):
+    """Client record {username, formatted_name, email, email_enabled} for a key, or None"""
+    now = time.monotonic()
+    entry = _cache.get(api_key)
+    if entry and entry[0] > now:
+        return entry[1]
+
+    # Import inside function to avoid circular import
+    from database import get_client_by_api_key
+    record = get_client_by_api_key(api_key)
+    ttl = API_KEY_CACHE_TTL if record else API_KEY_NEGATIVE_TTL
+    with _lock:
+        if len(_cache) >= API_KEY_CACHE_MAX:
+            _prune(now)
+        _cache[api_key] = (now + ttl, record)
+    return record
+
+
+def invalidate(username=None):
+    """Forget cached records for one client, or everything when username is None, in every worker"""
+    _forget(username)
+    get_state().publish('api_keys', username)
+
+
+def _forget(username):
+    with _lock:
+        if username is None:
+            _cache.clear()
+            return
+        for key in [k for k, (_, record) in _cache.items() if record is None or record['username'] == username]:
+            del _cache[key]
+
+
+# Another worker's invalidate(), or None when messages may have been missed - forget everything
+subscribe('api_keys', _forget)
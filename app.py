@@ -1,103 +1,79 @@
-from flask import Flask
-from routes import setup_routes
-from database import get_db_connection
-import sqlite3
+# app.py - Application factory
+# Importing this module does nothing; create_app() builds the Flask app without
+# touching the data. Schema set-up (migrations + default owner) runs in
+# init_db(): explicitly with `python app.py --init-db` before the workers start,
+# or - with DB_AUTO_MIGRATE on - from create_app() when the schema is behind.
+# Then a file lock makes one worker migrate while the others wait for it, and a
+# current schema costs a single PRAGMA read.
+#
+#   gunicorn 'app:create_app()'
+#   python app.py [--init-db]
+import argparse
+import fcntl
 import os
-from datetime import datetime
-from config import UK_TZ
+from flask import Flask
+from config import DB_PATH, DB_AUTO_MIGRATE
+
+
+def init_db():
+    """Apply pending migrations and create the default owner; returns the schema version"""
+    # Import inside function so importing app stays cheap
+    from database import get_db_connection, create_default_owner
+    from migrations import migrate, get_schema_version, LATEST_VERSION
+
+    with open(os.path.abspath(DB_PATH) + '.init.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)  # released when the file is closed
+        conn = get_db_connection()
+        try:
+            if get_schema_version(conn) >= LATEST_VERSION:
+                return LATEST_VERSION  # another worker got here first
+        finally:
+            conn.close()
+        print("Initializing StormSaver database...")
+        version = migrate()
+        create_default_owner()
+    print(f"Database ready (schema version {version})")
+    return version
 
-app = Flask(__name__)
-app.secret_key = os.getenv('SECRET_KEY', 'super-secret-storm-key-2025')
 
-# ====================== DATABASE INIT ======================
-print("Initializing StormSaver database...")
-conn = get_db_connection()
-cursor = conn.cursor()
+def schema_is_current():
+    from database import get_db_connection
+    from migrations import get_schema_version, LATEST_VERSION
 
-# Create tables if not exist
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE,
-        password TEXT,
-        role TEXT
-    )
-''')
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS clients (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE,
-        password TEXT,
-        places TEXT,
-        email TEXT,
-        phone TEXT,
-        address TEXT,
-        email_enabled INTEGER DEFAULT 1,
-        collection_interval INTEGER DEFAULT 10,
-        api_key TEXT,
-        formatted_name TEXT
-    )
-''')
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS sensor_data (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp TEXT,
-        client_place TEXT,
-        place TEXT,
-        temperature REAL,
-        humidity REAL,
-        warning TEXT
-    )
-''')
+    conn = get_db_connection()
+    try:
+        return get_schema_version(conn) >= LATEST_VERSION
+    finally:
+        conn.close()
 
-# Add missing columns if needed
-try:
-    cursor.execute("ALTER TABLE clients ADD COLUMN api_key TEXT")
-except sqlite3.OperationalError:
-    pass
-try:
-    cursor.execute("ALTER TABLE clients ADD COLUMN formatted_name TEXT")
-except sqlite3.OperationalError:
-    pass
-try:
-    cursor.execute("ALTER TABLE clients ADD COLUMN collection_interval INTEGER DEFAULT 10")
-except sqlite3.OperationalError:
-    pass
 
-conn.commit()
+def create_app():
+    from routes import setup_routes
+    from db_pool import init_app as init_db_pool
+    from metrics import init_app as init_metrics
+    from retention import start_retention_worker
+    from shared_state import get_state
 
-# Default owner
-cursor.execute("SELECT 1 FROM clients WHERE username = 'owner'")
-if not cursor.fetchone():
-    from auth import hash_password
-    hashed = hash_password('ownerpass')
-    cursor.execute("INSERT INTO clients (username, password, role, places) VALUES (?, ?, 'owner', 'N/A')", ('owner', hashed))
-    cursor.execute("INSERT INTO users (username, password, role) VALUES (?, ?, 'owner')", ('owner', hashed))
-    conn.commit()
-    print("✅ Default owner created in clients table")
+    if not schema_is_current():
+        if not DB_AUTO_MIGRATE:
+            raise RuntimeError("Database schema is out of date - run `python app.py --init-db`")
+        init_db()
 
-# Debug print
-cursor.execute("SELECT username, role, places, collection_interval, email_enabled FROM clients")
-clients = cursor.fetchall()
-print("=============================================================")
-print("🔍 DATABASE DEBUG")
-print(f"👥 CLIENTS ({len(clients)} total):")
-for c in clients:
-    print(f"  - {c[0]} (Role: {c[1]}, Place: {c[2]}, Interval: {c[3]}s, Alerts: {'On' if c[4] else 'Off'})")
-cursor.execute("SELECT api_key FROM clients WHERE api_key IS NOT NULL")
-keys = cursor.fetchall()
-print("🔑 API KEYS CHECK:")
-for k in keys:
-    print(f"   Key exists for client")
-cursor.execute("SELECT COUNT(*) FROM sensor_data")
-count = cursor.fetchone()[0]
-print(f"📊 SENSOR DATA: {count} records")
-print("=============================================================")
-print("Database ready!")
-conn.close()
+    app = Flask(__name__)
+    app.secret_key = os.getenv('SECRET_KEY', 'super-secret-storm-key-2025')
+    init_db_pool(app)
+    init_metrics(app)
+    setup_routes(app)
+    start_retention_worker()
+    get_state()  # listen for the other workers' cache invalidations from the start
+    return app
 
-# ====================== SETUP ROUTES ======================
-setup_routes(app)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=10000, debug=False)
+    parser = argparse.ArgumentParser(description="Run the dashboard (development server) or set up the database")
+    parser.add_argument("--init-db", action="store_true", help="apply migrations, create the owner and exit")
+    args = parser.parse_args()
+    if args.init_db:
+        init_db()
+    else:
+        create_app().run(host='0.0.0.0', port=10000, debug=False)
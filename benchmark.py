@@ -0,0 +1,309 @@
+# benchmark.py - Reproducible benchmarks for the ingestion, dashboard and export paths
+# Seeds synthetic databases of each --sizes row count (deterministic for a given
+# --seed; kept in --data-dir and reused), then measures each one in a fresh
+# process against a scratch copy, through Flask's test client:
+#
+#   ingest     save_sensor_data / save_sensor_data_batch and POST /submit-data(/batch): rows/s
+#   queries    /dashboard, /filter (place, client, date), /api/data, /latest-data: p50/p95 ms
+#   export     full and one-place CSV: seconds, MB, peak traced Python memory
+#   places     known-places registry lookup vs a DISTINCT scan of the readings
+#
+# Results go to --output as JSON; --compare prints the ratio against an older file.
+#
+#   python benchmark.py --sizes 100000,1000000
+#   python benchmark.py --sizes 100000 --compare bench_results/before.json
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+
+SEED_CHUNK = 100000
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# ------------------ seeding (runs in a child process with DB_PATH set) ------------------
+def seed(rows, places, clients, days, seed_value):
+    import random
+    import database
+    import rollups
+    from helpers import classify_readings, render_warnings
+    from storage import get_storage
+    from werkzeug.security import generate_password_hash
+
+    database.create_tables()
+    database.create_default_owner()
+    # Same rows add_client writes, with one password hash shared (hashing is deliberately slow)
+    hashed = generate_password_hash('bench')
+    names = [f"bench{c}_site_RESILIENT" for c in range(clients)]
+    conn = database.get_db_connection()
+    with conn:
+        conn.executemany("""
+            INSERT INTO clients (username, password_hash, role, places, email_enabled, email, collection_interval, api_key, formatted_name)
+            VALUES (?, ?, 'client', 'site', 1, '', 10, ?, ?)
+        """, [(f"bench{c}", hashed, f"bench-key-{c}", name) for c, name in enumerate(names)])
+
+    rng = random.Random(seed_value)
+    end = int(time.time()) // 86400 * 86400
+    start = end - days * 86400
+    step = days * 86400 / rows
+    storage = get_storage()
+    for offset in range(0, rows, SEED_CHUNK):
+        count = min(SEED_CHUNK, rows - offset)
+        temperatures = [round(rng.gauss(21.5, 3), 1) for _ in range(count)]
+        humidities = [round(rng.gauss(50, 8), 1) for _ in range(count)]
+        warnings = render_warnings(classify_readings(temperatures, humidities), temperatures, humidities)
+        batch = []
+        for i in range(count):
+            n = offset + i
+            p = n % places
+            ts = int(start + n * step)
+            place = f"room{p}"
+            batch.append((f"{names[p % clients]}_{place}", place, temperatures[i], humidities[i], warnings[i],
+                          database._utc_stamp(ts)[0], ts))
+        with conn:
+            storage.insert(conn, batch)
+        print(f"  seeded {offset + count}/{rows}", file=sys.stderr)
+    with conn:
+        rollups.rebuild_rollups(conn)
+        conn.executemany("INSERT OR IGNORE INTO known_places (place) VALUES (?)", [(f"room{p}",) for p in range(places)])
+        conn.execute("INSERT OR IGNORE INTO known_client_places (client_place) SELECT DISTINCT client_place FROM sensor_rollup_1d")
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+
+# ------------------ measurements (child process, scratch copy of a seeded DB) ------------------
+def _timings(samples):
+    samples = sorted(samples)
+    pick = lambda p: samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+    return {'n': len(samples), 'p50_ms': round(pick(50) * 1000, 3), 'p95_ms': round(pick(95) * 1000, 3),
+            'mean_ms': round(sum(samples) / len(samples) * 1000, 3)}
+
+
+def _repeat(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return _timings(samples)
+
+
+def _get_ok(client, url, **kwargs):
+    response = client.get(url, **kwargs)
+    assert response.status_code == 200, (url, response.status_code)
+    response.get_data()
+
+
+def _consume_export(client, url):
+    """Stream one export to nowhere; returns bytes read"""
+    response = client.get(url, buffered=False)
+    assert response.status_code == 200, (url, response.status_code)
+    size = sum(len(chunk) for chunk in response.response)
+    response.close()
+    return size
+
+
+def measure(places, clients, repeat, ingest_rows):
+    import random
+    import tracemalloc
+    from app import create_app
+    from storage import get_storage
+    import database
+
+    client = create_app().test_client()
+    with client.session_transaction() as session:
+        session['username'], session['role'] = 'owner', 'owner'
+    results = {}
+    rng = random.Random(1)
+    day_before = time.strftime("%Y-%m-%d", time.gmtime(time.time() - 86400))
+
+    # Places
+    results['known_places'] = _repeat(database.get_known_places, repeat)
+    conn = database.get_db_connection()
+    # What known_places replaces: a scan of every storage table (UNION de-duplicates across partitions)
+    scan = " UNION ".join(f"SELECT place FROM {table}" for table in get_storage().tables(conn))
+    results['distinct_places_scan'] = _repeat(lambda: conn.execute(scan).fetchall(), 1)
+    conn.close()
+
+    # Dashboard / queries (no If-None-Match, so nothing is answered with 304)
+    results['dashboard'] = _repeat(lambda: _get_ok(client, '/dashboard'), repeat)
+    results['filter_place'] = _repeat(lambda: client.post('/filter', data={'place': f"room{rng.randrange(places)}"}).get_data(), repeat)
+    results['filter_client'] = _repeat(lambda: client.post('/filter', data={'client': f"bench{rng.randrange(clients)}_"}).get_data(), repeat)
+    results['filter_last_day'] = _repeat(lambda: client.post('/filter', data={'start_date': day_before, 'end_date': day_before}).get_data(), repeat)
+    results['api_data_page'] = _repeat(lambda: _get_ok(client, f'/api/data?place=room{rng.randrange(places)}&limit=200'), repeat)
+    results['latest_data_cold'] = _repeat(lambda: _get_ok(client, '/latest-data'), 1)
+    results['latest_data_warm'] = _repeat(lambda: _get_ok(client, '/latest-data'), repeat)
+
+    # Export: timed without tracing, then once more under tracemalloc for peak memory
+    for name, url in (('export_csv_all', '/download-csv'), ('export_csv_place', '/download-csv?place=room0')):
+        started = time.perf_counter()
+        size = _consume_export(client, url)
+        seconds = time.perf_counter() - started
+        tracemalloc.start()
+        _consume_export(client, url)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = {'seconds': round(seconds, 3), 'mb': round(size / 1e6, 2),
+                         'mb_per_s': round(size / 1e6 / seconds, 2), 'peak_traced_mb': round(peak / 1e6, 2)}
+
+    # Ingest (last: it adds rows to the scratch copy)
+    def rate(fn, rows):
+        started = time.perf_counter()
+        fn()
+        return round(rows / (time.perf_counter() - started), 1)
+
+    def reading(i):
+        return (f"bench{i % clients}_site_RESILIENT_room{i % places}", f"room{i % places}",
+                round(rng.gauss(21.5, 3), 1), round(rng.gauss(50, 8), 1), '')
+
+    def save_singles():
+        for i in range(ingest_rows):
+            database.save_sensor_data(*reading(i))
+
+    def save_batches():
+        for offset in range(0, ingest_rows, 500):
+            database.save_sensor_data_batch([reading(i) for i in range(offset, min(offset + 500, ingest_rows))])
+
+    samples = []
+
+    def post_singles():
+        for i in range(ingest_rows):
+            started = time.perf_counter()
+            response = client.post('/submit-data', headers={'X-API-Key': f"bench-key-{i % clients}"},
+                                   json={'place': f"room{i % places}", 'temperature': 21.0, 'humidity': 50.0})
+            samples.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.get_data()
+
+    def post_batches():
+        for offset in range(0, ingest_rows, 500):
+            batch = [{'place': f"room{i % places}", 'temperature': 21.0, 'humidity': 50.0}
+                     for i in range(offset, min(offset + 500, ingest_rows))]
+            response = client.post('/submit-data/batch', headers={'X-API-Key': 'bench-key-0'}, json={'readings': batch})
+            assert response.status_code == 200, response.get_data()
+
+    results['ingest_save_single_rows_per_s'] = rate(save_singles, ingest_rows)
+    results['ingest_save_batch_rows_per_s'] = rate(save_batches, ingest_rows)
+    results['ingest_http_single_rows_per_s'] = rate(post_singles, ingest_rows)
+    results['ingest_http_single'] = _timings(samples)
+    results['ingest_http_batch_rows_per_s'] = rate(post_batches, ingest_rows)
+    return results
+
+
+# ------------------ driver ------------------
+def _child(args, command, db_path, extra):
+    # Everything a run writes next to the DB goes with it in _remove_db
+    env = dict(os.environ, DB_PATH=db_path, EXPORT_CACHE_DIR=db_path + '.export_cache',
+               ARCHIVE_DIR=db_path + '.archive', RETENTION_RAW_DAYS='0',
+               RETENTION_ROLLUP_1M_DAYS='0', WRITE_BEHIND_ENABLED='0')
+    subprocess.run([sys.executable, os.path.abspath(__file__), '--child', command, '--db', db_path, *extra],
+                   env=env, cwd=HERE, check=True, stdout=subprocess.DEVNULL if args.quiet else None)
+
+
+def _remove_db(path):
+    """The DB and everything derived from it: WAL, version counters, shared state, export cache, archives"""
+    for suffix in ('', '-wal', '-shm', '.versions', '.state', '.state-wal', '.state-shm', '.init.lock'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    for suffix in ('.export_cache', '.archive'):
+        shutil.rmtree(path + suffix, ignore_errors=True)
+
+
+def run(args):
+    from config import STORAGE_BACKEND
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    report = {
+        'started': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        'commit': subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True, text=True).stdout.strip(),
+        'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version, 'platform': platform.platform(),
+        'storage_backend': STORAGE_BACKEND,
+        'params': {k: getattr(args, k) for k in ('places', 'clients', 'days', 'seed', 'repeat', 'ingest_rows')},
+        'results': {},
+    }
+    shape = ['--places', str(args.places), '--clients', str(args.clients)]
+    for size in args.sizes:
+        seeded = os.path.join(args.data_dir, f"seed_{STORAGE_BACKEND}_{size}_{args.places}p_{args.clients}c_{args.days}d_s{args.seed}.db")
+        if args.reseed or not os.path.exists(seeded):
+            print(f"🌱 seeding {size} readings -> {seeded}")
+            _remove_db(seeded)
+            started = time.perf_counter()
+            _child(args, 'seed', seeded, [str(size), *shape, '--days', str(args.days), '--seed', str(args.seed)])
+            print(f"   {time.perf_counter() - started:.1f}s")
+        scratch = os.path.join(args.data_dir, 'scratch.db')
+        _remove_db(scratch)
+        shutil.copyfile(seeded, scratch)
+        out = os.path.join(args.data_dir, 'result.json')
+        print(f"⏱️  measuring {size} readings")
+        _child(args, 'measure', scratch, [out, *shape, '--repeat', str(args.repeat), '--ingest-rows', str(args.ingest_rows)])
+        with open(out) as f:
+            report['results'][str(size)] = json.load(f)
+        _remove_db(scratch)
+        os.remove(out)
+
+    output = args.output or os.path.join('bench_results', f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ results written to {output}")
+    summarize(report, _load(args.compare) if args.compare else None)
+
+
+def _load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _headline(value):
+    """The single number reported for a metric (p50 for timings)"""
+    if isinstance(value, dict):
+        return value.get('p50_ms', value.get('seconds'))
+    return value
+
+
+def summarize(report, baseline=None):
+    for size, results in report['results'].items():
+        print(f"\n{size} readings")
+        for name, value in results.items():
+            line = f"  {name:32} {_headline(value):>12}"
+            if isinstance(value, dict) and 'peak_traced_mb' in value:
+                line += f"  ({value['mb']} MB, peak {value['peak_traced_mb']} MB)"
+            old = baseline and baseline['results'].get(size, {}).get(name)
+            if old is not None and _headline(old):
+                line += f"   x{_headline(value) / _headline(old):.2f} vs baseline"
+            print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, dashboard queries and exports")
+    parser.add_argument("--sizes", default="100000,1000000,10000000", help="comma-separated row counts")
+    parser.add_argument("--places", type=int, default=500, help="distinct places in the seeded data")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--days", type=int, default=90, help="seeded readings span this many days up to today")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=20, help="samples per query benchmark")
+    parser.add_argument("--ingest-rows", type=int, default=2000, help="rows per ingest benchmark")
+    parser.add_argument("--data-dir", default="bench_data", help="seeded databases are kept here")
+    parser.add_argument("--reseed", action="store_true", help="rebuild seeded databases even if present")
+    parser.add_argument("--output", help="results file (default bench_results/bench_<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--quiet", action="store_true", help="hide the app's own output")
+    parser.add_argument("--child", choices=("seed", "measure"), help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    parser.add_argument("child_args", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child == 'seed':
+        seed(int(args.child_args[0]), args.places, args.clients, args.days, args.seed)
+    elif args.child == 'measure':
+        with open(args.child_args[0], 'w') as f:
+            json.dump(measure(args.places, args.clients, args.repeat, args.ingest_rows), f)
+    else:
+        args.sizes = [int(float(s)) for s in args.sizes.split(',')]
+        args.data_dir = os.path.abspath(args.data_dir)
+        run(args)
@@ -5,10 +5,109 @@ from zoneinfo import ZoneInfo
 # Configuration with environment variables for security
 TEMP_RANGE = (18, 25)
 HUM_RANGE = (40, 60)
-SMTP_SERVER = "smtp.gmail.com"
-SMTP_PORT = 587
+SMTP_SERVER = os.environ.get('SMTP_SERVER', "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get('SMTP_PORT', 587))
+SMTP_USE_TLS = os.environ.get('SMTP_USE_TLS', '1') == '1'  # set 0 for the local fake_smtp.py sink
 EMAIL_SENDER = os.environ.get('EMAIL_SENDER', '')
 EMAIL_PASSWORD = os.environ.get('EMAIL_PASSWORD', '')
 UK_TZ = ZoneInfo("Europe/London")
-DB_PATH = "sensor_data.db"
-SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-key-change-in-production')
\ No newline at end of file
+DB_PATH = os.environ.get('DB_PATH', "sensor_data.db")
+SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-key-change-in-production')
+DB_AUTO_MIGRATE = os.environ.get('DB_AUTO_MIGRATE', '1') == '1'  # 0: workers refuse to start on an old schema (run app.py --init-db)
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 1000))
+
+# Write-behind ingestion (off by default: readings are committed inside the request).
+# On, /submit-data answers before the reading is committed: a clean shutdown flushes the
+# queue, but a killed or crashed worker loses up to WRITE_BEHIND_MAX_DELAY seconds of
+# queued readings (at most WRITE_BEHIND_QUEUE_SIZE) - sensors don't resend acknowledged ones
+WRITE_BEHIND_ENABLED = os.environ.get('WRITE_BEHIND_ENABLED', '0') == '1'
+WRITE_BEHIND_MAX_ROWS = int(os.environ.get('WRITE_BEHIND_MAX_ROWS', 500))
+WRITE_BEHIND_MAX_DELAY = float(os.environ.get('WRITE_BEHIND_MAX_DELAY', 0.5))  # seconds
+WRITE_BEHIND_QUEUE_SIZE = int(os.environ.get('WRITE_BEHIND_QUEUE_SIZE', 10000))
+
+# SQLite connection manager: 'thread' (one connection per thread), 'pool' (shared pool) or 'none'
+DB_POOL_MODE = os.environ.get('DB_POOL_MODE', 'thread')
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+DB_BUSY_TIMEOUT = float(os.environ.get('DB_BUSY_TIMEOUT', 5.0))  # seconds
+DB_CACHE_SIZE_KB = int(os.environ.get('DB_CACHE_SIZE_KB', 16384))
+DB_MMAP_SIZE = int(os.environ.get('DB_MMAP_SIZE', 256 * 1024 * 1024))
+DATA_VERSION_FILE = os.environ.get('DATA_VERSION_FILE', DB_PATH + '.versions')  # shared per-place change counters (ETags)
+
+# Reading storage: 'single' (everything in sensor_data) or 'partitioned' (one table per UTC day, see storage.py)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'single')
+
+# /latest-data last-value cache: also re-read from the DB this often (seconds); 0 = only after history rewrites
+LATEST_CACHE_RESYNC = float(os.environ.get('LATEST_CACHE_RESYNC', 0))
+
+# /stream live feed (Server-Sent Events)
+SSE_QUEUE_SIZE = int(os.environ.get('SSE_QUEUE_SIZE', 200))  # frames buffered per tab before it must resync
+SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT', 15))  # seconds between keep-alive comments
+SSE_MAX_DURATION = float(os.environ.get('SSE_MAX_DURATION', 300))  # seconds before a stream ends and the browser reconnects
+# Each open stream holds one worker thread, so streams get at most WEB_THREADS - SSE_RESERVED_THREADS per worker
+# and ingestion / page loads always have threads left; beyond the cap dashboards poll
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))  # gunicorn --threads per worker (render.yaml passes the same value)
+SSE_RESERVED_THREADS = int(os.environ.get('SSE_RESERVED_THREADS', 4))
+SSE_MAX_SUBSCRIBERS = min(int(os.environ.get('SSE_MAX_SUBSCRIBERS', 50)), max(WEB_THREADS - SSE_RESERVED_THREADS, 0))
+
+# Simulators (simulation_generator.py scripts, fleet.py): where the server listens
+SIMULATOR_SERVER_URL = os.environ.get('SIMULATOR_SERVER_URL', 'http://127.0.0.1:10000')
+
+# Instrumentation: /metrics (Prometheus text) and the opt-in slow-request profiler
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')  # if set, /metrics needs "Authorization: Bearer <token>"
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))  # share of requests run under cProfile; 0 = off
+PROFILE_SLOW_SECONDS = float(os.environ.get('PROFILE_SLOW_SECONDS', 1.0))  # sampled requests at least this slow are dumped
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+
+# Streaming anomaly detection on ingest (anomaly.py), on top of the fixed ranges
+ANOMALY_ENABLED = os.environ.get('ANOMALY_ENABLED', '1') == '1'
+ANOMALY_ALPHA = float(os.environ.get('ANOMALY_ALPHA', 0.1))  # EWMA weight of the newest reading
+ANOMALY_Z_SCORE = float(os.environ.get('ANOMALY_Z_SCORE', 4.0))  # spike threshold in standard deviations
+ANOMALY_WARMUP = int(os.environ.get('ANOMALY_WARMUP', 20))  # readings per sensor before spikes are flagged
+ANOMALY_MIN_STD = float(os.environ.get('ANOMALY_MIN_STD', 0.5))  # floor so near-constant sensors don't flag noise
+ANOMALY_TEMP_RATE = float(os.environ.get('ANOMALY_TEMP_RATE', 8.0))  # °C per minute
+ANOMALY_HUM_RATE = float(os.environ.get('ANOMALY_HUM_RATE', 25.0))  # % per minute
+ANOMALY_FLATLINE = int(os.environ.get('ANOMALY_FLATLINE', 30))  # identical readings in a row; 0 = off
+ANOMALY_MAX_SENSORS = int(os.environ.get('ANOMALY_MAX_SENSORS', 100000))  # per worker
+
+# API key -> client record cache used by the ingestion endpoints
+API_KEY_CACHE_TTL = float(os.environ.get('API_KEY_CACHE_TTL', 300))  # seconds
+API_KEY_NEGATIVE_TTL = float(os.environ.get('API_KEY_NEGATIVE_TTL', 30))  # seconds, for rejected keys
+API_KEY_CACHE_MAX = int(os.environ.get('API_KEY_CACHE_MAX', 50000))
+
+# Background alert delivery (email_service.AlertDispatcher)
+ALERT_QUEUE_SIZE = int(os.environ.get('ALERT_QUEUE_SIZE', 1000))
+ALERT_MAX_RETRIES = int(os.environ.get('ALERT_MAX_RETRIES', 5))
+ALERT_RETRY_BACKOFF = float(os.environ.get('ALERT_RETRY_BACKOFF', 1.0))  # seconds, doubled per retry
+SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', 10))
+SMTP_IDLE_CHECK = float(os.environ.get('SMTP_IDLE_CHECK', 60))  # NOOP a session idle longer than this
+
+# Alert state machine: first warning emails at once, repeats are folded into a digest
+ALERT_DIGEST_COOLDOWN = float(os.environ.get('ALERT_DIGEST_COOLDOWN', 900))  # seconds between emails per sensor
+
+# Exports (/download-csv, /export)
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 2000))  # rows per fetchmany() in exports
+EXPORT_PARQUET_ROW_GROUP = int(os.environ.get('EXPORT_PARQUET_ROW_GROUP', 100000))
+EXPORT_CACHE_DIR = os.environ.get('EXPORT_CACHE_DIR', 'export_cache')  # exports of closed date ranges
+
+# Retention (off while RETENTION_RAW_DAYS = 0): 'archive' moves old readings to ARCHIVE_DIR/sensor_data_YYYYMM.db,
+# 'rollup' deletes them and relies on the rollup tables
+RETENTION_RAW_DAYS = int(os.environ.get('RETENTION_RAW_DAYS', 0))
+RETENTION_MODE = os.environ.get('RETENTION_MODE', 'archive')
+RETENTION_ROLLUP_1M_DAYS = int(os.environ.get('RETENTION_ROLLUP_1M_DAYS', 0))  # 0 keeps 1-minute buckets forever
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 2000))
+RETENTION_PAUSE = float(os.environ.get('RETENTION_PAUSE', 0.05))  # seconds between batches
+RETENTION_INTERVAL = float(os.environ.get('RETENTION_INTERVAL', 3600))  # seconds between sweeps
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'archive')
+
+# Shared state between worker processes (shared_state.py): 'local' (per process),
+# 'sqlite' (a file shared by the workers on this host) or 'redis' (any Redis-protocol server).
+# A single worker needs nothing shared, so 'sqlite' is only the default when gunicorn runs
+# several workers - set their number with WEB_CONCURRENCY (gunicorn reads it too), not -w
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+SHARED_STATE_BACKEND = os.environ.get('SHARED_STATE_BACKEND', 'sqlite' if WEB_CONCURRENCY > 1 else 'local')
+SHARED_STATE_PATH = os.environ.get('SHARED_STATE_PATH', DB_PATH + '.state')
+SHARED_STATE_URL = os.environ.get('SHARED_STATE_URL', 'redis://127.0.0.1:6379/0')
+SHARED_STATE_PREFIX = os.environ.get('SHARED_STATE_PREFIX', 'sensor:')  # namespaces keys on a shared Redis
+SHARED_STATE_POLL = float(os.environ.get('SHARED_STATE_POLL', 0.05))  # seconds between sqlite message checks
+SHARED_STATE_MESSAGE_TTL = float(os.environ.get('SHARED_STATE_MESSAGE_TTL', 60))  # seconds sqlite keeps messages
@@ -0,0 +1,125 @@
+# data_versions.py - Per-place data-version counters for ETag / Last-Modified
+# The ingestion path bumps the counters of every place (and client_place) it
+# wrote after each commit; the dashboard, data and export endpoints turn the
+# counter into an ETag and answer If-None-Match with 304 before any query runs.
+#
+# Counters live in a small memory-mapped file (DATA_VERSION_FILE) so every
+# gunicorn worker on the host sees every other worker's bumps; reading one is a
+# memory read, not a syscall or SQL. Places hash into a fixed number of slots -
+# a collision only costs a spurious 200, never a wrong 304. The file header holds
+# a random generation id, so counters restarting from zero (file deleted) can't
+# collide with ETags handed out before. A few low slots are reserved for named
+# signals between workers (touch / counter) and never shared with a place.
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from config import DATA_VERSION_FILE
+
+SLOTS = 4096
+_HEADER = struct.Struct('<8sQ')  # magic, generation
+_SLOT = struct.Struct('<QQ')     # version, last modified (epoch seconds)
+_MAGIC = b'SDVERS02'  # v2 moved the place slots up; an older file is re-created with a new generation
+ANY_SLOT = 0    # bumped by every change (unfiltered views)
+RESET_SLOT = 1  # bumped when history is rewritten everywhere (retention, backfills)
+# Named cross-worker signals for touch() / counter(): reserved slots no place hashes into,
+# so a signal never spoils a place's ETag and a place never fires a signal
+SIGNAL_SLOTS = {
+    'thresholds': 2,     # threshold profiles or the client list changed
+    'shared_state': 3,   # a message was published to the sqlite shared state backend
+}
+_FIRST_PLACE_SLOT = 16
+_SIZE = _HEADER.size + SLOTS * _SLOT.size
+
+_map = None
+_fd = None
+_pid = None
+_generation = None
+_lock = threading.Lock()
+
+
+def _open():
+    """Map the counter file, creating it on first use; reopened after fork"""
+    global _map, _fd, _pid, _generation
+    if _map is not None and _pid == os.getpid():
+        return _map
+    with _lock:
+        if _map is not None and _pid == os.getpid():
+            return _map
+        fd = os.open(DATA_VERSION_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            magic = os.pread(fd, 8, 0)
+            if magic != _MAGIC or os.fstat(fd).st_size != _SIZE:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, _SIZE)
+                os.pwrite(fd, _HEADER.pack(_MAGIC, int.from_bytes(os.urandom(8), 'little')), 0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        _map = mmap.mmap(fd, _SIZE)
+        _fd, _pid = fd, os.getpid()
+        _generation = _HEADER.unpack_from(_map, 0)[1]
+        return _map
+
+
+def _slot(place):
+    return _FIRST_PLACE_SLOT + zlib.crc32(place.encode('utf-8')) % (SLOTS - _FIRST_PLACE_SLOT)
+
+
+def _offset(slot):
+    return _HEADER.size + slot * _SLOT.size
+
+
+def _bump_slots(slots):
+    data = _open()
+    now = int(time.time())
+    # flock serialises the read-modify-write across worker processes
+    fcntl.flock(_fd, fcntl.LOCK_EX)
+    try:
+        for slot in slots:
+            version, _ = _SLOT.unpack_from(data, _offset(slot))
+            _SLOT.pack_into(data, _offset(slot), version + 1, now)
+    finally:
+        fcntl.flock(_fd, fcntl.LOCK_UN)
+
+
+def bump(places):
+    """Record that readings for these places / client_places changed"""
+    _bump_slots({ANY_SLOT} | {_slot(p) for p in places if p})
+
+
+def bump_all():
+    """Record a change that may touch every place (rows archived, deleted or re-classified)"""
+    _bump_slots((ANY_SLOT, RESET_SLOT))
+
+
+def get_version(place=None):
+    """(version token, last modified epoch) for one place / client_place, or for everything"""
+    data = _open()
+    slot = _slot(place) if place and place != 'All' else ANY_SLOT
+    version, modified = _SLOT.unpack_from(data, _offset(slot))
+    resets, reset_at = _SLOT.unpack_from(data, _offset(RESET_SLOT))
+    return f"{_generation:x}-{resets}-{version}", max(modified, reset_at)
+
+
+def reset_count():
+    """Number of bump_all() calls on this host - history was rewritten, caches should re-read"""
+    return _SLOT.unpack_from(_open(), _offset(RESET_SLOT))[0]
+
+
+def change_count():
+    """Total number of bumps on this host - lets in-process caches notice other workers' writes"""
+    return _SLOT.unpack_from(_open(), _offset(ANY_SLOT))[0]
+
+
+def touch(name):
+    """Bump one SIGNAL_SLOTS counter without marking any data changed"""
+    _bump_slots((SIGNAL_SLOTS[name],))
+
+
+def counter(name):
+    """Current value of a SIGNAL_SLOTS counter - compare with an earlier read"""
+    return _SLOT.unpack_from(_open(), _offset(SIGNAL_SLOTS[name]))[0]
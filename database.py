@@ -6,80 +6,34 @@
 
 import sqlite3
 from werkzeug.security import generate_password_hash, check_password_hash
-from config import DB_PATH  # If you have config; otherwise ignore
-from datetime import datetime
+from config import DB_PATH, EXPORT_CHUNK_SIZE  # If you have config; otherwise ignore
+from db_pool import get_connection
+import api_key_cache
+import latest_values
+import data_versions
+import thresholds
+from live_feed import get_broker
+from rollups import update_rollups
+from storage import get_storage, query_tables
+import metrics
+from datetime import datetime, timezone
 import os
+import time
 
 def get_db_connection():
-    """Get database connection"""
-    conn = sqlite3.connect('sensor_data.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Get database connection (shared per request, reused per thread/pool - see db_pool.py)"""
+    return get_connection()
 
 def migrate_db():
-    """Safely add new columns if they don't exist"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("ALTER TABLE clients ADD COLUMN api_key TEXT")
-        print("Added column: api_key")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" not in str(e):
-            print(f"Migration warning (api_key): {e}")
-    
-    try:
-        cursor.execute("ALTER TABLE clients ADD COLUMN formatted_name TEXT")
-        print("Added column: formatted_name")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" not in str(e):
-            print(f"Migration warning (formatted_name): {e}")
-    
-    conn.commit()
-    conn.close()
-    print("Migration complete")
+    """Apply pending schema migrations (see migrations.py)"""
+    from migrations import migrate
+    version = migrate()
+    print(f"Migration complete (schema version {version})")
 
 def create_tables():
-    """Create tables if not exist"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS clients (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            role TEXT DEFAULT 'client',
-            places TEXT,
-            email_enabled INTEGER DEFAULT 1,
-            email TEXT,
-            phone TEXT,
-            address TEXT,
-            collection_interval INTEGER DEFAULT 10,
-            api_key TEXT UNIQUE,
-            formatted_name TEXT
-        )
-    """)
-    
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS sensor_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            place TEXT,
-            client_place TEXT,
-            temperature REAL,
-            humidity REAL,
-            warning TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS known_places (
-            place TEXT PRIMARY KEY
-        )
-    """)
-    
-    conn.commit()
-    conn.close()
+    """Create tables if not exist - the base schema is migration 1"""
+    from migrations import migrate
+    migrate()
     print("✅ Tables created/verified")
 
 def create_default_owner():
@@ -114,6 +68,8 @@ def add_client(username, password, place, email, phone, address, collection_inte
             VALUES (?, ?, 'client', ?, 1, ?, ?, ?, ?, ?, ?)
         """, (username, hashed, place, email, phone, address, collection_interval, api_key, formatted_name))
         conn.commit()
+        api_key_cache.invalidate()  # the key may be negatively cached
+        thresholds.invalidate()
         return True
     except Exception as e:
         print(f"❌ Add client error: {e}")
@@ -128,6 +84,15 @@ def get_user_by_username(username):
     conn.close()
     return dict(row) if row else None
 
+def get_client_by_api_key(api_key):
+    """Client record used by the ingestion endpoints (cached in api_key_cache)"""
+    conn = get_db_connection()
+    row = conn.execute(
+        "SELECT username, formatted_name, email, email_enabled FROM clients WHERE api_key = ?", (api_key,)
+    ).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
 def update_client_password(username, new_password):
     """Update client password"""
     conn = get_db_connection()
@@ -152,6 +117,7 @@ def update_user_email_enabled(username, enabled):
     conn.execute("UPDATE clients SET email_enabled = ? WHERE username = ?", (enabled, username))
     conn.commit()
     conn.close()
+    api_key_cache.invalidate(username)
 
 def get_all_clients():
     """Get all clients for manage page"""
@@ -166,16 +132,165 @@ def delete_client(username):
     conn.execute("DELETE FROM clients WHERE username = ?", (username,))
     conn.commit()
     conn.close()
+    api_key_cache.invalidate(username)
+    thresholds.invalidate()
+
+# Places / client_places this process has already written to known_places /
+# known_client_places - seen ones cost no SQL
+_known_places = set()
+_known_client_places = set()
+
+def _register_places(conn, places, client_places):
+    """Upsert places and client_places not seen before inside the caller's transaction.
+
+    Returns both sets of new names; add them to the _known sets only once the caller has committed.
+    """
+    new_places = {p for p in places if p and p not in _known_places}
+    if new_places:
+        conn.executemany("INSERT OR IGNORE INTO known_places (place) VALUES (?)", [(p,) for p in new_places])
+    new_client_places = {cp for cp in client_places if cp and cp not in _known_client_places}
+    if new_client_places:
+        conn.executemany("INSERT OR IGNORE INTO known_client_places (client_place) VALUES (?)",
+                         [(cp,) for cp in new_client_places])
+    return new_places, new_client_places
+
+def _remember_places(new):
+    _known_places.update(new[0])
+    _known_client_places.update(new[1])
+
+def _utc_stamp(ts=None):
+    """(display timestamp, epoch seconds) for a reading received at ts (default now)"""
+    ts = int(ts if ts is not None else time.time())
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d %H:%M:%S"), ts
 
 def save_sensor_data(client_place, place, temperature, humidity, warning):
     """Save sensor reading"""
+    timestamp, ts = _utc_stamp()
     conn = get_db_connection()
-    conn.execute("""
-        INSERT INTO sensor_data (client_place, place, temperature, humidity, warning)
-        VALUES (?, ?, ?, ?, ?)
-    """, (client_place, place, temperature, humidity, warning))
+    get_storage().insert(conn, [(client_place, place, temperature, humidity, warning, timestamp, ts)])
+    update_rollups(conn, [(client_place, place, temperature, humidity, warning, ts)])
+    new_places = _register_places(conn, [place], [client_place])
     conn.commit()
     conn.close()
+    _remember_places(new_places)
+    metrics.inc('sensor_ingested_rows_total')
+    row = (client_place, place, temperature, humidity, warning, timestamp, ts)
+    latest_values.record([row])
+    data_versions.bump([place, client_place])
+    get_broker().publish([row])
+
+def save_sensor_data_batch(readings):
+    """Save many sensor readings in a single transaction.
+
+    readings: list of (client_place, place, temperature, humidity, warning[, ts]) tuples;
+    ts is the epoch second the reading was received, defaulting to now
+    """
+    if not readings:
+        return 0
+    now = int(time.time())
+    rows = []
+    for reading in readings:
+        timestamp, ts = _utc_stamp(reading[5] if len(reading) > 5 else now)
+        rows.append((*reading[:5], timestamp, ts))
+    conn = get_db_connection()
+    try:
+        with conn:
+            get_storage().insert(conn, rows)
+            update_rollups(conn, [(cp, place, t, h, w, ts) for cp, place, t, h, w, _, ts in rows])
+            new_places = _register_places(conn, [row[1] for row in rows], [row[0] for row in rows])
+    finally:
+        conn.close()
+    _remember_places(new_places)
+    metrics.inc('sensor_ingested_rows_total', len(rows))
+    latest_values.record(rows)
+    data_versions.bump({row[0] for row in rows} | {row[1] for row in rows})
+    get_broker().publish(rows)
+    return len(rows)
+
+def get_known_places():
+    """Places for the dashboard filter dropdown, read from the known_places registry"""
+    conn = get_db_connection()
+    places = [row[0] for row in conn.execute("SELECT place FROM known_places ORDER BY place").fetchall()]
+    conn.close()
+    return places
+
+def sensor_data_filters(place=None):
+    """Filter clauses and params for the place dropdown; time ranges are handled by storage"""
+    if place and place != 'All':
+        return ["place = ?"], [place]
+    return [], []
+
+PAGE_COLUMNS = ["id", "ts", "timestamp", "client_place", "place", "temperature", "humidity", "warning"]
+
+def _like_pattern(text):
+    """LIKE pattern matching text anywhere; % and _ in text match literally (ESCAPE '\\')"""
+    return "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+def encode_page_cursor(ts, row_id):
+    return f"{ts}.{row_id}"
+
+def decode_page_cursor(cursor):
+    """(ts, id) of the last row on the previous page; ValueError if malformed"""
+    ts, row_id = cursor.split(".")
+    return int(ts), int(row_id)
+
+def get_sensor_page(place=None, client=None, place_contains=None, start_ts=None, end_ts=None, cursor=None, limit=200):
+    """One page of readings newest first, keyset-paginated on (ts, id).
+
+    client / place_contains are case-insensitive substring filters on client_place / place.
+    cursor is the value returned with the previous page; returns (rows as lists in
+    PAGE_COLUMNS order, next cursor or None). Cost is O(limit) however deep the page is.
+    Pages carry on into archived months (retention.py) once the live tables run out.
+    """
+    from retention import archived_months, open_history_connection
+
+    filters, params = sensor_data_filters(place)
+    if client:
+        filters.append("client_place LIKE ? ESCAPE '\\'")
+        params.append(_like_pattern(client))
+    if place_contains:
+        filters.append("place LIKE ? ESCAPE '\\'")
+        params.append(_like_pattern(place_contains))
+    if cursor:
+        after_ts, after_id = decode_page_cursor(cursor)
+        # Written as a ts range plus tie-break so the ts indexes still drive the scan
+        filters.append("ts <= ? AND (ts < ? OR id < ?)")
+        params.extend([after_ts, after_ts, after_id])
+        # Partitions newer than the cursor can be skipped entirely
+        end_ts = after_ts + 1 if end_ts is None else min(end_ts, after_ts + 1)
+    conn = get_db_connection()
+    rows = get_storage().query(conn, ", ".join(PAGE_COLUMNS), filters, params, start_ts, end_ts, limit=limit + 1)
+    conn.close()
+    # Archives hold the oldest readings, so they are only attached when the live tables fell short
+    if len(rows) <= limit and archived_months(start_ts, end_ts):
+        conn, archive_tables = open_history_connection(start_ts, end_ts)
+        try:
+            rows += query_tables(conn, archive_tables, ", ".join(PAGE_COLUMNS), filters, params,
+                                 start_ts, end_ts, limit=limit + 1 - len(rows))
+        finally:
+            conn.close()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_page_cursor(rows[-1]['ts'], rows[-1]['id'])
+    return [list(row) for row in rows], next_cursor
+
+def iter_sensor_data(place=None, start_ts=None, end_ts=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield export rows newest first, chunk_size at a time, without loading the table.
+
+    Uses its own connection so a long download never holds the request's one;
+    only the storage tables covering the range are read, then any archived months.
+    """
+    from retention import open_history_connection
+
+    filters, params = sensor_data_filters(place)
+    conn, archive_tables = open_history_connection(start_ts, end_ts)
+    try:
+        yield from get_storage().iter(
+            conn, "timestamp, client_place, place, temperature, humidity, warning",
+            filters, params, start_ts, end_ts, chunk_size=chunk_size, extra_tables=archive_tables)
+    finally:
+        conn.close()
 
 def debug_database():
     """Print DB state for debugging"""
@@ -194,7 +309,8 @@ def debug_database():
             api = conn.execute("SELECT api_key FROM clients WHERE username = ?", (client['username'],)).fetchone()
             print(f"  - {client['username']}: {'HAS_KEY' if api and api['api_key'] else 'NO_KEY'}")
     
-    sensor_count = conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0]
+    sensor_count = sum(conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                       for table in get_storage().tables(conn))
     print(f"\n📊 SENSOR DATA: {sensor_count} records")
     
     conn.close()
@@ -0,0 +1,209 @@
+# db_pool.py - Reusable, tuned SQLite connections
+# Every connection is opened with WAL, synchronous=NORMAL, a larger page cache,
+# mmap and a busy timeout. Inside a Flask app context all helpers share one
+# connection per request; it is released in teardown_appcontext.
+#
+# Modes (config.DB_POOL_MODE):
+#   thread - one long-lived connection per thread (default, fits gunicorn sync/gthread)
+#   pool   - a bounded pool shared by all threads of the worker
+#   none   - a fresh connection per call, closed by close() (old behaviour)
+#
+# With METRICS_ENABLED every execute is timed and reported to metrics.py.
+import os
+import queue
+import sqlite3
+import threading
+import time
+from config import (
+    DB_PATH,
+    DB_POOL_MODE,
+    DB_POOL_SIZE,
+    DB_BUSY_TIMEOUT,
+    DB_CACHE_SIZE_KB,
+    DB_MMAP_SIZE,
+    METRICS_ENABLED
+)
+import metrics
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() hands it back instead of closing it"""
+
+    _release = None   # callable that returns the connection to its owner
+    _held = False     # True while owned by a Flask app context
+    _pid = None       # process that opened it (never reuse across fork)
+
+    def close(self):
+        if self._held:
+            return
+        if self._release is not None:
+            self._release(self)
+            return
+        super().close()
+
+    def really_close(self):
+        sqlite3.Connection.close(self)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor whose statements are counted and timed (for conn.cursor() callers)"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.record_sql(time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.record_sql(time.perf_counter() - started)
+
+
+class TimedConnection(PooledConnection):
+    """PooledConnection that reports each statement to metrics.record_sql
+
+    Times the execute call itself (for a SELECT: preparing and stepping to the
+    first row); rows fetched afterwards are not included.
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.record_sql(time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.record_sql(time.perf_counter() - started)
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            metrics.record_sql(time.perf_counter() - started)
+
+
+def connect(path=None, check_same_thread=True):
+    """Open a new tuned connection"""
+    conn = sqlite3.connect(
+        path or DB_PATH,
+        timeout=DB_BUSY_TIMEOUT,
+        factory=TimedConnection if METRICS_ENABLED else PooledConnection,
+        check_same_thread=check_same_thread
+    )
+    conn.row_factory = sqlite3.Row
+    # Must precede the WAL switch to apply to a brand-new file; existing files need
+    # `python retention.py --enable-incremental-vacuum` (otherwise it is a no-op)
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn._pid = os.getpid()
+    return conn
+
+
+def _reset(conn):
+    """Drop any transaction a caller left open before the connection is reused"""
+    if conn.in_transaction:
+        conn.rollback()
+
+
+# ------------------ thread mode ------------------
+_local = threading.local()
+
+
+def _release_thread(conn):
+    _reset(conn)
+
+
+def _acquire_thread():
+    conn = getattr(_local, 'conn', None)
+    if conn is None or conn._pid != os.getpid():
+        conn = connect()
+        conn._release = _release_thread
+        _local.conn = conn
+    return conn
+
+
+# ------------------ pool mode ------------------
+_pool = queue.LifoQueue()
+_pool_lock = threading.Lock()
+_pool_created = 0
+_pool_pid = os.getpid()
+
+
+def _release_pool(conn):
+    _reset(conn)
+    if conn._pid == os.getpid():
+        _pool.put(conn)
+
+
+def _acquire_pool():
+    global _pool, _pool_created, _pool_pid
+    with _pool_lock:
+        if _pool_pid != os.getpid():
+            # Forked worker: inherited connections belong to the parent
+            _pool, _pool_created, _pool_pid = queue.LifoQueue(), 0, os.getpid()
+        try:
+            return _pool.get_nowait()
+        except queue.Empty:
+            pass
+        if _pool_created < DB_POOL_SIZE:
+            _pool_created += 1
+            conn = connect(check_same_thread=False)
+            conn._release = _release_pool
+            return conn
+    return _pool.get(timeout=DB_BUSY_TIMEOUT)
+
+
+def _acquire():
+    if DB_POOL_MODE == 'pool':
+        return _acquire_pool()
+    if DB_POOL_MODE == 'thread':
+        return _acquire_thread()
+    return connect()
+
+
+# ------------------ Flask integration ------------------
+def get_connection():
+    """Connection for the current request, or for the caller outside a request"""
+    # Import inside function so CLI scripts don't need an app
+    from flask import g, has_app_context
+
+    if not has_app_context():
+        return _acquire()
+    conn = g.get('_db_conn')
+    if conn is None:
+        conn = _acquire()
+        conn._held = True
+        g._db_conn = conn
+    return conn
+
+
+def release_connection(exc=None):
+    """teardown_appcontext hook: give the request's connection back"""
+    from flask import g
+
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        conn._held = False
+        conn.close()
+
+
+def init_app(app):
+    app.teardown_appcontext(release_connection)
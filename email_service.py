@@ -1,33 +1,216 @@
 # email_service.py
+# Alerts are queued and delivered by a background AlertDispatcher thread that
+# keeps one authenticated SMTP session open, reconnects when it drops and
+# retries with exponential backoff - request threads never talk to SMTP.
+import atexit
+import queue
 import smtplib
+import threading
+import time
 from email.mime.text import MIMEText
-from config import SMTP_SERVER, SMTP_PORT, EMAIL_SENDER, EMAIL_PASSWORD
+from config import (
+    SMTP_SERVER, SMTP_PORT, SMTP_USE_TLS, SMTP_TIMEOUT, SMTP_IDLE_CHECK,
+    EMAIL_SENDER, EMAIL_PASSWORD,
+    ALERT_QUEUE_SIZE, ALERT_MAX_RETRIES, ALERT_RETRY_BACKOFF
+)
+import metrics
+
+# Failures that won't go away by retrying the same message
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+class AlertDispatcher:
+    """Queue of outgoing messages drained over a persistent SMTP session"""
+
+    def __init__(self, server=SMTP_SERVER, port=SMTP_PORT, use_tls=SMTP_USE_TLS,
+                 max_queue=ALERT_QUEUE_SIZE, max_retries=ALERT_MAX_RETRIES, backoff=ALERT_RETRY_BACKOFF):
+        self.server = server
+        self.port = port
+        self.use_tls = use_tls
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._smtp = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'dropped_full': 0,
+            'rejected': 0,
+            'sent': 0,
+            'failed': 0,
+            'retries': 0,
+            'connects': 0,
+            'last_smtp_ms': 0.0,
+            'total_smtp_ms': 0.0
+        }
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='alert-dispatcher', daemon=True)
+        self._thread.start()
+
+    def enqueue(self, msg):
+        """Queue a MIMEText message; returns False if the queue is full or it has no sender"""
+        if not msg['From']:
+            # Every such message would fail at send time - refuse it here instead
+            with self._lock:
+                self._stats['rejected'] += 1
+                first = self._stats['rejected'] == 1
+            if first:
+                print("❌ EMAIL_SENDER is not set - alert emails are rejected until it is")
+            return False
+        try:
+            self._queue.put_nowait(msg)
+        except queue.Full:
+            with self._lock:
+                self._stats['dropped_full'] += 1
+            print(f"❌ Alert queue full, dropped email to {msg['To']}")
+            return False
+        with self._lock:
+            self._stats['enqueued'] += 1
+        return True
+
+    # ------------------ SMTP session ------------------
+    def _connect(self):
+        smtp = smtplib.SMTP(self.server, self.port, timeout=SMTP_TIMEOUT)
+        if self.use_tls:
+            smtp.starttls()
+        if EMAIL_PASSWORD:
+            smtp.login(EMAIL_SENDER, EMAIL_PASSWORD)
+        with self._lock:
+            self._stats['connects'] += 1
+        return smtp
+
+    def _disconnect(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def _session(self):
+        """Live session, probing with NOOP if it has been idle for a while"""
+        if self._smtp is not None and time.monotonic() - self._last_used > SMTP_IDLE_CHECK:
+            try:
+                self._smtp.noop()
+            except Exception:
+                self._smtp = None
+        if self._smtp is None:
+            self._smtp = self._connect()
+        return self._smtp
+
+    def _deliver(self, msg):
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self._lock:
+                    self._stats['retries'] += 1
+                # Wait out the backoff, but give up early on shutdown
+                if self._stop.wait(self.backoff * 2 ** (attempt - 1)):
+                    break
+            started = time.monotonic()
+            try:
+                self._session().send_message(msg)
+            except PERMANENT_ERRORS as e:
+                print(f"❌ Email to {msg['To']} rejected: {e}")
+                break
+            except (smtplib.SMTPException, OSError) as e:
+                print(f"❌ Email sending failed (attempt {attempt + 1}): {e}")
+                self._disconnect()
+                continue
+            except Exception as e:
+                # Malformed message - never let it kill the dispatcher thread
+                print(f"❌ Email to {msg['To']} not sendable: {e}")
+                break
+            elapsed_ms = (time.monotonic() - started) * 1000
+            metrics.observe('sensor_smtp_send_seconds', elapsed_ms / 1000)
+            self._last_used = time.monotonic()
+            with self._lock:
+                self._stats['sent'] += 1
+                self._stats['last_smtp_ms'] = round(elapsed_ms, 3)
+                self._stats['total_smtp_ms'] += elapsed_ms
+            print(f"✅ Email sent to {msg['To']}")
+            return True
+        with self._lock:
+            self._stats['failed'] += 1
+        return False
+
+    def _run(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            try:
+                msg = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self._deliver(msg)
+        self._disconnect()
+
+    def stop(self, timeout=10):
+        """Deliver what is queued (without retry waits) and close the session"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['avg_smtp_ms'] = round(stats['total_smtp_ms'] / stats['sent'], 3) if stats['sent'] else 0.0
+        stats['total_smtp_ms'] = round(stats['total_smtp_ms'], 3)
+        return stats
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_alert_dispatcher():
+    """Started dispatcher for this process (created lazily, after any gunicorn fork)"""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                dispatcher = AlertDispatcher()
+                dispatcher.start()
+                atexit.register(dispatcher.stop)
+                _dispatcher = dispatcher
+    return _dispatcher
+
 
 def send_email(to_email, subject, body):
-    if not to_email: return
-    
+    """Queue an email for background delivery"""
+    if not to_email: return False
+
     msg = MIMEText(body)
     msg["Subject"] = subject
     msg["From"] = EMAIL_SENDER
     msg["To"] = to_email
-    
-    try:
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(EMAIL_SENDER, EMAIL_PASSWORD)
-            server.send_message(msg)
-            print(f"✅ Email sent to {to_email}")
-    except Exception as e:
-        print(f"❌ Email sending failed: {e}")
-
-def send_alert_email(place, temperature, humidity, warning_msg):
-    # Import inside function to avoid circular import
-    from database import get_client_for_place
+    return get_alert_dispatcher().enqueue(msg)
+
+def _uk_now():
     from config import UK_TZ
     from datetime import datetime
-    
-    client = get_client_for_place(place)
-    if client and client['email_enabled'] == 1 and client['email']:
-        subject = f"⚠ Alert: {place} readings out of range"
-        body = f"Office: {place}\nTemperature: {temperature}°C\nHumidity: {humidity}%\nWarning: {warning_msg}\nTime: {datetime.now(UK_TZ).strftime('%Y-%m-%d %H:%M:%S')} UK"
-        send_email(client['email'], subject, body)
\ No newline at end of file
+    return datetime.now(UK_TZ).strftime('%Y-%m-%d %H:%M:%S')
+
+def send_alert_email(client_name, place, temperature, humidity, warning_msg, to_email):
+    subject = f"⚠ Alert: {client_name} {place} readings out of range"
+    body = f"Client: {client_name}\nOffice: {place}\nTemperature: {temperature}°C\nHumidity: {humidity}%\nWarning: {warning_msg}\nTime: {_uk_now()} UK"
+    return send_email(to_email, subject, body)
+
+def send_alert_digest_email(client_name, place, temperature, humidity, warning_msg, repeats, minutes, to_email):
+    subject = f"⚠ Still out of range: {client_name} {place}"
+    body = (f"Client: {client_name}\nOffice: {place}\n"
+            f"{repeats} more out-of-range readings since the last email; out of range for {minutes} min.\n"
+            f"Latest - Temperature: {temperature}°C, Humidity: {humidity}%\nWarning: {warning_msg}\nTime: {_uk_now()} UK")
+    return send_email(to_email, subject, body)
+
+def send_recovery_email(client_name, place, temperature, humidity, minutes, to_email):
+    subject = f"✅ Recovered: {client_name} {place} back in range"
+    body = (f"Client: {client_name}\nOffice: {place}\nReadings are back in range after {minutes} min.\n"
+            f"Temperature: {temperature}°C\nHumidity: {humidity}%\nTime: {_uk_now()} UK")
+    return send_email(to_email, subject, body)
@@ -0,0 +1,190 @@
+# exporters.py - Streaming export formats for sensor_data
+# Every format consumes the fetchmany() chunks from database.iter_sensor_data
+# and yields encoded bytes as it goes, so nothing holds the whole table.
+#
+#   csv      plain CSV (same columns as the dashboard download)
+#   csv.gz   gzip-compressed CSV, compressed incrementally
+#   ndjson   one JSON object per line, for streaming consumers
+#   parquet  columnar, one row group per EXPORT_PARQUET_ROW_GROUP rows (needs pyarrow)
+#
+# Exports of closed date ranges (ending before today, UTC) never change, so
+# export_stream() keeps a copy in EXPORT_CACHE_DIR and serves repeats from it.
+import csv
+import glob
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+import zlib
+from config import EXPORT_CACHE_DIR, EXPORT_PARQUET_ROW_GROUP
+
+CSV_HEADER = ["timestamp", "Client & Place", "Place", "Temperature (°C)", "Humidity (%)", "Warning"]
+COLUMNS = ["timestamp", "client_place", "place", "temperature", "humidity", "warning"]
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'csv.gz': ('application/gzip', 'csv.gz'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+class ExportError(Exception):
+    """Requested export can't be produced (unknown format, missing optional dependency)"""
+
+
+def iter_csv(chunks):
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator='\n')
+    writer.writerow(CSV_HEADER)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield output.getvalue().encode('utf-8')
+        output.seek(0)
+        output.truncate(0)
+    if output.tell():
+        yield output.getvalue().encode('utf-8')
+
+
+def iter_csv_gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for data in iter_csv(chunks):
+        compressed = compressor.compress(data)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def iter_ndjson(chunks):
+    for rows in chunks:
+        yield ''.join(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + '\n' for row in rows).encode('utf-8')
+
+
+class _DrainSink(io.RawIOBase):
+    """Write-only file that hands written bytes back via drain() but keeps tell() absolute"""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def iter_parquet(chunks):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError("Parquet export requires pyarrow (pip install pyarrow)")
+
+    schema = pa.schema([
+        ('timestamp', pa.string()),
+        ('client_place', pa.string()),
+        ('place', pa.string()),
+        ('temperature', pa.float64()),
+        ('humidity', pa.float64()),
+        ('warning', pa.string()),
+    ])
+    sink = _DrainSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    pending = []
+
+    def write_group(rows):
+        columns = list(zip(*rows))
+        writer.write_table(pa.Table.from_arrays([pa.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema))
+        return sink.drain()
+
+    for rows in chunks:
+        pending.extend(tuple(row) for row in rows)
+        if len(pending) >= EXPORT_PARQUET_ROW_GROUP:
+            yield write_group(pending)
+            pending = []
+    if pending:
+        yield write_group(pending)
+    writer.close()
+    yield sink.drain()
+
+
+WRITERS = {
+    'csv': iter_csv,
+    'csv.gz': iter_csv_gzip,
+    'ndjson': iter_ndjson,
+    'parquet': iter_parquet,
+}
+
+
+# ------------------ closed-range cache ------------------
+def _cache_path(fmt, place, start_ts, end_ts):
+    key = hashlib.sha1(f"{fmt}|{place or 'All'}|{start_ts}|{end_ts}".encode()).hexdigest()
+    return os.path.abspath(os.path.join(EXPORT_CACHE_DIR, f"{key}.{FORMATS[fmt][1]}"))
+
+
+def is_closed_range(end_ts):
+    """True if [.., end_ts) ends before the start of today (UTC) - new readings can't land in it"""
+    return end_ts is not None and end_ts <= int(time.time()) // 86400 * 86400
+
+
+def cached_export(fmt, place, start_ts, end_ts):
+    """Path of a finished cached export, or None"""
+    if not is_closed_range(end_ts):
+        return None
+    path = _cache_path(fmt, place, start_ts, end_ts)
+    return path if os.path.exists(path) else None
+
+
+def export_stream(fmt, chunks, place=None, start_ts=None, end_ts=None):
+    """Encoded byte stream for fmt; closed ranges are also written to the cache"""
+    if fmt not in WRITERS:
+        raise ExportError(f"Unknown format '{fmt}' (use one of: {', '.join(FORMATS)})")
+    if fmt == 'parquet':
+        # Fail before the response starts rather than mid-stream
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ExportError("Parquet export requires pyarrow (pip install pyarrow)")
+    stream = WRITERS[fmt](chunks)
+    if not is_closed_range(end_ts):
+        return stream
+    return _tee_to_cache(stream, _cache_path(fmt, place, start_ts, end_ts))
+
+
+def _tee_to_cache(stream, path):
+    os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+    # A fresh name per call: threads of one worker may export the same range at once
+    fd, tmp_path = tempfile.mkstemp(dir=EXPORT_CACHE_DIR, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        try:
+            for data in stream:
+                f.write(data)
+                yield data
+        except BaseException:
+            # Client went away or the query failed: never publish a partial file
+            f.close()
+            os.remove(tmp_path)
+            raise
+    os.replace(tmp_path, path)
+
+
+def clear_export_cache():
+    """Drop cached exports - call after anything rewrites historical readings"""
+    for path in glob.glob(os.path.join(EXPORT_CACHE_DIR, '*')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
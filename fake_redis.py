@@ -0,0 +1,282 @@
+# fake_redis.py - Local Redis-protocol server for trying the shared state 'redis' backend
+# Speaks RESP2 and just the commands shared_state.RedisState (and redis-cli
+# poking around) needs: PING, ECHO, AUTH, SELECT, GET, SET (EX/PX/NX/XX), DEL,
+# EXISTS, INCR/INCRBY/DECR, EXPIRE/PEXPIRE, TTL/PTTL, WATCH/UNWATCH/MULTI/EXEC/
+# DISCARD, PUBLISH, (P)SUBSCRIBE/(P)UNSUBSCRIBE, FLUSHALL, QUIT. One keyspace,
+# kept in memory.
+#
+#   python fake_redis.py --port 6379
+#   SHARED_STATE_BACKEND=redis SHARED_STATE_URL=redis://127.0.0.1:6379/0 python app.py
+import argparse
+import fnmatch
+import socketserver
+import threading
+import time
+
+
+class _Error(Exception):
+    pass
+
+
+def _bulk(value):
+    if value is None:
+        return b"$-1\r\n"
+    data = value if isinstance(value, bytes) else str(value).encode()
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+def _array(items):
+    return b"*%d\r\n" % len(items) + b"".join(
+        b":%d\r\n" % item if isinstance(item, int) else _bulk(item) for item in items)
+
+
+class _RedisHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.channels, self.patterns = set(), set()
+        self.watched = {}    # key -> write version when WATCHed
+        self.queued = None   # commands after MULTI, until EXEC / DISCARD
+        self.write_lock = threading.Lock()  # publishers on other threads write here too
+
+    def send(self, data):
+        with self.write_lock:
+            self.wfile.write(data)
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()  # inline command (telnet / redis-cli -x)
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2])
+        return args
+
+    def handle(self):
+        try:
+            while True:
+                args = self.read_command()
+                if args is None:
+                    return
+                if not args:
+                    continue
+                command = args[0].decode().upper()
+                try:
+                    reply = self.server.execute(self, command, args[1:])
+                except _Error as e:
+                    reply = b"-ERR %s\r\n" % str(e).encode()
+                except (ValueError, IndexError):
+                    reply = b"-ERR syntax error\r\n"
+                if reply is not None:
+                    self.send(reply)
+                if command == 'QUIT':
+                    return
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.server.unsubscribe_all(self)
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, verbose=False):
+        super().__init__((host, port), _RedisHandler)
+        self.data = {}  # key -> (value bytes, expires monotonic or None)
+        self.versions = {}  # key -> writes so far, for WATCH
+        self.subscribers = set()
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def _live(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return entry
+
+    def execute(self, client, command, args):
+        if client.queued is not None and command not in ('EXEC', 'DISCARD', 'MULTI', 'WATCH'):
+            client.queued.append((command, args))
+            return b"+QUEUED\r\n"
+        if command in ('WATCH', 'UNWATCH', 'MULTI', 'EXEC', 'DISCARD'):
+            return self._transaction(client, command, args)
+        if command == 'PING':
+            return _bulk(args[0]) if args else b"+PONG\r\n"
+        if command in ('QUIT', 'AUTH', 'SELECT'):
+            return b"+OK\r\n"
+        if command == 'ECHO':
+            return _bulk(args[0])
+        if command == 'PUBLISH':
+            return b":%d\r\n" % self.publish(args[0].decode(), args[1])
+        if command in ('SUBSCRIBE', 'PSUBSCRIBE', 'UNSUBSCRIBE', 'PUNSUBSCRIBE'):
+            return self.subscribe(client, command, [a.decode() for a in args])
+        with self._lock:
+            return self._execute_data(command, args)
+
+    def _transaction(self, client, command, args):
+        if command == 'WATCH':
+            if client.queued is not None:
+                raise _Error("WATCH inside MULTI is not allowed")
+            with self._lock:
+                client.watched.update((key, self.versions.get(key, 0)) for key in args)
+            return b"+OK\r\n"
+        if command == 'UNWATCH':
+            client.watched = {}
+            return b"+OK\r\n"
+        if command == 'MULTI':
+            if client.queued is not None:
+                raise _Error("MULTI calls can not be nested")
+            client.queued = []
+            return b"+OK\r\n"
+        if client.queued is None:
+            raise _Error(f"{command} without MULTI")
+        queued, watched = client.queued, client.watched
+        client.queued, client.watched = None, {}
+        if command == 'DISCARD':
+            return b"+OK\r\n"
+        with self._lock:
+            if any(self.versions.get(key, 0) != version for key, version in watched.items()):
+                return b"*-1\r\n"  # a watched key was written - abort
+            replies = []
+            for queued_command, queued_args in queued:
+                try:
+                    replies.append(self._execute_data(queued_command, queued_args))
+                except _Error as e:
+                    replies.append(b"-ERR %s\r\n" % str(e).encode())
+        return b"*%d\r\n" % len(replies) + b"".join(replies)
+
+    def _written(self, *keys):
+        for key in keys:
+            self.versions[key] = self.versions.get(key, 0) + 1
+
+    def _execute_data(self, command, args):
+        now = time.monotonic()
+        if command == 'GET':
+            entry = self._live(args[0])
+            return _bulk(entry[0] if entry else None)
+        if command == 'SET':
+            key, value, options = args[0], args[1], [a.decode().upper() for a in args[2:]]
+            expires = None
+            for index, option in enumerate(options):
+                if option == 'EX':
+                    expires = now + int(options[index + 1])
+                elif option == 'PX':
+                    expires = now + int(options[index + 1]) / 1000
+            exists = self._live(key) is not None
+            if ('NX' in options and exists) or ('XX' in options and not exists):
+                return b"$-1\r\n"
+            self.data[key] = (value, expires)
+            self._written(key)
+            return b"+OK\r\n"
+        if command in ('DEL', 'EXISTS'):
+            found = [key for key in args if self._live(key) is not None]
+            if command == 'DEL':
+                for key in found:
+                    del self.data[key]
+                self._written(*found)
+            return b":%d\r\n" % len(found)
+        if command in ('INCR', 'INCRBY', 'DECR', 'DECRBY'):
+            amount = int(args[1]) if command.endswith('BY') else 1
+            amount = -amount if command.startswith('DECR') else amount
+            entry = self._live(args[0])
+            try:
+                value = (int(entry[0]) if entry else 0) + amount
+            except ValueError:
+                raise _Error("value is not an integer or out of range")
+            self.data[args[0]] = (str(value).encode(), entry[1] if entry else None)
+            self._written(args[0])
+            return b":%d\r\n" % value
+        if command in ('EXPIRE', 'PEXPIRE'):
+            entry = self._live(args[0])
+            if entry is None:
+                return b":0\r\n"
+            seconds = int(args[1]) / (1000 if command == 'PEXPIRE' else 1)
+            self.data[args[0]] = (entry[0], now + seconds)
+            self._written(args[0])
+            return b":1\r\n"
+        if command in ('TTL', 'PTTL'):
+            entry = self._live(args[0])
+            if entry is None:
+                return b":-2\r\n"
+            if entry[1] is None:
+                return b":-1\r\n"
+            return b":%d\r\n" % int((entry[1] - now) * (1000 if command == 'PTTL' else 1))
+        if command == 'FLUSHALL':
+            self._written(*self.data)
+            self.data.clear()
+            return b"+OK\r\n"
+        raise _Error(f"unknown command '{command}'")
+
+    # ------------------ pub/sub ------------------
+    def subscribe(self, client, command, names):
+        targets = client.patterns if command.startswith('P') else client.channels
+        kind = command.lower().encode()
+        with self._lock:
+            if command.endswith('UNSUBSCRIBE'):
+                names = names or sorted(targets)
+                targets.difference_update(names)
+            else:
+                targets.update(names)
+            if client.channels or client.patterns:
+                self.subscribers.add(client)
+            else:
+                self.subscribers.discard(client)
+            count = len(client.channels) + len(client.patterns)
+        return b"".join(_array([kind, name, count]) for name in names)
+
+    def unsubscribe_all(self, client):
+        with self._lock:
+            self.subscribers.discard(client)
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self.subscribers)
+        if self.verbose:
+            print(f"📣 {channel}: {message[:120]!r}")
+        delivered = 0
+        for client in subscribers:
+            frames = []
+            if channel in client.channels:
+                frames.append(_array([b"message", channel, message]))
+            frames.extend(_array([b"pmessage", pattern, channel, message])
+                          for pattern in client.patterns if fnmatch.fnmatchcase(channel, pattern))
+            for frame in frames:
+                try:
+                    client.send(frame)
+                    delivered += 1
+                except OSError:
+                    self.unsubscribe_all(client)
+        return delivered
+
+    def start(self):
+        """Serve in a background thread (for tests); returns self"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local in-memory Redis-protocol server for the shared state backend")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--verbose", action="store_true", help="print every published message")
+    args = parser.parse_args()
+    server = FakeRedisServer(args.host, args.port, verbose=args.verbose)
+    print(f"Fake Redis listening on {args.host}:{server.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,107 @@
+# fake_smtp.py - Local SMTP sink for testing alert delivery offline
+# Speaks just enough SMTP (EHLO/HELO, AUTH, MAIL, RCPT, DATA, RSET, NOOP, QUIT)
+# for smtplib and keeps every message in memory. No STARTTLS, so run the app
+# with SMTP_USE_TLS=0:
+#
+#   python fake_smtp.py --port 1025
+#   SMTP_SERVER=127.0.0.1 SMTP_PORT=1025 SMTP_USE_TLS=0 EMAIL_SENDER=alerts@localhost python app.py
+import argparse
+import socketserver
+import threading
+from email import message_from_bytes
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        sink = self.server
+        self._reply("220 fake-smtp ready")
+        mail_from, rcpt_to = None, []
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode(errors='replace').rstrip("\r\n")
+            command = line.split(" ", 1)[0].upper()
+            if command == "EHLO":
+                self.wfile.write(b"250-fake-smtp\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+            elif command == "HELO":
+                self._reply("250 fake-smtp")
+            elif command == "AUTH":
+                sink.logins += 1
+                self._reply("235 Authentication successful")
+            elif command == "MAIL":
+                mail_from, rcpt_to = line.split(":", 1)[1].strip(), []
+                self._reply("250 OK")
+            elif command == "RCPT":
+                rcpt_to.append(line.split(":", 1)[1].strip())
+                self._reply("250 OK")
+            elif command == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b".\r\n", b".\n"):
+                        break
+                    lines.append(data[1:] if data.startswith(b"..") else data)
+                sink.add(mail_from, rcpt_to, b"".join(lines))
+                self._reply("250 OK queued")
+            elif command == "RSET":
+                mail_from, rcpt_to = None, []
+                self._reply("250 OK")
+            elif command == "NOOP":
+                self._reply("250 OK")
+            elif command == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, verbose=False):
+        super().__init__((host, port), _SMTPHandler)
+        self.messages = []   # list of (mail_from, rcpt_to, email.message.Message)
+        self.logins = 0
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def add(self, mail_from, rcpt_to, data):
+        msg = message_from_bytes(data)
+        with self._lock:
+            self.messages.append((mail_from, rcpt_to, msg))
+        if self.verbose:
+            print(f"📨 {mail_from} -> {', '.join(rcpt_to)}: {msg['Subject']}")
+
+    def start(self):
+        """Serve in a background thread (for tests); returns self"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local SMTP sink that prints received alerts")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1025)
+    args = parser.parse_args()
+    server = FakeSMTPServer(args.host, args.port, verbose=True)
+    print(f"Fake SMTP sink listening on {args.host}:{server.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,314 @@
+# fleet.py - Asyncio load generator: thousands of simulated sensors against a running server
+# Sensors are spread over the clients in the clients table and post with their
+# client's real API key, either one reading per request (/submit-data) or
+# gathered per client into /submit-data/batch requests. HTTP/1.1 is spoken
+# directly over asyncio streams with a bounded keep-alive connection pool, so one
+# process can drive far more sensors than the per-client simulation scripts.
+# Prints achieved throughput and p50/p95/p99 request latency at the end.
+#
+#   python fleet.py --sensors 2000 --interval 10 --duration 60
+#   python fleet.py --sensors 5000 --interval 1 --mode batch --batch-size 200 --json fleet.json
+#   python fleet.py --url https://example.com --api-key KEY --sensors 100   (no local DB needed)
+import argparse
+import asyncio
+import json
+import random
+import ssl
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+from config import TEMP_RANGE, HUM_RANGE, SIMULATOR_SERVER_URL
+
+PATTERNS = ('spike', 'flatline', 'drift', 'out_of_range')
+
+
+class HTTPError(Exception):
+    """Malformed or truncated HTTP response"""
+
+
+class ConnectionPool:
+    """Keep-alive HTTP/1.1 connections to one server; at most size requests in flight"""
+
+    def __init__(self, url, size):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        self.base_path = parts.path.rstrip('/')
+        self.opened = 0
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def post_json(self, path, payload, headers):
+        """POST payload; returns (status, seconds spent on the exchange)"""
+        body = json.dumps(payload).encode()
+        head = (f"POST {self.base_path}{path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                + "".join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n").encode()
+        async with self._slots:
+            while True:
+                reused = bool(self._idle)
+                reader, writer = self._idle.pop() if reused else await self._open()
+                started = time.perf_counter()
+                try:
+                    writer.write(head + body)
+                    await writer.drain()
+                    status, keep_alive = await _read_response(reader)
+                except (ConnectionError, asyncio.IncompleteReadError, HTTPError):
+                    writer.close()
+                    if reused:
+                        continue  # the server closed an idle keep-alive connection; retry on a fresh one
+                    raise
+                elapsed = time.perf_counter() - started
+                if keep_alive:
+                    self._idle.append((reader, writer))
+                else:
+                    writer.close()
+                return status, elapsed
+
+    async def _open(self):
+        self.opened += 1
+        return await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+
+    def close(self):
+        while self._idle:
+            self._idle.pop()[1].close()
+
+
+async def _read_response(reader):
+    """Read one response; returns (status, connection reusable)"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise HTTPError("connection closed")
+    version, status = status_line.split(None, 2)[:2]
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip().lower()
+    keep_alive = version == b'HTTP/1.1' and headers.get('connection') != 'close'
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.read()
+        keep_alive = False
+    return int(status), keep_alive
+
+
+class SimSensor:
+    """One emulated sensor: a random walk inside the comfort band plus injected anomaly patterns"""
+
+    __slots__ = ('api_key', 'place', 'temp', 'hum', 'pattern', 'left')
+
+    def __init__(self, api_key, place, rng):
+        self.api_key, self.place = api_key, place
+        self.temp = rng.uniform(*TEMP_RANGE)
+        self.hum = rng.uniform(*HUM_RANGE)
+        self.pattern, self.left = None, 0
+
+    def read(self, rng, anomaly_rate, patterns):
+        if self.pattern is None and patterns and rng.random() < anomaly_rate:
+            self.pattern = rng.choice(patterns)
+            self.left = 1 if self.pattern in ('spike', 'out_of_range') else rng.randint(20, 60)
+        pattern = self.pattern
+        if pattern is not None:
+            self.left -= 1
+            if self.left <= 0:
+                self.pattern = None
+        if pattern == 'flatline':
+            return round(self.temp, 1), round(self.hum, 1)
+        if pattern == 'drift':
+            self.temp += 0.5
+        else:
+            # Walk, pulled back towards the middle of the band
+            self.temp += rng.gauss(0, 0.2) + (sum(TEMP_RANGE) / 2 - self.temp) * 0.05
+            self.hum += rng.gauss(0, 0.5) + (sum(HUM_RANGE) / 2 - self.hum) * 0.05
+        temp, hum = self.temp, self.hum
+        if pattern == 'spike':
+            temp += rng.choice((-1, 1)) * (TEMP_RANGE[1] - TEMP_RANGE[0])
+        elif pattern == 'out_of_range':
+            hum = HUM_RANGE[1] + rng.uniform(1, 15)
+        return round(temp, 1), round(min(max(hum, 0), 100), 1)
+
+
+class Fleet:
+    """Drives every sensor on its own schedule and collects latency / status statistics"""
+
+    def __init__(self, args, sensors):
+        self.args = args
+        self.sensors = sensors
+        self.pool = ConnectionPool(args.url, args.connections)
+        self.rng = random.Random(args.seed)
+        self.patterns = [p for p in args.anomaly_patterns.split(',') if p]
+        self.latencies = []
+        self.statuses = Counter()
+        self.readings_sent = self.readings_ok = 0
+        self.errors = Counter()
+        self._pending = {}  # api_key -> readings waiting for the next batch request
+        self._inflight = set()
+
+    async def _post(self, path, payload, api_key, count):
+        try:
+            status, elapsed = await self.pool.post_json(path, payload, {'X-API-Key': api_key})
+        except (OSError, asyncio.IncompleteReadError, HTTPError) as e:
+            self.errors[type(e).__name__] += 1
+            return
+        self.latencies.append(elapsed)
+        self.statuses[status] += 1
+        self.readings_sent += count
+        if status == 200:
+            self.readings_ok += count
+
+    def _submit_batch(self, api_key):
+        readings = self._pending.pop(api_key, None)
+        if readings:
+            task = asyncio.ensure_future(self._post('/submit-data/batch', {'readings': readings}, api_key, len(readings)))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, sensor):
+        temperature, humidity = sensor.read(self.rng, self.args.anomaly_rate, self.patterns)
+        reading = {'place': sensor.place, 'temperature': temperature, 'humidity': humidity}
+        if self.args.mode == 'single':
+            await self._post('/submit-data', reading, sensor.api_key, 1)
+            return
+        pending = self._pending.setdefault(sensor.api_key, [])
+        pending.append(reading)
+        if len(pending) >= self.args.batch_size:
+            self._submit_batch(sensor.api_key)
+
+    async def _run_sensor(self, sensor, deadline):
+        args, rng = self.args, self.rng
+        next_at = time.monotonic() + rng.uniform(0, args.interval)  # spread the fleet over one interval
+        next_burst = time.monotonic() + args.burst_every if args.burst_every else None
+        while True:
+            now = time.monotonic()
+            if next_at >= deadline:
+                return
+            await asyncio.sleep(max(next_at - now, 0))
+            count = 1
+            if next_burst is not None and next_at >= next_burst:
+                next_burst += args.burst_every
+                if rng.random() < args.burst_fraction:
+                    count = args.burst_size
+            for _ in range(count):
+                await self._send(sensor)
+            next_at += args.interval * (1 + rng.uniform(-args.jitter, args.jitter))
+
+    async def _flush_batches(self):
+        while True:
+            await asyncio.sleep(self.args.batch_interval)
+            for api_key in list(self._pending):
+                self._submit_batch(api_key)
+
+    async def _report_progress(self, started):
+        while True:
+            await asyncio.sleep(self.args.report_every)
+            elapsed = time.monotonic() - started
+            print(f"  {elapsed:6.0f}s  {self.readings_ok / elapsed:8.1f} readings/s  "
+                  f"{len(self.latencies)} requests  {sum(self.errors.values())} errors")
+
+    async def run(self):
+        started = time.monotonic()
+        deadline = started + self.args.duration
+        helpers = [asyncio.ensure_future(self._report_progress(started))]
+        if self.args.mode == 'batch':
+            helpers.append(asyncio.ensure_future(self._flush_batches()))
+        await asyncio.gather(*(self._run_sensor(sensor, deadline) for sensor in self.sensors))
+        for api_key in list(self._pending):
+            self._submit_batch(api_key)
+        if self._inflight:
+            await asyncio.gather(*self._inflight)
+        for task in helpers:
+            task.cancel()
+        elapsed = time.monotonic() - started
+        self.pool.close()
+        return self.summary(elapsed)
+
+    def summary(self, elapsed):
+        latencies = sorted(self.latencies)
+        return {
+            'mode': self.args.mode,
+            'sensors': len(self.sensors),
+            'duration_s': round(elapsed, 2),
+            'target_readings_per_s': round(len(self.sensors) / self.args.interval, 1),
+            'readings_per_s': round(self.readings_ok / elapsed, 1),
+            'requests_per_s': round(len(latencies) / elapsed, 1),
+            'readings_sent': self.readings_sent,
+            'readings_ok': self.readings_ok,
+            'statuses': {str(k): v for k, v in sorted(self.statuses.items())},
+            'errors': dict(self.errors),
+            'connections_opened': self.pool.opened,
+            'latency_ms': {name: round(percentile(latencies, p) * 1000, 2)
+                           for name, p in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100))},
+        }
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+
+def load_sensors(count, api_keys, rng):
+    """count sensors spread round-robin over the given keys, or over every client with an API key"""
+    if api_keys:
+        owners = [(key, 'sim') for key in api_keys]
+    else:
+        # Import inside function so --api-key runs don't need the local database
+        from database import get_db_connection
+
+        conn = get_db_connection()
+        owners = [(row['api_key'], row['places'] or 'sim') for row in conn.execute(
+            "SELECT api_key, places FROM clients WHERE role = 'client' AND api_key IS NOT NULL AND api_key != ''")]
+        conn.close()
+        if not owners:
+            raise SystemExit("No clients with API keys - register some or pass --api-key")
+    return [SimSensor(key, f"{place}-{i // len(owners)}", rng)
+            for i, (key, place) in ((i, owners[i % len(owners)]) for i in range(count))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Emulate a fleet of sensors posting to the ingestion API")
+    parser.add_argument("--url", default=SIMULATOR_SERVER_URL, help="server base URL")
+    parser.add_argument("--api-key", action="append", help="use these keys instead of the clients table (repeatable)")
+    parser.add_argument("--sensors", type=int, default=1000)
+    parser.add_argument("--interval", type=float, default=10, help="seconds between readings per sensor")
+    parser.add_argument("--jitter", type=float, default=0.1, help="interval varies by up to this fraction")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to run")
+    parser.add_argument("--mode", choices=("single", "batch"), default="single")
+    parser.add_argument("--batch-size", type=int, default=100, help="readings per batch request")
+    parser.add_argument("--batch-interval", type=float, default=1.0, help="flush partial batches this often (seconds)")
+    parser.add_argument("--burst-every", type=float, default=0, help="seconds between bursts; 0 = no bursts")
+    parser.add_argument("--burst-size", type=int, default=10, help="readings a bursting sensor sends back-to-back")
+    parser.add_argument("--burst-fraction", type=float, default=0.1, help="share of sensors that burst each time")
+    parser.add_argument("--anomaly-rate", type=float, default=0.001, help="chance per reading of starting an anomaly")
+    parser.add_argument("--anomaly-patterns", default=",".join(PATTERNS), help=f"comma-separated subset of {PATTERNS}")
+    parser.add_argument("--connections", type=int, default=100, help="max concurrent requests / open connections")
+    parser.add_argument("--report-every", type=float, default=10, help="seconds between progress lines")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", help="also write the summary to this file")
+    args = parser.parse_args()
+
+    unknown = set(p for p in args.anomaly_patterns.split(',') if p) - set(PATTERNS)
+    if unknown:
+        parser.error(f"unknown anomaly patterns: {', '.join(sorted(unknown))}")
+    sensors = load_sensors(args.sensors, args.api_key, random.Random(args.seed))
+    print(f"🚀 {len(sensors)} sensors -> {args.url} ({args.mode}), {len(sensors) / args.interval:.0f} readings/s target")
+    result = asyncio.run(Fleet(args, sensors).run())
+    latency = result['latency_ms']
+    print(f"✅ {result['readings_ok']} readings accepted in {result['duration_s']}s: {result['readings_per_s']} readings/s, "
+          f"{result['requests_per_s']} requests/s\n"
+          f"   latency p50 {latency['p50']} ms, p95 {latency['p95']} ms, p99 {latency['p99']} ms, max {latency['max']} ms\n"
+          f"   statuses {result['statuses']}, errors {result['errors']}, connections opened {result['connections_opened']}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
@@ -1,7 +1,7 @@
 # helpers.py
 from datetime import datetime
 from zoneinfo import ZoneInfo
-from config import UK_TZ
+from config import UK_TZ, TEMP_RANGE, HUM_RANGE
 
 def convert_to_uk(dt_str):
     if not dt_str: return dt_str
@@ -11,14 +11,55 @@ def convert_to_uk(dt_str):
     except Exception:
         return dt_str
 
-def check_sensor_ranges(temperature, humidity):
-    from config import TEMP_RANGE, HUM_RANGE
+def date_to_epoch(date_str, end_of_day=False):
+    """'YYYY-MM-DD' (UTC) -> epoch seconds at the start of that day, or of the next day if end_of_day"""
+    if not date_str: return None
+    try:
+        dt = datetime.strptime(date_str, "%Y-%m-%d").replace(tzinfo=ZoneInfo("UTC"))
+    except ValueError:
+        return None
+    return int(dt.timestamp()) + (86400 if end_of_day else 0)
+
+# Warning codes returned by classify_readings (bit flags)
+WARN_OK = 0
+WARN_TEMPERATURE = 1
+WARN_HUMIDITY = 2
+
+def check_sensor_ranges(temperature, humidity, temp_range=TEMP_RANGE, hum_range=HUM_RANGE):
     warn = []
     
-    if temperature < TEMP_RANGE[0] or temperature > TEMP_RANGE[1]:
+    if temperature < temp_range[0] or temperature > temp_range[1]:
         warn.append(f"Temperature out of range ({temperature}°C)")
     
-    if humidity < HUM_RANGE[0] or humidity > HUM_RANGE[1]:
+    if humidity < hum_range[0] or humidity > hum_range[1]:
         warn.append(f"Humidity out of range ({humidity}%)")
     
-    return '; '.join(warn) if warn else None
\ No newline at end of file
+    return '; '.join(warn) if warn else None
+
+def classify_readings(temperatures, humidities, temp_range=TEMP_RANGE, hum_range=HUM_RANGE):
+    """Vectorised check_sensor_ranges: arrays of readings -> uint8 array of WARN_* flags
+
+    Range bounds may be scalars or per-row arrays (e.g. from thresholds.lookup_many).
+    """
+    # Import inside function so importing helpers doesn't load numpy
+    import numpy as np
+
+    t = np.asarray(temperatures, dtype=np.float64)
+    h = np.asarray(humidities, dtype=np.float64)
+    codes = np.where((t < temp_range[0]) | (t > temp_range[1]), WARN_TEMPERATURE, WARN_OK).astype(np.uint8)
+    codes |= np.where((h < hum_range[0]) | (h > hum_range[1]), WARN_HUMIDITY, WARN_OK).astype(np.uint8)
+    return codes
+
+def render_warnings(codes, temperatures, humidities):
+    """Warning strings for classify_readings output ('' in range) - only flagged rows are formatted"""
+    import numpy as np
+
+    warnings = [''] * len(codes)
+    for i in np.flatnonzero(codes):
+        warn = []
+        if codes[i] & WARN_TEMPERATURE:
+            warn.append(f"Temperature out of range ({float(temperatures[i])}°C)")
+        if codes[i] & WARN_HUMIDITY:
+            warn.append(f"Humidity out of range ({float(humidities[i])}%)")
+        warnings[i] = '; '.join(warn)
+    return warnings
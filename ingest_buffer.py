@@ -0,0 +1,164 @@
+# ingest_buffer.py - Optional write-behind queue for sensor readings
+# Request threads enqueue validated readings and return at once; a single
+# background writer drains the queue in group commits bounded by row count
+# and max delay, and flushes what is left on shutdown.
+#
+# Durability trade-off: a reading is acknowledged before it is committed. A clean
+# shutdown (SIGTERM, atexit) flushes the queue, but a killed or crashed worker
+# loses what was still queued - up to WRITE_BEHIND_MAX_DELAY seconds of readings,
+# at most WRITE_BEHIND_QUEUE_SIZE - and a group that fails WRITE_RETRIES times is
+# dropped (rows_dropped under ingest_buffer in /health).
+import atexit
+import queue
+import threading
+import time
+from config import (
+    WRITE_BEHIND_ENABLED,
+    WRITE_BEHIND_MAX_ROWS,
+    WRITE_BEHIND_MAX_DELAY,
+    WRITE_BEHIND_QUEUE_SIZE
+)
+
+WRITE_RETRIES = 3
+
+
+class IngestBuffer:
+    """Bounded in-process queue drained by one writer thread"""
+
+    def __init__(self, max_rows=WRITE_BEHIND_MAX_ROWS, max_delay=WRITE_BEHIND_MAX_DELAY,
+                 max_queue=WRITE_BEHIND_QUEUE_SIZE):
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'rejected_full': 0,
+            'flushes': 0,
+            'rows_flushed': 0,
+            'rows_dropped': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+            'max_queue_wait_ms': 0.0
+        }
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, reading):
+        """Enqueue one (client_place, place, temperature, humidity, warning) tuple.
+
+        Returns False when the queue is full or the writer has been stopped, so the
+        caller can write synchronously - nothing is queued that no writer will flush.
+        """
+        if self._stop.is_set():
+            return False
+        try:
+            self._queue.put_nowait((time.monotonic(), int(time.time()), reading))
+        except queue.Full:
+            with self._lock:
+                self._stats['rejected_full'] += 1
+            return False
+        with self._lock:
+            self._stats['enqueued'] += 1
+        return True
+
+    def _collect(self, block):
+        """Take up to max_rows items, waiting at most max_delay after the first"""
+        items = []
+        try:
+            items.append(self._queue.get(timeout=self.max_delay) if block else self._queue.get_nowait())
+        except queue.Empty:
+            return items
+        deadline = time.monotonic() + self.max_delay
+        while len(items) < self.max_rows:
+            remaining = deadline - time.monotonic()
+            try:
+                items.append(self._queue.get(timeout=remaining) if block and remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _write(self, items):
+        # Import inside function to avoid circular import
+        from database import save_sensor_data_batch
+
+        rows = [(*reading[:5], received) for _, received, reading in items]
+        for attempt in range(1, WRITE_RETRIES + 1):
+            started = time.monotonic()
+            try:
+                save_sensor_data_batch(rows)
+            except Exception as e:
+                print(f"❌ Write-behind flush failed (attempt {attempt}/{WRITE_RETRIES}): {e}")
+                time.sleep(0.1 * attempt)
+                continue
+            finished = time.monotonic()
+            flush_ms = (finished - started) * 1000
+            wait_ms = (finished - items[0][0]) * 1000
+            with self._lock:
+                self._stats['flushes'] += 1
+                self._stats['rows_flushed'] += len(rows)
+                self._stats['last_flush_ms'] = round(flush_ms, 3)
+                self._stats['max_flush_ms'] = round(max(self._stats['max_flush_ms'], flush_ms), 3)
+                self._stats['total_flush_ms'] += flush_ms
+                self._stats['max_queue_wait_ms'] = round(max(self._stats['max_queue_wait_ms'], wait_ms), 3)
+            return True
+        with self._lock:
+            self._stats['rows_dropped'] += len(rows)
+        return False
+
+    def _run(self):
+        while not self._stop.is_set():
+            items = self._collect(block=True)
+            if items:
+                self._write(items)
+        # Final drain after stop() - never block here
+        while True:
+            items = self._collect(block=False)
+            if not items:
+                break
+            self._write(items)
+
+    def stop(self, timeout=10):
+        """Stop the writer and flush everything still queued"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['avg_flush_ms'] = round(stats['total_flush_ms'] / stats['flushes'], 3) if stats['flushes'] else 0.0
+        stats['total_flush_ms'] = round(stats['total_flush_ms'], 3)
+        return stats
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_ingest_buffer():
+    """Return the started write-behind buffer, or None when disabled.
+
+    Started lazily so each gunicorn worker gets its own writer after fork.
+    """
+    global _buffer
+    if not WRITE_BEHIND_ENABLED:
+        return None
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                buffer = IngestBuffer()
+                buffer.start()
+                atexit.register(buffer.stop)
+                _buffer = buffer
+    return _buffer
@@ -0,0 +1,101 @@
+# latest_values.py - Last reading per client_place, kept in memory for /latest-data
+# database.save_sensor_data / save_sensor_data_batch call record() after every
+# commit, so a dashboard poll is a dict walk over the sensors instead of a sorted
+# table query. On the first poll the map is filled from the DB (one indexed
+# lookup per sensor in known_client_places). Rows saved by other workers arrive
+# through shared_state's 'latest' channel, so the map is only re-read when
+# history was rewritten (data_versions reset signal) or messages may have been
+# missed - or, with SHARED_STATE_BACKEND=local, when the shared data_versions
+# counter shows changes this process didn't make. LATEST_CACHE_RESYNC > 0 adds
+# a periodic re-read as well.
+import threading
+import time
+from config import LATEST_CACHE_RESYNC, SHARED_STATE_BACKEND
+import data_versions
+from shared_state import get_state, subscribe
+
+FIELDS = ("client_place", "place", "temperature", "humidity", "warning", "timestamp", "ts")
+
+_latest = {}  # client_place -> reading dict
+_lock = threading.Lock()
+_synced_at = None  # monotonic time of the last DB sync, None before the first
+_synced_resets = 0   # data_versions.reset_count() at the last sync
+_synced_changes = 0  # data_versions.change_count() at the last sync (local backend only)
+_local_changes = 0   # record() calls since then (each is one bump by this process)
+
+
+def record(rows):
+    """Fold committed (client_place, place, temperature, humidity, warning, timestamp, ts) rows in"""
+    global _local_changes
+    with _lock:
+        _local_changes += 1
+    _merge(rows)
+    get_state().publish('latest', [list(row) for row in rows])
+
+
+def _on_published(rows):
+    """Rows another worker recorded, or None when messages may have been missed"""
+    global _synced_at
+    if rows is None:
+        with _lock:
+            _synced_at = None  # resync on the next poll
+        return
+    _merge(rows)
+
+
+def _merge(rows):
+    with _lock:
+        for row in rows:
+            current = _latest.get(row[0])
+            if current is None or row[6] >= current['ts']:
+                _latest[row[0]] = dict(zip(FIELDS, row))
+
+
+def _sync():
+    # Import inside function to avoid circular import
+    from database import get_db_connection
+    from storage import get_storage
+
+    conn = get_db_connection()
+    storage = get_storage()
+    client_places = [row[0] for row in conn.execute("SELECT client_place FROM known_client_places")]
+    rows = []
+    for client_place in client_places:
+        known = _latest.get(client_place)
+        since = known['ts'] if known else None
+        # Only tables newer than what we already hold - a silent sensor costs nothing after the first sync
+        for table in storage.tables(conn, since):
+            row = conn.execute(
+                f"SELECT {', '.join(FIELDS)} FROM {table} WHERE client_place = ? AND ts >= ? ORDER BY ts DESC LIMIT 1",
+                (client_place, since or 0)
+            ).fetchone()
+            if row is not None:
+                rows.append(tuple(row))
+                break
+    conn.close()
+    _merge(rows)
+
+
+def get_latest(place=None):
+    """Latest reading of every sensor, newest first; place (or client_place) narrows it down"""
+    global _synced_at, _synced_resets, _synced_changes, _local_changes
+    now = time.monotonic()
+    resets = data_versions.reset_count()
+    changes = data_versions.change_count()
+    # Without a shared backend other workers' saves only show up as data_versions bumps
+    foreign_writes = SHARED_STATE_BACKEND == 'local' and changes - _synced_changes > _local_changes
+    if (_synced_at is None or resets != _synced_resets or foreign_writes
+            or (LATEST_CACHE_RESYNC > 0 and now - _synced_at >= LATEST_CACHE_RESYNC)):
+        with _lock:
+            _synced_at, _synced_resets, _synced_changes, _local_changes = now, resets, changes, 0
+        _sync()
+    with _lock:
+        readings = list(_latest.values())
+    if place and place != 'All':
+        readings = [r for r in readings if r['place'] == place or r['client_place'] == place]
+    readings.sort(key=lambda r: r['ts'], reverse=True)
+    return readings
+
+
+
+subscribe('latest', _on_published)
@@ -0,0 +1,142 @@
+# live_feed.py - Fan-out broker behind the /stream Server-Sent Events endpoint
+# database.py publishes every committed batch of readings once, and batches
+# saved by other workers arrive on shared_state's 'latest' channel; the broker
+# serialises each reading to an SSE frame a single time and hands the same bytes
+# to every subscriber whose place / client filter matches. Each dashboard tab
+# has a small bounded queue - a tab that falls behind is told to resync (reload
+# via /latest-data) instead of slowing ingestion down.
+#
+# Every open stream holds a worker thread: streams end after SSE_MAX_DURATION
+# (EventSource reconnects by itself), and above SSE_MAX_SUBSCRIBERS - never more
+# than WEB_THREADS - SSE_RESERVED_THREADS - new streams are refused so the
+# dashboards fall back to polling and ingestion always has threads to run on.
+import json
+import queue
+import threading
+import time
+from config import SSE_QUEUE_SIZE, SSE_HEARTBEAT, SSE_MAX_DURATION, SSE_MAX_SUBSCRIBERS
+from helpers import convert_to_uk
+from shared_state import subscribe
+import thresholds
+
+RETRY_MS = 3000  # EventSource reconnect delay
+
+
+class Subscriber:
+    """One open /stream response"""
+
+    __slots__ = ('place', 'client_prefix', 'queue', 'dropped')
+
+    def __init__(self, place=None, client_prefix=None):
+        self.place = place if place and place != 'All' else None
+        self.client_prefix = client_prefix  # None = owner, sees every sensor
+        self.queue = queue.Queue(maxsize=SSE_QUEUE_SIZE)
+        self.dropped = False
+
+    def wants(self, client_place, place):
+        if self.client_prefix is not None and not client_place.startswith(self.client_prefix):
+            return False
+        return self.place is None or self.place == place or self.place == client_place
+
+
+class LiveFeedBroker:
+    """Publishes reading frames to every matching subscriber"""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._stats = {'published': 0, 'delivered': 0, 'resyncs': 0, 'refused': 0}
+
+    def subscribe(self, place=None, client_prefix=None):
+        """New Subscriber, or None when SSE_MAX_SUBSCRIBERS streams are already open"""
+        with self._lock:
+            if len(self._subscribers) >= SSE_MAX_SUBSCRIBERS:
+                self._stats['refused'] += 1
+                return None
+            subscriber = Subscriber(place, client_prefix)
+            self._subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, rows):
+        """rows: committed (client_place, place, temperature, humidity, warning, timestamp, ts) tuples"""
+        if not self._subscribers:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+        delivered = resyncs = 0
+        for client_place, place, temperature, humidity, warning, timestamp, ts in rows:
+            targets = [s for s in subscribers if not s.dropped and s.wants(client_place, place)]
+            if not targets:
+                continue
+            (temp_min, temp_max), (hum_min, hum_max) = thresholds.lookup(client_place, place)
+            frame = _frame('warning' if warning else 'reading', {
+                'client_place': client_place, 'place': place, 'temperature': temperature,
+                'humidity': humidity, 'warning': warning, 'timestamp': convert_to_uk(timestamp), 'ts': ts,
+                'temp_alert': not temp_min <= temperature <= temp_max, 'hum_alert': not hum_min <= humidity <= hum_max
+            })
+            for subscriber in targets:
+                try:
+                    subscriber.queue.put_nowait(frame)
+                    delivered += 1
+                except queue.Full:
+                    # Too slow: stop feeding it and let the client reload its table
+                    subscriber.dropped = True
+                    resyncs += 1
+        with self._lock:
+            self._stats['published'] += len(rows)
+            self._stats['delivered'] += delivered
+            self._stats['resyncs'] += resyncs
+
+    def resync_all(self):
+        """Tell every open stream to reload - readings may have been missed"""
+        with self._lock:
+            subscribers = [s for s in self._subscribers if not s.dropped]
+            for subscriber in subscribers:
+                subscriber.dropped = True
+            self._stats['resyncs'] += len(subscribers)
+
+    def stream(self, subscriber):
+        """SSE byte frames for one subscriber until SSE_MAX_DURATION; unsubscribes when done"""
+        deadline = time.monotonic() + SSE_MAX_DURATION
+        try:
+            yield f"retry: {RETRY_MS}\n\n".encode()
+            while time.monotonic() < deadline:
+                if subscriber.dropped:
+                    yield _frame('resync', {})
+                    return
+                try:
+                    yield subscriber.queue.get(timeout=min(SSE_HEARTBEAT, max(deadline - time.monotonic(), 0.01)))
+                except queue.Empty:
+                    yield b": ping\n\n"  # keeps proxies from closing an idle stream
+        finally:
+            self.unsubscribe(subscriber)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats, subscribers=len(self._subscribers))
+
+
+def _frame(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+
+
+_broker = LiveFeedBroker()
+
+
+def get_broker():
+    return _broker
+
+
+def _on_published(rows):
+    """Rows another worker saved (see latest_values.record), or None when messages may have been missed"""
+    if rows is None:
+        _broker.resync_all()
+    else:
+        _broker.publish(rows)
+
+
+subscribe('latest', _on_published)
@@ -0,0 +1,228 @@
+# metrics.py - In-process instrumentation served as Prometheus text at /metrics
+# init_app() wraps every request: latency histogram per endpoint / method /
+# status, plus the number and time of SQL statements it ran (db_pool times each
+# execute on a TimedConnection and reports here). database.py counts ingested
+# rows and email_service times SMTP sends; queue depths and other live values are
+# read from their owners when /metrics is scraped.
+#
+# Values are per worker process - scrape each worker, or aggregate with the
+# usual rate()/sum() queries. Exports (stream_with_context) are measured until
+# the stream ends; /stream deliberately isn't wrapped - it would hold the
+# request's DB connection for the whole stream - so it is timed to the first
+# byte and its SQL ran before that.
+#
+# With METRICS_ENABLED every statement goes through a Python-level TimedConnection
+# wrapper: a few microseconds per execute (about 1 us inside a request, 6 us in
+# background threads, against ~3 us for a trivial query). Set METRICS_ENABLED=0
+# to skip it.
+#
+# Opt-in profiler: with PROFILE_SAMPLE_RATE > 0 that share of requests runs under
+# cProfile, and any sampled request slower than PROFILE_SLOW_SECONDS has its stats
+# dumped to PROFILE_DIR (inspect with `python -m pstats <file>`).
+import bisect
+import os
+import random
+import threading
+import time
+from config import METRICS_ENABLED, PROFILE_SAMPLE_RATE, PROFILE_SLOW_SECONDS, PROFILE_DIR
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+HELP = {
+    'sensor_http_request_duration_seconds': ('histogram', 'Request latency by endpoint, method and status'),
+    'sensor_request_sql_statements': ('histogram', 'SQL statements executed per request'),
+    'sensor_request_sql_seconds': ('histogram', 'Time spent executing SQL per request'),
+    'sensor_sql_statements_total': ('counter', 'SQL statements executed (endpoint "background" outside requests)'),
+    'sensor_sql_seconds_total': ('counter', 'Time spent executing SQL statements'),
+    'sensor_ingested_rows_total': ('counter', 'Readings committed to the database'),
+    'sensor_smtp_send_seconds': ('histogram', 'SMTP send latency of alert emails'),
+    'sensor_profiles_dumped_total': ('counter', 'Slow sampled requests whose cProfile stats were written'),
+}
+
+
+class Histogram:
+    """Cumulative-bucket histogram (Prometheus semantics)"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+_lock = threading.Lock()
+_histograms = {}  # (name, labels) -> Histogram; labels is a tuple of (key, value) pairs
+_counters = {}    # (name, labels) -> value
+_request = threading.local()  # started / sql tally / profiler of the request on this thread
+
+
+def inc(name, value=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+
+def record_sql(seconds):
+    """One statement finished - called by db_pool's TimedConnection / TimedCursor"""
+    tally = getattr(_request, 'sql', None)
+    if tally is not None:
+        tally[0] += 1
+        tally[1] += seconds
+    else:
+        inc('sensor_sql_statements_total', endpoint='background')
+        inc('sensor_sql_seconds_total', seconds, endpoint='background')
+
+
+# ------------------ Flask hooks ------------------
+def _before_request():
+    _request.started = time.perf_counter()
+    _request.sql = [0, 0.0]
+    _request.status = None
+    _request.profiler = None
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return  # another profiler is already active on this thread
+        _request.profiler = profiler
+
+
+def _after_request(response):
+    _request.status = response.status_code
+    return response
+
+
+def _teardown_request(exc=None):
+    # Runs when the request context is popped, i.e. after a streamed body is finished
+    from flask import request
+
+    started = getattr(_request, 'started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    statements, sql_seconds = _request.sql
+    profiler = _request.profiler
+    _request.started = _request.sql = _request.profiler = None
+    endpoint = request.endpoint or 'unmatched'
+    status = _request.status or (500 if exc is not None else 200)
+
+    observe('sensor_http_request_duration_seconds', elapsed, endpoint=endpoint, method=request.method, status=str(status))
+    observe('sensor_request_sql_statements', statements, COUNT_BUCKETS, endpoint=endpoint)
+    observe('sensor_request_sql_seconds', sql_seconds, endpoint=endpoint)
+    inc('sensor_sql_statements_total', statements, endpoint=endpoint)
+    inc('sensor_sql_seconds_total', sql_seconds, endpoint=endpoint)
+
+    if profiler is not None:
+        profiler.disable()
+        if elapsed >= PROFILE_SLOW_SECONDS:
+            _dump_profile(profiler, endpoint, elapsed)
+
+
+def _dump_profile(profiler, endpoint, elapsed):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d_%H%M%S')}_{endpoint}_{int(elapsed * 1000)}ms_{os.getpid()}.prof")
+    try:
+        profiler.dump_stats(path)
+    except OSError as e:
+        print(f"❌ Profile dump failed: {e}")
+        return
+    inc('sensor_profiles_dumped_total')
+    print(f"🐢 Slow request {endpoint} ({elapsed * 1000:.0f} ms) profiled -> {path}")
+
+
+def init_app(app):
+    if not METRICS_ENABLED:
+        return
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+
+# ------------------ exposition ------------------
+def _gauges():
+    """(name, type, help, labels, value) read from their owners at scrape time"""
+    # Import inside function: these modules import db_pool, which imports this one
+    from email_service import get_alert_dispatcher
+    from ingest_buffer import get_ingest_buffer
+    from live_feed import get_broker
+    import anomaly
+
+    alerts = get_alert_dispatcher().get_stats()
+    yield 'sensor_alert_queue_depth', 'gauge', 'Alert emails waiting to be sent', (), alerts['queue_depth']
+    for outcome in ('sent', 'failed', 'dropped_full', 'rejected', 'retries'):
+        yield 'sensor_alert_emails_total', 'counter', 'Alert email outcomes', (('outcome', outcome),), alerts.get(outcome, 0)
+    buffer = get_ingest_buffer()
+    if buffer:
+        stats = buffer.get_stats()
+        yield 'sensor_ingest_buffer_queue_depth', 'gauge', 'Readings waiting in the write-behind queue', (), stats['queue_depth']
+        yield 'sensor_ingest_buffer_dropped_rows_total', 'counter', 'Readings the write-behind queue failed to save', (), stats.get('rows_dropped', 0)
+    feed = get_broker().get_stats()
+    yield 'sensor_live_feed_subscribers', 'gauge', 'Open /stream connections', (), feed['subscribers']
+    yield 'sensor_live_feed_resyncs_total', 'counter', 'Streams told to resync after falling behind', (), feed['resyncs']
+    yield 'sensor_anomaly_sensors', 'gauge', 'Sensors with anomaly statistics in this worker', (), anomaly.get_stats()['sensors']
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    with _lock:
+        histograms = {key: (list(h.counts), h.sum, h.count, h.buckets) for key, h in _histograms.items()}
+        counters = dict(_counters)
+    lines, described = [], set()
+
+    def describe(name, kind=None, text=None):
+        if name not in described:
+            described.add(name)
+            kind, text = (kind, text) if kind else HELP.get(name, ('untyped', name))
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), (counts, total, count, buckets) in sorted(histograms.items()):
+        describe(name)
+        cumulative = 0
+        for bound, bucket_count in zip(buckets + ('+Inf',), counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_labels(labels, ('le', bound))} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+        lines.append(f"{name}_count{_labels(labels)} {count}")
+    for (name, labels), value in sorted(counters.items()):
+        describe(name)
+        lines.append(f"{name}{_labels(labels)} {_number(value)}")
+    for name, kind, text, labels, value in _gauges():
+        describe(name, kind, text)
+        lines.append(f"{name}{_labels(labels)} {_number(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,199 @@
+# migrations.py - Versioned schema migrations
+# The applied version lives in PRAGMA user_version. Each migration runs once,
+# in its own transaction, in the order listed in MIGRATIONS. To change the
+# schema append a new (version, description, function) entry - never edit an
+# applied one.
+import sqlite3
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _add_column(conn, table, column, definition):
+    if column not in _columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        print(f"Added column: {table}.{column}")
+
+
+def _create_base_tables(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS clients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            role TEXT DEFAULT 'client',
+            places TEXT,
+            email_enabled INTEGER DEFAULT 1,
+            email TEXT,
+            phone TEXT,
+            address TEXT,
+            collection_interval INTEGER DEFAULT 10,
+            api_key TEXT UNIQUE,
+            formatted_name TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE,
+            password TEXT,
+            role TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sensor_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            place TEXT,
+            client_place TEXT,
+            temperature REAL,
+            humidity REAL,
+            warning TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS known_places (
+            place TEXT PRIMARY KEY
+        )
+    """)
+
+
+def _add_client_columns(conn):
+    # Databases created by older app.py builds lack some of these
+    _add_column(conn, 'clients', 'password_hash', 'TEXT')
+    _add_column(conn, 'clients', 'role', "TEXT DEFAULT 'client'")
+    _add_column(conn, 'clients', 'api_key', 'TEXT')
+    _add_column(conn, 'clients', 'formatted_name', 'TEXT')
+    _add_column(conn, 'clients', 'collection_interval', 'INTEGER DEFAULT 10')
+
+
+def _add_epoch_timestamps(conn):
+    # Integer UTC epoch seconds next to the display timestamp: cheap to compare and sort
+    _add_column(conn, 'sensor_data', 'ts', 'INTEGER')
+    conn.execute("""
+        UPDATE sensor_data SET ts = CAST(strftime('%s', timestamp) AS INTEGER)
+        WHERE ts IS NULL AND timestamp IS NOT NULL
+    """)
+
+
+def _add_sensor_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sensor_data_ts ON sensor_data (ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sensor_data_place_ts ON sensor_data (place, ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sensor_data_client_place_ts ON sensor_data (client_place, ts)")
+
+
+def _backfill_known_places(conn):
+    # One-off scan (served by the place index); ingestion keeps it current from here on
+    conn.execute("""
+        INSERT OR IGNORE INTO known_places (place)
+        SELECT DISTINCT place FROM sensor_data WHERE place IS NOT NULL AND place != ''
+    """)
+
+
+def _add_api_key_index(conn):
+    # Older clients tables have api_key without the UNIQUE constraint (and its index)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_clients_api_key ON clients (api_key)")
+
+
+def _create_alert_state(conn):
+    # Mirror of alert_state.py's in-memory machine so restarts don't re-fire alerts
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS alert_state (
+            client_place TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            since REAL,
+            last_sent REAL,
+            suppressed INTEGER DEFAULT 0,
+            last_warning TEXT
+        )
+    """)
+
+
+def _create_rollups(conn):
+    from rollups import create_rollup_tables, rebuild_rollups
+    create_rollup_tables(conn)
+    rebuild_rollups(conn)
+
+
+
+def _create_threshold_profiles(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS threshold_profiles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client TEXT,
+            place TEXT,
+            temp_min REAL NOT NULL,
+            temp_max REAL NOT NULL,
+            hum_min REAL NOT NULL,
+            hum_max REAL NOT NULL,
+            updated_at TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_threshold_profiles_scope
+        ON threshold_profiles (IFNULL(client, ''), IFNULL(place, ''))
+    """)
+
+
+def _create_known_client_places(conn):
+    # Sensor registry for latest_values; backfilled once from the daily rollup
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS known_client_places (
+            client_place TEXT PRIMARY KEY
+        )
+    """)
+    conn.execute("""
+        INSERT OR IGNORE INTO known_client_places (client_place)
+        SELECT DISTINCT client_place FROM sensor_rollup_1d
+    """)
+
+
+MIGRATIONS = [
+    (1, "base tables", _create_base_tables),
+    (2, "clients: columns missing from older schemas", _add_client_columns),
+    (3, "sensor_data: integer epoch ts", _add_epoch_timestamps),
+    (4, "sensor_data: ts, (place, ts), (client_place, ts) indexes", _add_sensor_indexes),
+    (5, "known_places: backfill from sensor_data", _backfill_known_places),
+    (6, "clients: api_key index", _add_api_key_index),
+    (7, "alert_state table", _create_alert_state),
+    (8, "1m/1h/1d rollup tables, backfilled", _create_rollups),
+    (9, "threshold_profiles table", _create_threshold_profiles),
+    (10, "known_client_places: backfill from the daily rollup", _create_known_client_places),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn=None):
+    """Apply pending migrations; returns the resulting schema version"""
+    # Import inside function to avoid circular import
+    from database import get_db_connection
+
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    try:
+        version = get_schema_version(conn)
+        for number, description, apply in MIGRATIONS:
+            if number <= version:
+                continue
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                # Another process may have applied it while we waited for the lock
+                if get_schema_version(conn) >= number:
+                    conn.rollback()
+                    continue
+                apply(conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+            print(f"Applied migration {number}: {description}")
+        return get_schema_version(conn)
+    finally:
+        if own_conn:
+            conn.close()
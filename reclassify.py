@@ -0,0 +1,106 @@
+# reclassify.py - Re-evaluate the stored warning column after the alert ranges change
+# Ranges come from the threshold profiles (thresholds.py), so run it after editing
+# profiles or TEMP_RANGE / HUM_RANGE. Walks every reading table (all day partitions,
+# the legacy sensor_data table and archived months) in id order, classifies each
+# chunk with the vectorised helpers.classify_readings and writes back only the rows
+# whose warning changed, one short transaction per chunk. Rollup warning counts are
+# adjusted in the same transaction; cached exports are dropped and data versions
+# bumped afterwards. Anomaly warnings (anomaly.py) depend on the reading history,
+# not the ranges, so they are kept as stored.
+#
+#   python reclassify.py                  everything
+#   python reclassify.py --no-archives    live tables only
+import argparse
+from helpers import classify_readings, render_warnings
+from anomaly import combine
+from rollups import RESOLUTIONS, ROLLUP_TABLES
+import thresholds
+
+DEFAULT_CHUNK_SIZE = 5000
+RANGE_WARNINGS = ("Temperature out of range", "Humidity out of range")
+
+
+def _anomaly_part(warning):
+    """The parts of a stored warning that aren't range checks"""
+    return '; '.join(w for w in warning.split('; ') if w and not w.startswith(RANGE_WARNINGS))
+
+
+def reclassify_table(conn, table, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Rewrite changed warnings in one table; returns the number of rows updated"""
+    changed, last_id = 0, -1
+    while True:
+        rows = conn.execute(
+            f"SELECT id, client_place, ts, temperature, humidity, warning, place FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, chunk_size)
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        temperatures = [row[3] for row in rows]
+        humidities = [row[4] for row in rows]
+        temp_range, hum_range = thresholds.lookup_many([row[1] for row in rows], [row[6] for row in rows])
+        warnings = render_warnings(classify_readings(temperatures, humidities, temp_range, hum_range), temperatures, humidities)
+
+        updates, deltas = [], {}
+        for row, warning in zip(rows, warnings):
+            old = row[5] or ''
+            warning = combine(warning, _anomaly_part(old))
+            if old == warning:
+                continue
+            updates.append((warning, row[0]))
+            delta = bool(warning) - bool(old)
+            if delta and row[2] is not None:
+                for name, width in RESOLUTIONS:
+                    key = (name, row[1], row[2] - row[2] % width)
+                    deltas[key] = deltas.get(key, 0) + delta
+        if not updates:
+            continue
+        with conn:
+            conn.executemany(f"UPDATE {table} SET warning = ? WHERE id = ?", updates)
+            for name, _ in RESOLUTIONS:
+                conn.executemany(
+                    f"UPDATE {ROLLUP_TABLES[name]} SET warnings = warnings + ? WHERE client_place = ? AND bucket = ?",
+                    [(delta, client_place, bucket) for (n, client_place, bucket), delta in deltas.items() if n == name and delta]
+                )
+        changed += len(updates)
+    return changed
+
+
+def reclassify_all(include_archives=True, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Re-evaluate every stored reading; returns {table: rows updated} for tables that changed"""
+    # Import inside function to avoid circular import
+    from db_pool import connect
+    from storage import get_storage
+    from retention import list_archive_months, _attach
+    from exporters import clear_export_cache
+    import data_versions
+
+    result = {}
+    conn = connect()
+    try:
+        for table in get_storage().tables(conn):
+            result[table] = reclassify_table(conn, table, chunk_size)
+        if include_archives:
+            for month in list_archive_months():
+                alias = f"arch_{month}"
+                _attach(conn, month, alias)
+                try:
+                    result[f"{alias}.sensor_data"] = reclassify_table(conn, f"{alias}.sensor_data", chunk_size)
+                finally:
+                    conn.execute("DETACH DATABASE " + alias)
+    finally:
+        conn.close()
+    result = {table: count for table, count in result.items() if count}
+    if result:
+        clear_export_cache()
+        data_versions.bump_all()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-evaluate stored warnings against the current ranges")
+    parser.add_argument("--no-archives", action="store_true", help="skip archived months")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows per transaction")
+    args = parser.parse_args()
+    changed = reclassify_all(not args.no_archives, args.chunk_size)
+    print(f"✅ {sum(changed.values())} warnings updated" + "".join(f"\n  - {t}: {n}" for t, n in changed.items()))
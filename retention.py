@@ -0,0 +1,312 @@
+# retention.py - Retention and monthly archival for sensor_data
+# Raw readings older than RETENTION_RAW_DAYS are either moved to per-month
+# archive databases (RETENTION_MODE='archive', ARCHIVE_DIR/sensor_data_YYYYMM.db)
+# or just deleted because the rollup tables already summarise them
+# (RETENTION_MODE='rollup'). Work is done by one background thread per host in
+# batches of RETENTION_BATCH_SIZE rows, each its own short transaction, so
+# ingestion never waits behind a long write lock. Freed pages are returned
+# with incremental vacuum when the database was created with auto_vacuum=INCREMENTAL.
+# With STORAGE_BACKEND='partitioned' whole expired day partitions are archived
+# (copied in batches, then dropped) or simply dropped - no row-by-row DELETE.
+# Archived months stay readable: exports and the dashboard / data API pages
+# attach them through open_history_connection once the live tables run out.
+#
+#   python retention.py --sweep                     run one sweep now
+#   python retention.py --enable-incremental-vacuum one-off VACUUM (maintenance window)
+import argparse
+import calendar
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from config import (
+    RETENTION_RAW_DAYS,
+    RETENTION_MODE,
+    RETENTION_ROLLUP_1M_DAYS,
+    RETENTION_BATCH_SIZE,
+    RETENTION_PAUSE,
+    RETENTION_INTERVAL,
+    ARCHIVE_DIR
+)
+import data_versions
+
+SENSOR_COLUMNS = "id, timestamp, ts, client_place, place, temperature, humidity, warning"
+# SQLite allows 10 attached databases by default; keep one slot spare
+MAX_ATTACHED_ARCHIVES = 9
+
+
+# ------------------ archive files ------------------
+def _month_key(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y%m")
+
+
+def _month_end(ts):
+    dt = datetime.fromtimestamp(ts, timezone.utc)
+    days = calendar.monthrange(dt.year, dt.month)[1]
+    return int(datetime(dt.year, dt.month, 1, tzinfo=timezone.utc).timestamp()) + days * 86400
+
+
+def archive_path(month):
+    return os.path.abspath(os.path.join(ARCHIVE_DIR, f"sensor_data_{month}.db"))
+
+
+def list_archive_months():
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    return sorted(name[len("sensor_data_"):-3] for name in os.listdir(ARCHIVE_DIR)
+                  if name.startswith("sensor_data_") and name.endswith(".db"))
+
+
+def _attach(conn, month, alias):
+    # ATTACH creates the file if needed; schema keeps the original ids so re-runs are idempotent
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    conn.execute("ATTACH DATABASE ? AS " + alias, (archive_path(month),))
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {alias}.sensor_data (
+            id INTEGER PRIMARY KEY,
+            timestamp TEXT,
+            ts INTEGER,
+            client_place TEXT,
+            place TEXT,
+            temperature REAL,
+            humidity REAL,
+            warning TEXT
+        )
+    """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {alias}.idx_archive_ts ON sensor_data (ts)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {alias}.idx_archive_place_ts ON sensor_data (place, ts)")
+
+
+def archived_months(start_ts=None, end_ts=None):
+    """Archive months overlapping [start_ts, end_ts), oldest first - a directory listing, no SQL"""
+    months = list_archive_months()
+    if start_ts is not None:
+        months = [m for m in months if m >= _month_key(start_ts)]
+    if end_ts is not None:
+        months = [m for m in months if m <= _month_key(max(end_ts - 1, 0))]
+    return months
+
+
+def open_history_connection(start_ts=None, end_ts=None):
+    """Connection plus the archive tables to read for [start_ts, end_ts), newest month first.
+
+    Archived months overlapping the range (the most recent MAX_ATTACHED_ARCHIVES of
+    them) are attached, and e.g. 'arch_202401.sensor_data' is returned for each; the
+    list is empty when nothing archived overlaps.
+    """
+    # Import inside function to avoid circular import
+    from db_pool import connect
+
+    conn = connect()
+    months = archived_months(start_ts, end_ts)
+    if len(months) > MAX_ATTACHED_ARCHIVES:
+        print(f"⚠️ Range spans {len(months)} archived months; only the latest {MAX_ATTACHED_ARCHIVES} are included")
+        months = months[-MAX_ATTACHED_ARCHIVES:]
+    tables = []
+    for month in reversed(months):
+        alias = f"arch_{month}"
+        _attach(conn, month, alias)
+        tables.append(f"{alias}.sensor_data")
+    return conn, tables
+
+
+# ------------------ sweeps ------------------
+def _archive_batch(conn, cutoff):
+    """Move up to RETENTION_BATCH_SIZE of the oldest expired rows; returns rows moved"""
+    oldest = conn.execute("SELECT MIN(ts) FROM sensor_data WHERE ts IS NOT NULL").fetchone()[0]
+    if oldest is None or oldest >= cutoff:
+        return 0
+    month = _month_key(oldest)
+    upper = min(cutoff, _month_end(oldest))  # one archive file per batch
+    ids = [row[0] for row in conn.execute(
+        "SELECT id FROM sensor_data WHERE ts < ? ORDER BY ts LIMIT ?", (upper, RETENTION_BATCH_SIZE))]
+    if not ids:
+        return 0
+    alias = "arch_sweep"
+    _attach(conn, month, alias)
+    try:
+        marks = ",".join("?" * len(ids))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"""
+                INSERT OR IGNORE INTO {alias}.sensor_data ({SENSOR_COLUMNS})
+                SELECT {SENSOR_COLUMNS} FROM main.sensor_data WHERE id IN ({marks})
+            """, ids)
+            conn.execute(f"DELETE FROM main.sensor_data WHERE id IN ({marks})", ids)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        conn.execute("DETACH DATABASE " + alias)
+    return len(ids)
+
+
+def _delete_batch(conn, cutoff):
+    """Drop up to RETENTION_BATCH_SIZE expired rows (rollup mode); returns rows deleted"""
+    with conn:
+        cursor = conn.execute("""
+            DELETE FROM sensor_data WHERE id IN (
+                SELECT id FROM sensor_data WHERE ts < ? ORDER BY ts LIMIT ?
+            )
+        """, (cutoff, RETENTION_BATCH_SIZE))
+    return cursor.rowcount
+
+
+def _prune_rollup_batch(conn, cutoff):
+    with conn:
+        cursor = conn.execute("""
+            DELETE FROM sensor_rollup_1m WHERE (client_place, bucket) IN (
+                SELECT client_place, bucket FROM sensor_rollup_1m WHERE bucket < ? LIMIT ?
+            )
+        """, (cutoff, RETENTION_BATCH_SIZE))
+    return cursor.rowcount
+
+
+def _archive_partition(conn, table, stop=None):
+    """Copy one expired day partition into its month archive in batches, then drop it"""
+    from storage import _name_day, get_storage
+
+    alias = "arch_sweep"
+    _attach(conn, _month_key(_name_day(table) * 86400), alias)
+    moved, last_id = 0, -1
+    try:
+        while True:
+            if stop and stop.is_set():
+                return moved  # partition stays; the next sweep re-copies idempotently
+            upper, count = conn.execute(f"""
+                SELECT MAX(id), COUNT(*) FROM (SELECT id FROM main.{table} WHERE id > ? ORDER BY id LIMIT ?)
+            """, (last_id, RETENTION_BATCH_SIZE)).fetchone()
+            if not count:
+                break
+            # Only the attached archive is written here, so ingestion into main isn't blocked
+            with conn:
+                conn.execute(f"""
+                    INSERT OR IGNORE INTO {alias}.sensor_data ({SENSOR_COLUMNS})
+                    SELECT {SENSOR_COLUMNS} FROM main.{table} WHERE id > ? AND id <= ?
+                """, (last_id, upper))
+            last_id, moved = upper, moved + count
+            time.sleep(RETENTION_PAUSE)
+        with conn:
+            get_storage().drop(conn, table)
+    finally:
+        conn.execute("DETACH DATABASE " + alias)
+    return moved
+
+
+def _expire_partitions(conn, cutoff, stop=None):
+    """Archive or drop whole day partitions older than cutoff; returns rows removed"""
+    from storage import get_storage
+
+    storage = get_storage()
+    total = 0
+    for table in storage.expired_tables(conn, cutoff):
+        if stop and stop.is_set():
+            break
+        if RETENTION_MODE == 'archive':
+            total += _archive_partition(conn, table, stop)
+        else:
+            total += conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            with conn:
+                storage.drop(conn, table)
+    return total
+
+
+def _drain(step, conn, cutoff, stop=None):
+    total = 0
+    while not (stop and stop.is_set()):
+        done = step(conn, cutoff)
+        if not done:
+            break
+        total += done
+        time.sleep(RETENTION_PAUSE)  # let writers in between batches
+    return total
+
+
+def run_sweep(now=None, stop=None):
+    """One retention pass; returns {'raw': rows, 'rollup_1m': rows}"""
+    from db_pool import connect
+
+    now = now if now is not None else time.time()
+    result = {'raw': 0, 'rollup_1m': 0}
+    conn = connect()
+    try:
+        if RETENTION_RAW_DAYS > 0:
+            cutoff = int(now - RETENTION_RAW_DAYS * 86400)
+            result['raw'] = _expire_partitions(conn, cutoff, stop)
+            # Legacy / single-table readings still go row batch by row batch
+            step = _archive_batch if RETENTION_MODE == 'archive' else _delete_batch
+            result['raw'] += _drain(step, conn, cutoff, stop)
+        if RETENTION_ROLLUP_1M_DAYS > 0:
+            result['rollup_1m'] = _drain(_prune_rollup_batch, conn, int(now - RETENTION_ROLLUP_1M_DAYS * 86400), stop)
+        if result['raw']:
+            data_versions.bump_all()  # cached dashboards / exports no longer match
+        if (result['raw'] or result['rollup_1m']) and conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            conn.execute("PRAGMA incremental_vacuum(1000)").fetchall()
+    finally:
+        conn.close()
+    if result['raw'] or result['rollup_1m']:
+        print(f"🧹 Retention: {result['raw']} raw readings {'archived' if RETENTION_MODE == 'archive' else 'deleted'}, "
+              f"{result['rollup_1m']} 1-minute buckets pruned")
+    return result
+
+
+def enable_incremental_vacuum():
+    """Switch an existing database to auto_vacuum=INCREMENTAL (rewrites the whole file)"""
+    from db_pool import connect
+
+    conn = connect()
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    finally:
+        conn.close()
+
+
+# ------------------ background worker ------------------
+_worker = None
+_stop = threading.Event()
+
+
+def _run_worker(lock_file):
+    while not _stop.is_set():
+        try:
+            run_sweep(stop=_stop)
+        except Exception as e:
+            print(f"❌ Retention sweep failed: {e}")
+        _stop.wait(RETENTION_INTERVAL)
+    lock_file.close()
+
+
+def start_retention_worker():
+    """Start the sweeper unless retention is off or another process on this host runs it"""
+    global _worker
+    if (RETENTION_RAW_DAYS <= 0 and RETENTION_ROLLUP_1M_DAYS <= 0) or _worker is not None:
+        return False
+    import fcntl
+
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    lock_file = open(os.path.join(ARCHIVE_DIR, ".retention.lock"), "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _worker = threading.Thread(target=_run_worker, args=(lock_file,), name='retention', daemon=True)
+    _worker.start()
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="sensor_data retention and archival")
+    parser.add_argument("--sweep", action="store_true", help="run one retention sweep now")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="one-off VACUUM switching the database to auto_vacuum=INCREMENTAL")
+    args = parser.parse_args()
+    if args.enable_incremental_vacuum:
+        print("✅ Incremental vacuum enabled" if enable_incremental_vacuum() else "❌ Could not enable incremental vacuum")
+    if args.sweep:
+        print(run_sweep())
+    if not (args.sweep or args.enable_incremental_vacuum):
+        parser.print_help()
@@ -0,0 +1,182 @@
+# rollups.py - Time-bucketed min/max/mean per client_place at 1-minute, 1-hour and 1-day resolution
+# save_sensor_data / save_sensor_data_batch call update_rollups() inside their
+# transaction, so the buckets are always in step with the raw readings. Long-range
+# charts and reports read query_rollups(), which costs O(buckets), not O(readings).
+#
+#   python rollups.py --rebuild   recompute the buckets the raw readings still cover
+import argparse
+import time
+from config import RETENTION_ROLLUP_1M_DAYS
+
+# (name, bucket width in seconds) - finest first
+RESOLUTIONS = [('1m', 60), ('1h', 3600), ('1d', 86400)]
+ROLLUP_TABLES = {name: f"sensor_rollup_{name}" for name, _ in RESOLUTIONS}
+
+# SQLite's two-argument min() / max() and + return NULL if either side is NULL (a NaN is
+# stored as NULL), so the coalesce()s keep one NULL value from wiping a bucket's aggregates
+_UPSERT = """
+    INSERT INTO {table} (client_place, bucket, place, count, warnings,
+                         temp_sum, temp_min, temp_max, hum_sum, hum_min, hum_max)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (client_place, bucket) DO UPDATE SET
+        count = count + excluded.count,
+        warnings = warnings + excluded.warnings,
+        temp_sum = coalesce(temp_sum + excluded.temp_sum, temp_sum, excluded.temp_sum),
+        temp_min = coalesce(min(temp_min, excluded.temp_min), temp_min, excluded.temp_min),
+        temp_max = coalesce(max(temp_max, excluded.temp_max), temp_max, excluded.temp_max),
+        hum_sum = coalesce(hum_sum + excluded.hum_sum, hum_sum, excluded.hum_sum),
+        hum_min = coalesce(min(hum_min, excluded.hum_min), hum_min, excluded.hum_min),
+        hum_max = coalesce(max(hum_max, excluded.hum_max), hum_max, excluded.hum_max)
+"""
+
+
+def create_rollup_tables(conn):
+    for table in ROLLUP_TABLES.values():
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                client_place TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                place TEXT,
+                count INTEGER NOT NULL,
+                warnings INTEGER NOT NULL,
+                temp_sum REAL, temp_min REAL, temp_max REAL,
+                hum_sum REAL, hum_min REAL, hum_max REAL,
+                PRIMARY KEY (client_place, bucket)
+            ) WITHOUT ROWID
+        """)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_place ON {table} (place, bucket)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table} (bucket)")
+
+
+def update_rollups(conn, rows):
+    """Fold readings into every resolution inside the caller's transaction.
+
+    rows: (client_place, place, temperature, humidity, warning, ts) tuples.
+    Pre-aggregated in Python first, so a batch costs one upsert per touched bucket.
+    """
+    for name, width in RESOLUTIONS:
+        buckets = {}
+        for client_place, place, temperature, humidity, warning, ts in rows:
+            if ts is None:
+                continue
+            key = (client_place, ts - ts % width)
+            agg = buckets.get(key)
+            if agg is None:
+                buckets[key] = [place, 1, 1 if warning else 0,
+                                temperature, temperature, temperature, humidity, humidity, humidity]
+            else:
+                agg[1] += 1
+                agg[2] += 1 if warning else 0
+                agg[3] += temperature
+                agg[4] = min(agg[4], temperature)
+                agg[5] = max(agg[5], temperature)
+                agg[6] += humidity
+                agg[7] = min(agg[7], humidity)
+                agg[8] = max(agg[8], humidity)
+        if buckets:
+            conn.executemany(_UPSERT.format(table=ROLLUP_TABLES[name]),
+                             [(cp, bucket, *agg) for (cp, bucket), agg in buckets.items()])
+
+
+def rebuild_rollups(conn, since_ts=None):
+    """Recompute buckets from the raw readings (backfill, or after raw readings were rewritten).
+
+    Only the span the live tables still hold is rebuilt: buckets of archived or
+    rolled-up-and-deleted readings, older than the oldest live reading, are kept.
+    """
+    # Import inside function to avoid circular import
+    from storage import get_storage
+
+    sources = get_storage().tables(conn, since_ts)
+    oldest = [conn.execute(f"SELECT MIN(ts) FROM {source}").fetchone()[0] for source in sources]
+    oldest_live = min((ts for ts in oldest if ts is not None), default=None)
+    if oldest_live is None and any(
+            conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() for table in ROLLUP_TABLES.values()):
+        return  # no raw readings left to rebuild from - the buckets are all there is
+    for name, width in RESOLUTIONS:
+        table = ROLLUP_TABLES[name]
+        start = since_ts - since_ts % width if since_ts is not None else None
+        if oldest_live is not None:
+            oldest_bucket = conn.execute(f"SELECT MIN(bucket) FROM {table}").fetchone()[0]
+            if oldest_bucket is not None and oldest_bucket < oldest_live - oldest_live % width:
+                # History older than the live tables: start at the first bucket they fully cover
+                floor = oldest_live + (-oldest_live % width)
+                start = floor if start is None else max(start, floor)
+        if start is not None:
+            conn.execute(f"DELETE FROM {table} WHERE bucket >= ?", (start,))
+            where, params = ("WHERE ts >= ?", [start])
+        else:
+            conn.execute(f"DELETE FROM {table}")
+            where, params = ("WHERE ts IS NOT NULL", [])
+        # Readings may be split over several partitions, so buckets are merged with the upsert
+        for source in sources:
+            conn.execute(f"""
+                INSERT INTO {table} (client_place, bucket, place, count, warnings,
+                                     temp_sum, temp_min, temp_max, hum_sum, hum_min, hum_max)
+                SELECT client_place, ts - ts % {width}, MAX(place), COUNT(*),
+                       SUM(CASE WHEN warning IS NOT NULL AND warning != '' THEN 1 ELSE 0 END),
+                       SUM(temperature), MIN(temperature), MAX(temperature),
+                       SUM(humidity), MIN(humidity), MAX(humidity)
+                FROM {source} {where}
+                GROUP BY client_place, ts - ts % {width}
+            """ + _UPSERT[_UPSERT.index("ON CONFLICT"):], params)
+
+
+def choose_resolution(start_ts, end_ts, max_points=500):
+    """Finest resolution whose bucket count over [start_ts, end_ts) stays within max_points"""
+    span = max(end_ts - start_ts, 1)
+    for name, width in RESOLUTIONS:
+        if span / width <= max_points:
+            return name, width
+    return RESOLUTIONS[-1]
+
+
+def query_rollups(client_place=None, place=None, start_ts=None, end_ts=None, max_points=500):
+    """Buckets covering [start_ts, end_ts) at the resolution picked by choose_resolution
+    (1 hour instead of 1 minute where retention already pruned the 1-minute buckets).
+
+    Without client_place, sensors are merged per bucket (sums and extremes combine exactly).
+    Returns (resolution name, list of bucket dicts oldest first).
+    """
+    # Import inside function to avoid circular import
+    from database import get_db_connection
+
+    end_ts = end_ts if end_ts is not None else int(time.time()) + 1
+    start_ts = start_ts if start_ts is not None else end_ts - 86400
+    name, width = choose_resolution(start_ts, end_ts, max_points)
+    if name == '1m' and RETENTION_ROLLUP_1M_DAYS > 0 and start_ts < time.time() - RETENTION_ROLLUP_1M_DAYS * 86400:
+        name, width = RESOLUTIONS[1]  # retention pruned 1-minute buckets this old; hourly ones are kept
+    clauses, params = ["bucket >= ?", "bucket < ?"], [start_ts - start_ts % width, end_ts]
+    if client_place:
+        clauses.append("client_place = ?")
+        params.append(client_place)
+    if place and place != 'All':
+        clauses.append("place = ?")
+        params.append(place)
+    conn = get_db_connection()
+    rows = conn.execute(f"""
+        SELECT bucket, SUM(count) AS count, SUM(warnings) AS warnings,
+               SUM(temp_sum) / SUM(count) AS temp_mean, MIN(temp_min) AS temp_min, MAX(temp_max) AS temp_max,
+               SUM(hum_sum) / SUM(count) AS hum_mean, MIN(hum_min) AS hum_min, MAX(hum_max) AS hum_max
+        FROM {ROLLUP_TABLES[name]}
+        WHERE {' AND '.join(clauses)}
+        GROUP BY bucket
+        ORDER BY bucket
+    """, params).fetchall()
+    conn.close()
+    return name, [dict(row) for row in rows]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain sensor_data rollup tables")
+    parser.add_argument("--rebuild", action="store_true", help="recompute buckets from the raw readings still in the live tables")
+    parser.add_argument("--since", type=int, help="only rebuild buckets from this epoch second on")
+    args = parser.parse_args()
+    if args.rebuild:
+        from database import get_db_connection
+        conn = get_db_connection()
+        with conn:
+            rebuild_rollups(conn, args.since)
+        print("✅ Rollups rebuilt")
+    else:
+        parser.print_help()
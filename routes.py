@@ -2,13 +2,14 @@
 # ALL routes included - no placeholders - ready to copy-paste
 # Dynamic API keys: auto-generated on registration, stored in DB, checked on submit
 # HTML separated into templates/login.html and templates/forgot_password.html
-from flask import request, jsonify, render_template, send_file, redirect, url_for, session, abort, flash
-import pandas as pd
+from flask import request, jsonify, render_template, send_file, redirect, url_for, session, abort, flash, Response, stream_with_context, make_response
+import hashlib
 import io
-from datetime import datetime
+import math
+from datetime import datetime, timezone
 import re
 import secrets
-from config import UK_TZ, TEMP_RANGE, HUM_RANGE
+from config import UK_TZ, TEMP_RANGE, HUM_RANGE, MAX_BATCH_SIZE, METRICS_TOKEN
 from database import (
     get_db_connection,
     get_user_by_username,
@@ -18,11 +19,27 @@ from database import (
     update_user_email_enabled,
     get_all_clients,
     delete_client,
-    save_sensor_data
+    save_sensor_data,
+    save_sensor_data_batch,
+    get_known_places,
+    get_sensor_page,
+    PAGE_COLUMNS,
+    iter_sensor_data
 )
-from helpers import convert_to_uk, check_sensor_ranges
-from email_service import send_alert_email
+from helpers import convert_to_uk, check_sensor_ranges, classify_readings, render_warnings, date_to_epoch
+from email_service import get_alert_dispatcher
+from alert_state import process_reading, process_batch
+from exporters import FORMATS, ExportError, export_stream, cached_export
+from rollups import query_rollups
 from simulation_generator import create_simulation_file
+from ingest_buffer import get_ingest_buffer
+import api_key_cache
+import latest_values
+import thresholds
+import anomaly
+import metrics
+import data_versions
+from live_feed import get_broker
 from auth import login_required, authenticate_user
 
 
@@ -84,6 +101,7 @@ def handle_client_registration():
             conn.execute("UPDATE clients SET formatted_name = ? WHERE username = ?", (formatted_name, username))
             conn.commit()
             conn.close()
+            api_key_cache.invalidate(username)
            
             try:
                 create_simulation_file(username, place, collection_interval, api_key)
@@ -117,12 +135,55 @@ def handle_password_reset():
     success = update_client_password(username, new_password) if user['role'] == 'client' else update_owner_password(username, new_password)
     return (True, "Password reset!") if success else (False, "Reset failed")
 
-# ------------------ get_known_places ------------------
-def get_known_places():
-    conn = get_db_connection()
-    places = [row[0] for row in conn.execute("SELECT DISTINCT place FROM sensor_data").fetchall()]
-    conn.close()
-    return places
+# ------------------ parse_sensor_reading ------------------
+def parse_sensor_reading(payload, client_name):
+    """Validate one submitted reading -> (client_place, place, temperature, humidity)
+
+    Raises KeyError (message in args[0]) for missing fields or a blank place, and
+    TypeError / ValueError for bad numbers (including NaN / infinity).
+    """
+    required = ['place', 'temperature', 'humidity']
+    if not isinstance(payload, dict) or not all(k in payload for k in required):
+        raise KeyError("Missing fields")
+    temperature = float(payload['temperature'])
+    humidity = float(payload['humidity'])
+    if not (math.isfinite(temperature) and math.isfinite(humidity)):
+        raise ValueError("Non-finite reading")
+    place = format_username_place(payload['place']) if isinstance(payload['place'], str) else None
+    if not place:
+        raise KeyError("Missing place")
+    return f"{client_name}_{place}", place, temperature, humidity
+
+# ------------------ threshold colouring ------------------
+def flag_out_of_range(row):
+    """Add temp_alert / hum_alert to a reading dict using its sensor's threshold profile"""
+    (temp_min, temp_max), (hum_min, hum_max) = thresholds.lookup(row['client_place'], row['place'])
+    row['temp_alert'] = row['temperature'] is not None and not temp_min <= row['temperature'] <= temp_max
+    row['hum_alert'] = row['humidity'] is not None and not hum_min <= row['humidity'] <= hum_max
+    return row
+
+# ------------------ conditional GET ------------------
+def data_validators(place=None, *variant):
+    """(ETag, Last-Modified) for a response that only changes with place's data version"""
+    version, modified = data_versions.get_version(place)
+    key = "|".join([version, *(str(v) for v in variant)])
+    etag = hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+    return etag, datetime.fromtimestamp(modified, timezone.utc) if modified else None
+
+def with_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'  # browsers keep it but always revalidate
+    return response
+
+def not_modified(etag, last_modified):
+    """304 response when the client's copy is current, else None - checked before any query"""
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    else:
+        fresh = bool(request.if_modified_since and last_modified and last_modified <= request.if_modified_since)
+    return with_validators(Response(status=304), etag, last_modified) if fresh else None
 
 # ------------------ setup_routes ------------------
 def setup_routes(app):
@@ -176,17 +237,21 @@ def setup_routes(app):
     @app.route('/dashboard')
     @login_required
     def dashboard():
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, timestamp, client_place, place, temperature, humidity, warning FROM sensor_data ORDER BY timestamp DESC LIMIT 200")
-        data = cursor.fetchall()
-        conn.close()
+        etag, last_modified = data_validators(None, 'dashboard', session.get('username'), session.get('role'))
+        # Pending flash messages must be rendered, never answered with 304
+        if '_flashes' not in session:
+            cached = not_modified(etag, last_modified)
+            if cached:
+                return cached
+       
+        rows, next_cursor = get_sensor_page(limit=200)
        
         # Convert to list of dicts
-        data_list = [dict(row) for row in data]
+        data_list = [flag_out_of_range(dict(zip(PAGE_COLUMNS, row))) for row in rows]
         places = get_known_places()  # For filter dropdown
        
-        return render_template('dashboard.html', data=data_list, places=places)
+        response = make_response(render_template('dashboard.html', data=data_list, places=places, next_cursor=next_cursor, filters={}))
+        return with_validators(response, etag, last_modified)
 
     @app.route('/submit-data', methods=['POST'])
     def submit_data():
@@ -194,49 +259,101 @@ def setup_routes(app):
         if not api_key:
             return jsonify({"error": "Missing API key"}), 401
        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT username, formatted_name FROM clients WHERE api_key = ?", (api_key,))
-        client = cursor.fetchone()
-        conn.close()
-       
+        client = api_key_cache.lookup(api_key)
         if not client:
             return jsonify({"error": "Invalid API key"}), 401
        
-        username, formatted_name = client
-        client_name = formatted_name or username
+        client_name = client['formatted_name'] or client['username']
+        payload = request.get_json(silent=True)
+        if not payload:
+            return jsonify({"error": "No JSON"}), 400
         try:
-            payload = request.get_json()
-            if not payload:
-                return jsonify({"error": "No JSON"}), 400
-           
-            required = ['place', 'temperature', 'humidity']
-            if not all(k in payload for k in required):
-                return jsonify({"error": "Missing fields"}), 400
-           
-            temperature = float(payload['temperature'])
-            humidity = float(payload['humidity'])
-            place = format_username_place(payload['place'])
-            client_place = f"{client_name}_{place}"
-            warning = check_sensor_ranges(temperature, humidity) or ""
+            client_place, place, temperature, humidity = parse_sensor_reading(payload, client_name)
+        except KeyError as e:
+            return jsonify({"error": e.args[0]}), 400
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid number format"}), 400
+       
+        try:
+            warning = anomaly.combine(check_sensor_ranges(temperature, humidity, *thresholds.lookup(client_place, place)),
+                                      anomaly.check_reading(client_place, temperature, humidity))
            
-            save_sensor_data(client_place, place, temperature, humidity, warning)
+            reading = (client_place, place, temperature, humidity, warning)
+            buffer = get_ingest_buffer()
+            if not (buffer and buffer.submit(reading)):
+                save_sensor_data(*reading)
            
-            if warning:
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute("SELECT email_enabled FROM clients WHERE username = ?", (username,))
-                row = cursor.fetchone()
-                conn.close()
-                if row and row[0] == 1:
-                    send_alert_email(client_name, place, temperature, humidity, warning)
+            process_reading(client, client_name, client_place, place, temperature, humidity, warning)
            
             return jsonify({"status": "success", "client": client_name, "warning": warning}), 200
-        except ValueError:
-            return jsonify({"error": "Invalid number format"}), 400
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
+    @app.route('/submit-data/batch', methods=['POST'])
+    def submit_data_batch():
+        api_key = request.headers.get('X-API-Key')
+        if not api_key:
+            return jsonify({"error": "Missing API key"}), 401
+       
+        client = api_key_cache.lookup(api_key)
+        if not client:
+            return jsonify({"error": "Invalid API key"}), 401
+       
+        client_name = client['formatted_name'] or client['username']
+       
+        payload = request.get_json(silent=True)
+        readings = payload.get('readings') if isinstance(payload, dict) else payload
+        if not isinstance(readings, list) or not readings:
+            return jsonify({"error": "Expected a non-empty list of readings"}), 400
+        if len(readings) > MAX_BATCH_SIZE:
+            return jsonify({"error": f"Batch too large (max {MAX_BATCH_SIZE})"}), 413
+       
+        # Validate and range-check the whole batch before touching the DB
+        results = []
+        parsed = []
+        for index, item in enumerate(readings):
+            try:
+                parsed.append(parse_sensor_reading(item, client_name))
+            except KeyError as e:
+                results.append({"index": index, "status": "error", "error": e.args[0]})
+                continue
+            except (TypeError, ValueError):
+                results.append({"index": index, "status": "error", "error": "Invalid number format"})
+                continue
+            results.append({"index": index, "status": "success"})
+        temperatures = [reading[2] for reading in parsed]
+        humidities = [reading[3] for reading in parsed]
+        temp_range, hum_range = thresholds.lookup_many([r[0] for r in parsed], [r[1] for r in parsed])
+        warnings = render_warnings(classify_readings(temperatures, humidities, temp_range, hum_range), temperatures, humidities)
+        # Anomaly statistics are sequential per sensor, so this part runs row by row in submitted order
+        warnings = [anomaly.combine(warning, anomaly.check_reading(reading[0], reading[2], reading[3]))
+                    for reading, warning in zip(parsed, warnings)]
+        rows = [(*reading, warning) for reading, warning in zip(parsed, warnings)]
+        accepted = iter(warnings)
+        for result in results:
+            if result["status"] == "success":
+                result["warning"] = next(accepted)
+       
+        try:
+            save_sensor_data_batch(rows)
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+       
+        # Rows are already committed - an alert failure must not fail the batch
+        try:
+            process_batch(client, client_name, rows)
+        except Exception as e:
+            print(f"❌ Batch alert error: {e}")
+       
+        status = 200 if rows else 400
+        return jsonify({
+            "status": "success" if rows else "error",
+            "client": client_name,
+            "accepted": len(rows),
+            "rejected": len(readings) - len(rows),
+            "results": results
+        }), status
+
     @app.route('/update-client', methods=['POST'])
     @login_required
     def update_client_route():
@@ -251,29 +368,111 @@ def setup_routes(app):
         return redirect(url_for('manage_clients'))
 
     @app.route('/download-csv')
+    @app.route('/export')
     @login_required
     def download_csv():
-        conn = get_db_connection()
-        df = pd.read_sql_query("""
-            SELECT timestamp, client_place AS "Client & Place", place AS "Place",
-                   temperature AS "Temperature (°C)", humidity AS "Humidity (%)", warning AS "Warning"
-            FROM sensor_data
-            ORDER BY timestamp DESC
-        """, conn)
-        conn.close()
-       
-        output = io.StringIO()
-        df.to_csv(output, index=False)
-        output.seek(0)
+        fmt = request.args.get('format', 'csv')
+        place = request.args.get('place')
+        start_ts = date_to_epoch(request.args.get('start_date'))
+        end_ts = date_to_epoch(request.args.get('end_date'), end_of_day=True)
+        if fmt not in FORMATS:
+            return jsonify({"error": f"Unknown format (use one of: {', '.join(FORMATS)})"}), 400
+        mimetype, extension = FORMATS[fmt]
+        etag, last_modified = data_validators(place, 'export', fmt, start_ts, end_ts)
+        unchanged = not_modified(etag, last_modified)
+        if unchanged:
+            return unchanged
+       
+        # Past date ranges never change - serve the copy made by an earlier export
+        cached = cached_export(fmt, place, start_ts, end_ts)
+        if cached:
+            response = send_file(cached, mimetype=mimetype, as_attachment=True, etag=False,
+                                 download_name=f'sensor_data_{request.args.get("start_date") or "start"}_{request.args.get("end_date")}.{extension}')
+            return with_validators(response, etag, last_modified)
        
-        filename = f'sensor_data_{datetime.now(UK_TZ).strftime("%Y%m%d_%H%M")}.csv'
-        return send_file(
-            io.BytesIO(output.getvalue().encode('utf-8')),
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=filename
+        try:
+            stream = export_stream(fmt, iter_sensor_data(place, start_ts, end_ts), place, start_ts, end_ts)
+        except ExportError as e:
+            return jsonify({"error": str(e)}), 400
+       
+        filename = f'sensor_data_{datetime.now(UK_TZ).strftime("%Y%m%d_%H%M")}.{extension}'
+        response = Response(
+            stream_with_context(stream),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+        return with_validators(response, etag, last_modified)
+
+    @app.route('/latest-data')
+    @login_required
+    def latest_data():
+        """Newest reading of each sensor (optionally one place), served from memory"""
+        place = request.args.get('place')
+        etag, last_modified = data_validators(place, 'latest', place)
+        cached = not_modified(etag, last_modified)
+        if cached:
+            return cached
+        readings = latest_values.get_latest(place)
+        response = jsonify([flag_out_of_range(dict(r, timestamp=convert_to_uk(r['timestamp']))) for r in readings])
+        return with_validators(response, etag, last_modified)
+
+    @app.route('/stream')
+    @login_required
+    def stream():
+        """Server-Sent Events: new readings ('reading' / 'warning' events) for one place, or all"""
+        client_prefix = None
+        if session.get('role') != 'owner':
+            user = get_user_by_username(session.get('username')) or {}
+            client_prefix = f"{user.get('formatted_name') or session.get('username')}_"
+        subscriber = get_broker().subscribe(request.args.get('place'), client_prefix)
+        if subscriber is None:
+            # Dashboards fall back to polling /latest-data
+            return jsonify({"error": "Too many live streams"}), 503
+        return Response(
+            get_broker().stream(subscriber),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
         )
 
+    @app.route('/api/data')
+    @login_required
+    def data_api():
+        """Keyset-paginated readings: pass back `next` as `cursor` for the following (older) page"""
+        etag, last_modified = data_validators(request.args.get('place'), 'data', *sorted(request.args.items(multi=True)))
+        cached = not_modified(etag, last_modified)
+        if cached:
+            return cached
+        try:
+            limit = max(1, min(int(request.args.get('limit', 200)), 1000))
+            rows, next_cursor = get_sensor_page(
+                place=request.args.get('place'),
+                client=request.args.get('client', '').strip(),
+                place_contains=request.args.get('place_contains', '').strip(),
+                start_ts=date_to_epoch(request.args.get('start_date')),
+                end_ts=date_to_epoch(request.args.get('end_date'), end_of_day=True),
+                cursor=request.args.get('cursor'),
+                limit=limit
+            )
+        except ValueError:
+            return jsonify({"error": "Invalid limit or cursor"}), 400
+        return with_validators(jsonify({"columns": PAGE_COLUMNS, "rows": rows, "next": next_cursor}), etag, last_modified)
+
+    @app.route('/api/rollups')
+    @login_required
+    def rollups_api():
+        try:
+            max_points = min(int(request.args.get('max_points', 500)), 5000)
+        except ValueError:
+            return jsonify({"error": "Invalid max_points"}), 400
+        resolution, buckets = query_rollups(
+            client_place=request.args.get('client_place'),
+            place=request.args.get('place'),
+            start_ts=date_to_epoch(request.args.get('start_date')),
+            end_ts=date_to_epoch(request.args.get('end_date'), end_of_day=True),
+            max_points=max_points
+        )
+        return jsonify({"resolution": resolution, "buckets": buckets})
+
     @app.route('/refresh')
     @login_required
     def refresh():
@@ -294,7 +493,43 @@ def setup_routes(app):
             return redirect(url_for('dashboard'))
            
         clients = get_all_clients()
-        return render_template('manage_clients.html', clients=clients)
+        return render_template('manage_clients.html', clients=clients, profiles=thresholds.get_profiles(),
+                               default_ranges=(TEMP_RANGE, HUM_RANGE))
+
+    @app.route('/thresholds', methods=['POST'])
+    @login_required
+    def save_threshold_profile():
+        if session.get('username') != 'owner':
+            flash('Access denied', 'error')
+            return redirect(url_for('dashboard'))
+       
+        form = request.form
+        try:
+            thresholds.save_profile(form.get('client', '').strip(), format_username_place(form.get('place', '').strip()),
+                                    form.get('temp_min'), form.get('temp_max'), form.get('hum_min'), form.get('hum_max'))
+        except thresholds.ThresholdError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('manage_clients'))
+        flash('Threshold profile saved - new readings use it now; run python reclassify.py to re-check stored ones', 'success')
+        return redirect(url_for('manage_clients'))
+
+    @app.route('/thresholds/delete', methods=['POST'])
+    @login_required
+    def delete_threshold_profile():
+        if session.get('username') != 'owner':
+            flash('Access denied', 'error')
+            return redirect(url_for('dashboard'))
+       
+        try:
+            profile_id = int(request.form.get('id', ''))
+        except ValueError:
+            flash('Invalid threshold profile', 'error')
+            return redirect(url_for('manage_clients'))
+        if not thresholds.delete_profile(profile_id):
+            flash('Threshold profile not found', 'error')
+            return redirect(url_for('manage_clients'))
+        flash('Threshold profile deleted', 'success')
+        return redirect(url_for('manage_clients'))
            
     @app.route('/delete-client', methods=['POST'])
     @login_required
@@ -323,6 +558,7 @@ def setup_routes(app):
         cursor.execute("UPDATE clients SET email_enabled = ? WHERE username = ?", (new_status, username))
         conn.commit()
         conn.close()
+        api_key_cache.invalidate(username)
        
         flash(f'Email alerts {"enabled" if new_status else "disabled"} for {username}', 'success')
         return redirect(url_for('manage_clients'))
@@ -335,28 +571,15 @@ def setup_routes(app):
         start_date = request.form.get('start_date')
         end_date = request.form.get('end_date')
        
-        conn = get_db_connection()
-        query = "SELECT id, timestamp, client_place, place, temperature, humidity, warning FROM sensor_data WHERE 1=1"
-        params = []
-       
-        if place and place != 'All':
-            query += " AND place = ?"
-            params.append(place)
-        if start_date:
-            query += " AND timestamp >= ?"
-            params.append(start_date)
-        if end_date:
-            query += " AND timestamp <= ?"
-            params.append(end_date + " 23:59:59")
-       
-        query += " ORDER BY timestamp DESC LIMIT 200"
-        data = conn.execute(query, params).fetchall()
-        conn.close()
+        client = request.form.get('client', '').strip()
+        rows, next_cursor = get_sensor_page(place, client=client, start_ts=date_to_epoch(start_date),
+                                            end_ts=date_to_epoch(end_date, end_of_day=True), limit=200)
        
-        data_list = [dict(row) for row in data]
+        data_list = [flag_out_of_range(dict(zip(PAGE_COLUMNS, row))) for row in rows]
         places = get_known_places()
+        filters = {'place': place or '', 'client': client, 'start_date': start_date or '', 'end_date': end_date or ''}
        
-        return render_template('dashboard.html', data=data_list, places=places)
+        return render_template('dashboard.html', data=data_list, places=places, next_cursor=next_cursor, filters=filters)
 
 
 
@@ -368,6 +591,9 @@ def setup_routes(app):
             flash('Access denied', 'error')
             return redirect(url_for('dashboard'))
        
+        # Import inside function: pandas is slow to import and only this export uses it
+        import pandas as pd
+
         clients = get_all_clients()
         df = pd.DataFrame([{
             'Username': c['username'],
@@ -404,7 +630,7 @@ def setup_routes(app):
             return redirect(url_for('manage_clients'))
        
         try:
-            create_simulation_file(username, user['places'], user.get('collection_interval', 10))
+            create_simulation_file(username, user['places'], user.get('collection_interval') or 10, user.get('api_key'))
             flash(f'Simulation file generated for {username}', 'success')
         except Exception as e:
             flash(f'Error: {str(e)}', 'error')
@@ -421,12 +647,26 @@ def setup_routes(app):
         except:
             status = "database_error"
        
-        return jsonify({
+        health = {
             "status": status,
             "service": "StormSaver Sensor Dashboard",
             "timestamp": datetime.now(UK_TZ).isoformat(),
             "version": "2.0"
-        })
+        }
+        buffer = get_ingest_buffer()
+        if buffer:
+            health["ingest_buffer"] = buffer.get_stats()
+        health["alerts"] = get_alert_dispatcher().get_stats()
+        health["live_feed"] = get_broker().get_stats()
+        health["anomaly"] = anomaly.get_stats()
+        return jsonify(health)
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        """Prometheus scrape target (this worker's counters)"""
+        if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+            return jsonify({"error": "Unauthorized"}), 401
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
     @app.route('/api-key/<username>')
     @login_required
@@ -0,0 +1,452 @@
+# shared_state.py - Hot state shared by every worker process
+# In-process caches (API keys, latest readings, alert state) drift apart across
+# gunicorn workers; this module gives them one small key-value + pub/sub API
+# with three interchangeable backends (config.SHARED_STATE_BACKEND):
+#
+#   local   a dict in this process - nothing is shared (single worker, the default / tests)
+#   sqlite  SHARED_STATE_PATH, a separate WAL SQLite file every worker on the host
+#           opens; pub/sub messages go through a table, and a data_versions
+#           (mmap) counter tells listeners when to look, so idle polls cost no SQL
+#   redis   any server speaking the Redis protocol at SHARED_STATE_URL (multi-host);
+#           `python fake_redis.py` is a local stand-in for trying it out
+#
+# Values are JSON. Every backend supports TTLs, atomic incr() and add() (set if
+# absent), and a lock() built on add() and released with delete_if(), a
+# compare-and-delete (WATCH/MULTI/EXEC on redis). publish() reaches the
+# subscribers in the *other* processes - the publisher has already updated
+# itself - and a callback receiving None must assume it missed messages
+# (listener reconnected or fell behind) and drop whatever it caches.
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from config import (SHARED_STATE_BACKEND, SHARED_STATE_PATH, SHARED_STATE_URL, SHARED_STATE_PREFIX,
+                    SHARED_STATE_POLL, SHARED_STATE_MESSAGE_TTL)
+
+
+class SharedStateError(Exception):
+    """The backend refused a command or can't be reached"""
+
+
+_subscriptions = {}  # channel -> [callback(message or None)], kept across forks
+_subscriptions_lock = threading.Lock()
+
+
+def _dispatch(channel, message):
+    for callback in list(_subscriptions.get(channel, ())):
+        try:
+            callback(message)
+        except Exception as e:
+            # A broken subscriber must not stop the listener thread
+            print(f"❌ Shared state subscriber for {channel} failed: {e}")
+
+
+def _dispatch_missed():
+    for channel in list(_subscriptions):
+        _dispatch(channel, None)
+
+
+class SharedState(ABC):
+    """Operations every backend provides"""
+
+    def __init__(self):
+        self.source = f"{os.getpid()}-{os.urandom(4).hex()}"  # lets listeners skip their own messages
+
+    @abstractmethod
+    def get(self, key):
+        ...
+
+    @abstractmethod
+    def set(self, key, value, ttl=None):
+        ...
+
+    @abstractmethod
+    def add(self, key, value, ttl=None):
+        """Set key only if it is absent (or expired); True if this call set it"""
+
+    @abstractmethod
+    def delete(self, *keys):
+        ...
+
+    @abstractmethod
+    def delete_if(self, key, value):
+        """Atomically delete key only while it still holds value; True if this call deleted it"""
+
+    @abstractmethod
+    def incr(self, key, amount=1, ttl=None):
+        """Atomically add amount (a missing key counts as 0); ttl applies when the key is created"""
+
+    @abstractmethod
+    def publish(self, channel, message):
+        ...
+
+    def start_listener(self):
+        """Begin delivering other processes' messages to the subscribers"""
+
+    @contextmanager
+    def lock(self, name, ttl=5.0, wait=2.0):
+        """Cross-process mutex; yields False when it couldn't be had within wait seconds
+
+        ttl bounds how long a crashed holder can block the others.
+        """
+        key, token = f"lock:{name}", os.urandom(8).hex()
+        deadline = time.monotonic() + wait
+        delay = 0.001
+        acquired = self.add(key, token, ttl)
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+            acquired = self.add(key, token, ttl)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self.delete_if(key, token)  # not if it expired and another worker holds it now
+
+
+# ------------------ local ------------------
+class LocalState(SharedState):
+    """Per-process dict; publish() has nobody to tell"""
+
+    def __init__(self):
+        super().__init__()
+        self._data = {}  # key -> (json text, expires monotonic or None)
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= now:
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key, time.monotonic())
+        return json.loads(entry[0]) if entry else None
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (json.dumps(value), time.monotonic() + ttl if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        now = time.monotonic()
+        with self._lock:
+            if self._live(key, now) is not None:
+                return False
+            self._data[key] = (json.dumps(value), now + ttl if ttl else None)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def delete_if(self, key, value):
+        with self._lock:
+            entry = self._live(key, time.monotonic())
+            if entry is None or entry[0] != json.dumps(value):
+                return False
+            del self._data[key]
+            return True
+
+    def incr(self, key, amount=1, ttl=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live(key, now)
+            value = (json.loads(entry[0]) if entry else 0) + amount
+            self._data[key] = (json.dumps(value), entry[1] if entry else (now + ttl if ttl else None))
+            return value
+
+    def publish(self, channel, message):
+        pass
+
+
+# ------------------ sqlite ------------------
+class SQLiteState(SharedState):
+    """Key-value and message tables in a WAL SQLite file shared by the workers on this host"""
+
+    SIGNAL = 'shared_state'  # data_versions signal touched on every publish
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        self._publishes = 0
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL) WITHOUT ROWID")
+            conn.execute("CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, source TEXT NOT NULL, message TEXT NOT NULL, created REAL NOT NULL)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute("SELECT value FROM kv WHERE key = ? AND (expires IS NULL OR expires > ?)",
+                                   (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl=None):
+        self._conn().execute("INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)",
+                             (key, json.dumps(value), time.time() + ttl if ttl else None))
+
+    def add(self, key, value, ttl=None):
+        now = time.time()
+        # One statement, so the check and the write are atomic across processes
+        cursor = self._conn().execute("""
+            INSERT INTO kv (key, value, expires) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires
+            WHERE kv.expires IS NOT NULL AND kv.expires <= ?
+        """, (key, json.dumps(value), now + ttl if ttl else None, now))
+        return cursor.rowcount == 1
+
+    def delete(self, *keys):
+        self._conn().executemany("DELETE FROM kv WHERE key = ?", [(key,) for key in keys])
+
+    def delete_if(self, key, value):
+        cursor = self._conn().execute("DELETE FROM kv WHERE key = ? AND value = ? AND (expires IS NULL OR expires > ?)",
+                                      (key, json.dumps(value), time.time()))
+        return cursor.rowcount == 1
+
+    def incr(self, key, amount=1, ttl=None):
+        now = time.time()
+        row = self._conn().execute("""
+            INSERT INTO kv (key, value, expires) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                value = CASE WHEN kv.expires IS NOT NULL AND kv.expires <= ? THEN excluded.value
+                             ELSE CAST(kv.value AS INTEGER) + ? END,
+                expires = CASE WHEN kv.expires IS NOT NULL AND kv.expires <= ? THEN excluded.expires
+                               ELSE kv.expires END
+            RETURNING value
+        """, (key, str(amount), now + ttl if ttl else None, now, amount, now)).fetchone()
+        return int(row[0])
+
+    def publish(self, channel, message):
+        import data_versions
+
+        conn = self._conn()
+        conn.execute("INSERT INTO messages (channel, source, message, created) VALUES (?, ?, ?, ?)",
+                     (channel, self.source, json.dumps(message), time.time()))
+        self._publishes += 1
+        if self._publishes % 100 == 0:
+            now = time.time()
+            conn.execute("DELETE FROM messages WHERE created < ?", (now - SHARED_STATE_MESSAGE_TTL,))
+            conn.execute("DELETE FROM kv WHERE expires IS NOT NULL AND expires <= ?", (now,))
+        data_versions.touch(self.SIGNAL)
+
+    def start_listener(self):
+        threading.Thread(target=self._listen, name='shared-state', daemon=True).start()
+
+    def _listen(self):
+        import data_versions
+
+        conn = self._conn()
+        last_id = conn.execute("SELECT IFNULL(MAX(id), 0) FROM messages").fetchone()[0]
+        seen = data_versions.counter(self.SIGNAL)
+        last_poll = time.monotonic()
+        while True:
+            time.sleep(SHARED_STATE_POLL)
+            now = time.monotonic()
+            if now - last_poll > SHARED_STATE_MESSAGE_TTL / 2:
+                _dispatch_missed()  # stalled long enough for messages to have been pruned
+            last_poll = now
+            signal = data_versions.counter(self.SIGNAL)
+            if signal == seen:
+                continue  # nothing published - no SQL
+            seen = signal
+            try:
+                rows = conn.execute("SELECT id, channel, source, message FROM messages WHERE id > ? ORDER BY id",
+                                    (last_id,)).fetchall()
+            except sqlite3.Error as e:
+                print(f"❌ Shared state poll failed: {e}")
+                continue
+            for row_id, channel, source, message in rows:
+                last_id = row_id
+                if source != self.source and channel in _subscriptions:
+                    _dispatch(channel, json.loads(message))
+
+
+# ------------------ redis protocol ------------------
+def _encode(args):
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+        out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(out)
+
+
+def _read_reply(stream):
+    line = stream.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("connection closed")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b'+':
+        return rest.decode()
+    if kind == b'-':
+        raise SharedStateError(rest.decode())
+    if kind == b':':
+        return int(rest)
+    if kind == b'$':
+        size = int(rest)
+        return None if size < 0 else stream.read(size + 2)[:-2]
+    if kind == b'*':
+        size = int(rest)
+        return None if size < 0 else [_read_reply(stream) for _ in range(size)]
+    raise SharedStateError(f"unexpected reply {line!r}")
+
+
+class _RedisConnection:
+    def __init__(self, host, port, db, password):
+        self.sock = socket.create_connection((host, port), timeout=5.0)
+        self.stream = self.sock.makefile('rb')
+        if password:
+            self.command('AUTH', password)
+        if db:
+            self.command('SELECT', db)
+
+    def command(self, *args):
+        self.sock.sendall(_encode(args))
+        return _read_reply(self.stream)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisState(SharedState):
+    """Redis protocol over one socket per process (commands are serialised - each is a single round trip)"""
+
+    def __init__(self, url, prefix):
+        super().__init__()
+        parts = urlsplit(url)
+        self._address = (parts.hostname or '127.0.0.1', parts.port or 6379,
+                         int(parts.path.strip('/') or 0), parts.password)
+        self.prefix = prefix
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _run(self, operation):
+        """operation(connection) with this process's connection held, reconnecting once if it dropped"""
+        with self._lock:
+            for attempt in (0, 1):
+                try:
+                    if self._conn is None:
+                        self._conn = _RedisConnection(*self._address)
+                    return operation(self._conn)
+                except (OSError, ConnectionError) as e:
+                    if self._conn is not None:
+                        self._conn.close()
+                        self._conn = None
+                    if attempt:
+                        raise SharedStateError(f"redis unavailable: {e}")
+
+    def _command(self, *args):
+        return self._run(lambda conn: conn.command(*args))
+
+    def get(self, key):
+        value = self._command('GET', self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        args = ('PX', int(ttl * 1000)) if ttl else ()
+        self._command('SET', self.prefix + key, json.dumps(value), *args)
+
+    def add(self, key, value, ttl=None):
+        args = ('PX', int(ttl * 1000)) if ttl else ()
+        return self._command('SET', self.prefix + key, json.dumps(value), 'NX', *args) == 'OK'
+
+    def delete(self, *keys):
+        if keys:
+            self._command('DEL', *(self.prefix + key for key in keys))
+
+    def delete_if(self, key, value):
+        def compare_and_delete(conn):
+            # WATCH makes EXEC fail (nil) if anyone wrote the key after our GET
+            conn.command('WATCH', self.prefix + key)
+            if conn.command('GET', self.prefix + key) != json.dumps(value).encode():
+                conn.command('UNWATCH')
+                return False
+            conn.command('MULTI')
+            conn.command('DEL', self.prefix + key)
+            reply = conn.command('EXEC')
+            return reply is not None and reply[0] == 1
+        return self._run(compare_and_delete)
+
+    def incr(self, key, amount=1, ttl=None):
+        value = self._command('INCRBY', self.prefix + key, amount)
+        if ttl and value == amount:
+            self._command('PEXPIRE', self.prefix + key, int(ttl * 1000))  # we created it
+        return value
+
+    def publish(self, channel, message):
+        self._command('PUBLISH', self.prefix + channel, json.dumps({'source': self.source, 'message': message}))
+
+    def start_listener(self):
+        threading.Thread(target=self._listen, name='shared-state', daemon=True).start()
+
+    def _listen(self):
+        delay = 0.5
+        while True:
+            conn = None
+            try:
+                conn = _RedisConnection(*self._address)
+                conn.sock.settimeout(None)  # a quiet channel is not an error
+                conn.command('PSUBSCRIBE', self.prefix + '*')
+                delay = 0.5
+                while True:
+                    reply = _read_reply(conn.stream)
+                    if reply and reply[0] == b'pmessage':
+                        channel = reply[2].decode()[len(self.prefix):]
+                        envelope = json.loads(reply[3])
+                        if envelope['source'] != self.source and channel in _subscriptions:
+                            _dispatch(channel, envelope['message'])
+            except (OSError, ConnectionError, SharedStateError) as e:
+                print(f"❌ Shared state listener lost redis ({e}); reconnecting")
+            finally:
+                if conn is not None:
+                    conn.close()
+            _dispatch_missed()
+            time.sleep(delay)
+            delay = min(delay * 2, 10)
+
+
+# ------------------ process-wide instance ------------------
+_state = None
+_state_pid = None
+_state_lock = threading.Lock()
+
+
+def get_state():
+    """This process's backend (re-created after a fork), listening once anything subscribed"""
+    global _state, _state_pid
+    if _state is not None and _state_pid == os.getpid():
+        return _state
+    with _state_lock:
+        if _state is None or _state_pid != os.getpid():
+            if SHARED_STATE_BACKEND == 'redis':
+                state = RedisState(SHARED_STATE_URL, SHARED_STATE_PREFIX)
+            elif SHARED_STATE_BACKEND == 'sqlite':
+                state = SQLiteState(SHARED_STATE_PATH)
+            else:
+                state = LocalState()
+            state.start_listener()
+            _state, _state_pid = state, os.getpid()
+    return _state
+
+
+def subscribe(channel, callback):
+    """callback(message) runs on the listener thread for each message other processes publish"""
+    with _subscriptions_lock:
+        _subscriptions.setdefault(channel, []).append(callback)
@@ -1,33 +1,36 @@
 # simulation_generator.py
+# Writes one standalone script per client that posts a reading every collection
+# interval, like the real Arduino would. For load tests use fleet.py instead.
 import os
+from config import TEMP_RANGE, HUM_RANGE, SIMULATOR_SERVER_URL
 
-def create_simulation_file(client_name, place_name):
+def create_simulation_file(client_name, place_name, collection_interval=10, api_key=None):
     filename = f"simulated_arduino_{client_name}_{place_name}.py"
     if os.path.exists(filename):
         print(f"⚠️  Simulation file '{filename}' already exists. Skipping creation.")
         return
     
-    template = create_simulation_template(client_name, place_name)
+    template = create_simulation_template(client_name, place_name, collection_interval, api_key)
     
     with open(filename, 'w', encoding='utf-8') as f:
         f.write(template)
     print(f"✅ Simulation file created: {filename}")
 
-def create_simulation_template(client_name, place_name):
-    # Combine client name and place name for unique identifier (client_place format)
-    combined_place = f"{client_name}_{place_name}"  # Updated format
-    
+def create_simulation_template(client_name, place_name, collection_interval=10, api_key=None):
+    # The server prefixes the client name from the API key, so only the place is sent
     return f"""import requests
 import random
 import time
 
 # Configuration
-SERVER_URL = 'http://127.0.0.1:5001/submit-data'
-PLACE = '{combined_place}'  # Combined client and place name (client_place format)
+SERVER_URL = '{SIMULATOR_SERVER_URL.rstrip('/')}/submit-data'
+API_KEY = {api_key or 'YOUR-API-KEY'!r}  # the key shown once at registration
+PLACE = {place_name!r}
+INTERVAL = {int(collection_interval or 10)}  # seconds
 
-# comfort thresholds
-TEMP_RANGE = (18, 30)
-HUM_RANGE = (30, 70)
+# comfort thresholds - the server's defaults (config.TEMP_RANGE / HUM_RANGE) when generated
+TEMP_RANGE = {TEMP_RANGE}
+HUM_RANGE = {HUM_RANGE}
 
 def read_sensor():
     \"\"\"Simulate sensor readings (some normal, some abnormal).\"\"\"
@@ -36,10 +39,10 @@ def read_sensor():
         hum = round(random.uniform(*HUM_RANGE), 1)
     else:
         if random.choice(['temp', 'hum']) == 'temp':
-            temp = round(random.uniform(5, 15), 1) if random.random() < 0.5 else round(random.uniform(31, 45), 1)
+            temp = round(random.uniform(TEMP_RANGE[0] - 10, TEMP_RANGE[0] - 1), 1) if random.random() < 0.5 else round(random.uniform(TEMP_RANGE[1] + 1, TEMP_RANGE[1] + 10), 1)
             hum = round(random.uniform(*HUM_RANGE), 1)
         else:
-            hum = round(random.uniform(10, 25), 1) if random.random() < 0.5 else round(random.uniform(75, 95), 1)
+            hum = round(random.uniform(max(HUM_RANGE[0] - 20, 0), HUM_RANGE[0] - 1), 1) if random.random() < 0.5 else round(random.uniform(HUM_RANGE[1] + 1, min(HUM_RANGE[1] + 20, 100)), 1)
             temp = round(random.uniform(*TEMP_RANGE), 1)
     return temp, hum
 
@@ -49,12 +52,12 @@ def send_data(temp, hum):
         'temperature': temp,
         'humidity': hum
     }}
-    response = requests.post(SERVER_URL, json=data)
+    response = requests.post(SERVER_URL, json=data, headers={{'X-API-Key': API_KEY}}, timeout=10)
     print(f"Sent data: {{data}} | Server Response: {{response.text}}")
 
 if __name__ == '__main__':
     while True:
         temp, hum = read_sensor()
         send_data(temp, hum)
-        time.sleep(10)
+        time.sleep(INTERVAL)
 """
\ No newline at end of file
@@ -0,0 +1,240 @@
+# storage.py - Storage backends for sensor readings
+#
+#   single       everything in the sensor_data table (default, the original layout)
+#   partitioned  one table per UTC day, sensor_data_pYYYYMMDD, in the same database file
+#
+# Both expose the same calls, so save_sensor_data, the dashboard queries, the
+# exports and retention don't care which is configured (STORAGE_BACKEND).
+# Partitioned mode keeps each day's indexes small, lets a time-range query open
+# only the days it covers and drops an expired day with one DROP TABLE.
+# Readings written before switching to partitioned stay in sensor_data, which is
+# read as the oldest "partition"; `python storage.py --partition-existing` moves them.
+#
+# Partition ids start at day_number * 10**10 (seeded through sqlite_sequence), so
+# ids stay unique and increasing across partitions and (ts, id) orders globally.
+import argparse
+import re
+import threading
+from datetime import datetime, timezone
+from config import STORAGE_BACKEND
+
+INSERT_COLUMNS = "client_place, place, temperature, humidity, warning, timestamp, ts"
+PARTITION_PREFIX = "sensor_data_p"
+_PARTITION_RE = re.compile(r"^sensor_data_p(\d{8})$")
+ID_SPAN = 10 ** 10
+
+
+def day_of(ts):
+    return ts // 86400
+
+
+def _day_name(day):
+    return PARTITION_PREFIX + datetime.fromtimestamp(day * 86400, timezone.utc).strftime("%Y%m%d")
+
+
+def _name_day(name):
+    match = _PARTITION_RE.match(name)
+    if not match:
+        return None
+    return int(datetime.strptime(match.group(1), "%Y%m%d").replace(tzinfo=timezone.utc).timestamp()) // 86400
+
+
+def _range_filters(filters, params, start_ts, end_ts):
+    filters, params = list(filters), list(params)
+    if start_ts is not None:
+        filters.append("ts >= ?")
+        params.append(start_ts)
+    if end_ts is not None:
+        filters.append("ts < ?")
+        params.append(end_ts)
+    return filters, params
+
+
+def iter_tables(conn, tables, columns, filters=(), params=(), start_ts=None, end_ts=None, chunk_size=1000, limit=None):
+    """Yield lists of rows newest first from the given tables in order, at most limit rows in all"""
+    filters, params = _range_filters(filters, params, start_ts, end_ts)
+    where = (" WHERE " + " AND ".join(filters)) if filters else ""
+    remaining = limit
+    for table in tables:
+        sql = f"SELECT {columns} FROM {table}{where} ORDER BY ts DESC, id DESC"
+        table_params = list(params)
+        if remaining is not None:
+            sql += " LIMIT ?"
+            table_params.append(remaining)
+        cursor = conn.execute(sql, table_params)
+        while True:
+            chunk = cursor.fetchmany(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            yield chunk
+            if remaining is not None:
+                remaining -= len(chunk)
+                if remaining <= 0:
+                    return
+
+
+def query_tables(conn, tables, columns, filters=(), params=(), start_ts=None, end_ts=None, limit=None):
+    """iter_tables() as one list"""
+    return [row for chunk in iter_tables(conn, tables, columns, filters, params, start_ts, end_ts, limit=limit)
+            for row in chunk]
+
+
+class SingleTableStorage:
+    """All readings in sensor_data"""
+
+    name = 'single'
+
+    def tables(self, conn, start_ts=None, end_ts=None):
+        """Tables holding readings in [start_ts, end_ts), newest data first"""
+        return ['sensor_data']
+
+    def insert(self, conn, rows):
+        """rows: (client_place, place, temperature, humidity, warning, timestamp, ts) tuples"""
+        conn.executemany(f"INSERT INTO sensor_data ({INSERT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def query(self, conn, columns, filters=(), params=(), start_ts=None, end_ts=None, limit=None, extra_tables=()):
+        """Rows newest first (ts DESC, id DESC), touching only the tables that cover the range"""
+        return query_tables(conn, list(self.tables(conn, start_ts, end_ts)) + list(extra_tables),
+                            columns, filters, params, start_ts, end_ts, limit=limit)
+
+    def iter(self, conn, columns, filters=(), params=(), start_ts=None, end_ts=None,
+             chunk_size=1000, limit=None, extra_tables=()):
+        """Yield lists of rows newest first, table by table; extra_tables (e.g. attached archives) come last"""
+        yield from iter_tables(conn, list(self.tables(conn, start_ts, end_ts)) + list(extra_tables),
+                               columns, filters, params, start_ts, end_ts, chunk_size=chunk_size, limit=limit)
+
+    def expired_tables(self, conn, cutoff):
+        """Whole tables whose readings are all older than cutoff (none in single mode)"""
+        return []
+
+
+class PartitionedStorage(SingleTableStorage):
+    """One sensor_data_pYYYYMMDD table per UTC day"""
+
+    name = 'partitioned'
+
+    def __init__(self):
+        self._days = None  # known partition days, loaded from sqlite_master
+        self._seeded = set()  # days whose table and id seed this process saw committed
+        self._lock = threading.Lock()
+
+    def _known_days(self, conn, refresh=False):
+        if self._days is None or refresh:
+            names = [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'sensor_data_p%'")]
+            with self._lock:
+                self._days = {day for day in map(_name_day, names) if day is not None}
+        return self._days
+
+    def forget(self, day):
+        with self._lock:
+            if self._days is not None:
+                self._days.discard(day)
+            self._seeded.discard(day)
+
+    def _ensure_partition(self, conn, day):
+        if day in self._seeded:
+            return
+        name = _day_name(day)
+        # The id seed must not ride on the caller's transaction: CREATE TABLE outside
+        # a transaction autocommits, so a rolled-back seed would leave the table with
+        # ids restarting at 1. Commit both at once, unless the caller already has a
+        # transaction open - then they commit or roll back together.
+        own_transaction = not conn.in_transaction
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {name} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                place TEXT,
+                client_place TEXT,
+                temperature REAL,
+                humidity REAL,
+                warning TEXT,
+                timestamp DATETIME,
+                ts INTEGER
+            )
+        """)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_ts ON {name} (ts)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_place_ts ON {name} (place, ts)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_client_place_ts ON {name} (client_place, ts)")
+        if not conn.execute("SELECT 1 FROM sqlite_sequence WHERE name = ?", (name,)).fetchone():
+            # Also repairs a partition whose seed was lost: continue above any ids it holds
+            max_id = conn.execute(f"SELECT MAX(id) FROM {name}").fetchone()[0] or 0
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (name, max(day * ID_SPAN, max_id)))
+        if own_transaction:
+            conn.commit()
+        with self._lock:
+            if self._days is not None:
+                self._days.add(day)
+            if own_transaction:
+                self._seeded.add(day)  # otherwise verified again on the next write
+
+    def insert(self, conn, rows):
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(day_of(row[6]), []).append(row)
+        for day, day_rows in by_day.items():
+            self._ensure_partition(conn, day)
+            conn.executemany(f"INSERT INTO {_day_name(day)} ({INSERT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", day_rows)
+
+    def tables(self, conn, start_ts=None, end_ts=None):
+        # Refresh so partitions created by other workers are seen
+        days = sorted(self._known_days(conn, refresh=True), reverse=True)
+        if start_ts is not None:
+            days = [d for d in days if d >= day_of(start_ts)]
+        if end_ts is not None:
+            days = [d for d in days if d <= day_of(end_ts - 1)]
+        return [_day_name(d) for d in days] + ['sensor_data']
+
+    def expired_tables(self, conn, cutoff):
+        """Partitions whose whole day ends at or before cutoff, oldest first"""
+        return [_day_name(d) for d in sorted(self._known_days(conn, refresh=True)) if (d + 1) * 86400 <= cutoff]
+
+    def drop(self, conn, table):
+        """Drop one partition - no row-by-row delete"""
+        day = _name_day(table)
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+        self.forget(day)
+
+
+def partition_existing(conn):
+    """Move readings from sensor_data into day partitions, one day per transaction"""
+    storage = PartitionedStorage()
+    days = [row[0] for row in conn.execute(
+        "SELECT DISTINCT ts / 86400 FROM sensor_data WHERE ts IS NOT NULL ORDER BY 1")]
+    moved = 0
+    for day in days:
+        with conn:
+            storage._ensure_partition(conn, day)
+            cursor = conn.execute(f"""
+                INSERT INTO {_day_name(day)} ({INSERT_COLUMNS})
+                SELECT {INSERT_COLUMNS} FROM sensor_data WHERE ts >= ? AND ts < ? ORDER BY ts, id
+            """, (day * 86400, (day + 1) * 86400))
+            moved += cursor.rowcount
+            conn.execute("DELETE FROM sensor_data WHERE ts >= ? AND ts < ?", (day * 86400, (day + 1) * 86400))
+    return moved
+
+
+_storage = None
+
+
+def get_storage():
+    """Configured backend (STORAGE_BACKEND = 'single' | 'partitioned')"""
+    global _storage
+    if _storage is None:
+        _storage = PartitionedStorage() if STORAGE_BACKEND == 'partitioned' else SingleTableStorage()
+    return _storage
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sensor reading storage maintenance")
+    parser.add_argument("--partition-existing", action="store_true",
+                        help="move readings from sensor_data into day partitions")
+    args = parser.parse_args()
+    if args.partition_existing:
+        from db_pool import connect
+        conn = connect()
+        print(f"✅ Moved {partition_existing(conn)} readings into day partitions")
+        conn.close()
+    else:
+        parser.print_help()
@@ -56,30 +56,37 @@ function formatPlaceName(combinedPlace) {
     return combinedPlace;
 }
 
-function filterData() {
-    const filterText = document.getElementById('clientFilter').value.toLowerCase();
-    const table = document.getElementById('latest').querySelector('table');
-    
-    if (!table) return;
-    
-    const rows = table.getElementsByTagName('tr');
-    
-    for (let i = 1; i < rows.length; i++) { // Skip header row
-        const row = rows[i];
-        const placeCell = row.cells[2]; // Place column
-        const placeText = placeCell.textContent.toLowerCase();
-        
-        if (filterText === '') {
-            row.classList.remove('hidden');
-            row.classList.remove('highlight');
-        } else if (placeText.includes(filterText)) {
-            row.classList.remove('hidden');
-            row.classList.add('highlight');
+let nextCursor = null;
+
+function renderRow(row){
+    let tC=("temp_alert" in row?row.temp_alert:(row.temperature<TEMP_MIN||row.temperature>TEMP_MAX))?"red":"";
+    let hC=("hum_alert" in row?row.hum_alert:(row.humidity<HUM_MIN||row.humidity>HUM_MAX))?"red":"";
+    return "<tr class='highlight'><td>"+row.timestamp+"</td><td>"+formatPlaceName(row.client_place)+"</td><td class='"+tC+"'>"+row.temperature+
+           "</td><td class='"+hC+"'>"+row.humidity+"</td><td>"+(row.warning||"")+"</td></tr>";
+}
+
+// Filtering and paging happen server-side (/api/data); only the matching page is rendered
+function filterData(cursor) {
+    const filterText = document.getElementById('clientFilter').value.trim();
+    if (filterText === '') { nextCursor = null; refreshData(); return; }
+    const params = new URLSearchParams({client: filterText, place: document.getElementById("place").value, limit: 200});
+    if (cursor) params.set('cursor', cursor);
+    fetch("/api/data?" + params)
+    .then(r=>r.json())
+    .then(page=>{
+        const div = document.getElementById("latest");
+        const rows = page.rows.map(r=>Object.fromEntries(page.columns.map((name,i)=>[name,r[i]])));
+        if (!cursor) {
+            allSensorData = rows;
+            div.innerHTML = "<table><tr><th>Timestamp (UK)</th><th>Place</th><th>Temperature(°C)</th><th>Humidity(%)</th><th>Warning</th></tr></table>" +
+                            "<button type='button' id='loadMore' onclick='filterData(nextCursor)'>Load more</button>";
         } else {
-            row.classList.add('hidden');
-            row.classList.remove('highlight');
+            allSensorData = allSensorData.concat(rows);
         }
-    }
+        div.querySelector('table').insertAdjacentHTML('beforeend', rows.map(renderRow).join(''));
+        nextCursor = page.next;
+        document.getElementById('loadMore').style.display = nextCursor ? '' : 'none';
+    });
 }
 
 function clearFilter() {
@@ -88,36 +95,60 @@ function clearFilter() {
 }
 
 function refreshData(){
+  const filterInput = document.getElementById('clientFilter');
+  if (filterInput && filterInput.value.trim()) {
+      // Keep the filtered page (and any pages loaded after it) instead of replacing it
+      if (!nextCursor) filterData();
+      return;
+  }
   let place=document.getElementById("place").value;
   fetch("/latest-data?place="+encodeURIComponent(place))
   .then(r=>r.status===403?null:r.json())
   .then(data=>{
-    let div=document.getElementById("latest");
-    if(!data){div.innerHTML="<b>No data yet.</b>";return;}
-    let html="<table><tr><th>ID</th><th>Timestamp (UK)</th><th>Place</th><th>Temperature(°C)</th><th>Humidity(%)</th><th>Warning</th></tr>";
-    if(Array.isArray(data)){
-      allSensorData = data;
-      data.forEach(row=>{
-        let tC=(row.temperature<TEMP_MIN||row.temperature>TEMP_MAX)?"red":"";
-        let hC=(row.humidity<HUM_MIN||row.humidity>HUM_MAX)?"red":"";
-        html+="<tr><td>"+row.id+"</td><td>"+row.timestamp+"</td><td>"+formatPlaceName(row.place)+"</td><td class='"+tC+"'>"+row.temperature+
-              "</td><td class='"+hC+"'>"+row.humidity+"</td><td>"+(row.warning||"")+"</td></tr>";
-      });
-    } else if(data){
-      allSensorData = [data];
-      let tC=(data.temperature<TEMP_MIN||data.temperature>TEMP_MAX)?"red":"";
-      let hC=(data.humidity<HUM_MIN||data.humidity>HUM_MAX)?"red":"";
-      html+="<tr><td>"+data.id+"</td><td>"+data.timestamp+"</td><td>"+formatPlaceName(data.place)+"</td><td class='"+tC+"'>"+data.temperature+
-            "</td><td class='"+hC+"'>"+data.humidity+"</td><td>"+(data.warning||"")+"</td></tr>";
-    }
-    html+="</table>";
-    div.innerHTML=html;
-    
-    // Apply any existing filter after refresh
-    if (document.getElementById('clientFilter').value) {
-        filterData();
-    }
+    if(!data){document.getElementById("latest").innerHTML="<b>No data yet.</b>";return;}
+    allSensorData = Array.isArray(data) ? data : [data];
+    renderLatest(allSensorData);
+  });
+}
+
+function renderLatest(rows){
+  let html="<table><tr><th>Timestamp (UK)</th><th>Place</th><th>Temperature(°C)</th><th>Humidity(%)</th><th>Warning</th></tr>";
+  rows.forEach(row=>{
+    let tC=("temp_alert" in row?row.temp_alert:(row.temperature<TEMP_MIN||row.temperature>TEMP_MAX))?"red":"";
+    let hC=("hum_alert" in row?row.hum_alert:(row.humidity<HUM_MIN||row.humidity>HUM_MAX))?"red":"";
+    html+="<tr><td>"+row.timestamp+"</td><td>"+formatPlaceName(row.client_place)+"</td><td class='"+tC+"'>"+row.temperature+
+          "</td><td class='"+hC+"'>"+row.humidity+"</td><td>"+(row.warning||"")+"</td></tr>";
   });
+  html+="</table>";
+  document.getElementById("latest").innerHTML=html;
+}
+
+// Live updates: /stream pushes each new reading; poll every 3 s only when streaming is unavailable
+let liveFeed = null, pollTimer = null;
+
+function startPolling(){
+  if(!pollTimer) pollTimer=setInterval(refreshData,3000);
+}
+
+function onLiveReading(e){
+  const filterInput = document.getElementById('clientFilter');
+  if (filterInput && filterInput.value.trim()) return; // the filtered pages stay as loaded
+  const row = JSON.parse(e.data);
+  allSensorData = [row].concat(allSensorData.filter(r=>r.client_place!==row.client_place));
+  renderLatest(allSensorData);
+}
+
+function startLiveFeed(){
+  if(liveFeed) liveFeed.close();
+  if(!window.EventSource){startPolling();return;}
+  liveFeed=new EventSource("/stream?place="+encodeURIComponent(document.getElementById("place").value));
+  liveFeed.addEventListener('reading',onLiveReading);
+  liveFeed.addEventListener('warning',onLiveReading);
+  liveFeed.addEventListener('resync',refreshData);
+  // (Re)connected: stop polling and catch up on anything missed while disconnected
+  liveFeed.onopen=()=>{if(pollTimer){clearInterval(pollTimer);pollTimer=null;} refreshData();};
+  // CLOSED means the server refused the stream (e.g. 503) - EventSource won't retry
+  liveFeed.onerror=()=>{if(liveFeed.readyState===EventSource.CLOSED) startPolling();};
 }
 
 function toggleEmail(){
@@ -126,8 +157,7 @@ function toggleEmail(){
   .then(d=>{alert('Email alerts are now '+(d.enabled?'ENABLED':'DISABLED'));location.reload();});
 }
 
-setInterval(refreshData,3000);
-window.onload=refreshData;
+window.onload=()=>{refreshData();startLiveFeed();};
 </script>
 </head>
 <body>
@@ -149,7 +179,7 @@ Logged in as: <b>{{username}}</b> ({{role}}) |
 
 <div class="form-row">
 <label for="place">Select Place:</label>
-<select id="place" name="place" onchange="refreshData()">
+<select id="place" name="place" onchange="refreshData();startLiveFeed()">
 {% for p in places %}
 <option value="{{p}}" {% if loop.first %}selected{% endif %}>{{ p.replace('_', ' - ') }}</option>
 {% endfor %}
@@ -0,0 +1,84 @@
+# conftest.py - Shared fixtures: every test runs against a scratch database
+# Configuration is read from the environment when config.py is imported, so it
+# is pointed at a temporary directory here, before any app module loads. Alerts
+# stay in-process (shared state 'local') and no email ever leaves.
+import os
+import sys
+import tempfile
+
+import pytest
+
+_TMP = tempfile.mkdtemp(prefix='sensor-tests-')
+os.environ.update({
+    'DB_PATH': os.path.join(_TMP, 'sensor_data.db'),
+    'DATA_VERSION_FILE': os.path.join(_TMP, 'sensor_data.db.versions'),
+    'EXPORT_CACHE_DIR': os.path.join(_TMP, 'export_cache'),
+    'ARCHIVE_DIR': os.path.join(_TMP, 'archive'),
+    'SHARED_STATE_BACKEND': 'local',
+    'EMAIL_SENDER': '',  # the dispatcher refuses every email
+    'ANOMALY_ENABLED': '0',  # warnings depend on the fixed ranges only
+    'WRITE_BEHIND_ENABLED': '0',
+    'RETENTION_RAW_DAYS': '0',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+API_KEY = 'TEST-KEY'
+
+
+def _reset_state():
+    import alert_state  # noqa: F401 - imported so its shared state is reset below
+    import api_key_cache
+    import database
+    import latest_values
+    import shared_state
+    import storage
+    import thresholds
+
+    conn = database.get_db_connection()
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'sensor_data_p%'").fetchall():
+        conn.execute(f"DROP TABLE {name}")
+    conn.execute("DELETE FROM sqlite_sequence WHERE name LIKE 'sensor_data_p%'")
+    for table in ('sensor_data', 'sensor_rollup_1m', 'sensor_rollup_1h', 'sensor_rollup_1d', 'known_places',
+                  'known_client_places', 'alert_state', 'threshold_profiles'):
+        conn.execute(f"DELETE FROM {table}")
+    conn.execute("DELETE FROM clients WHERE role != 'owner'")
+    conn.commit()
+    conn.close()
+    database._known_places.clear()
+    database._known_client_places.clear()
+    storage._storage = None
+    api_key_cache._cache.clear()
+    latest_values._latest.clear()
+    latest_values._synced_at = None
+    shared_state._state = None
+    thresholds.invalidate()
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app
+
+    return create_app()
+
+
+@pytest.fixture
+def db(app):
+    """Empty readings, only the owner and one client 'alice' (place 'lab', key API_KEY)"""
+    import database
+
+    _reset_state()
+    database.add_client('alice', 'secret1', 'lab', 'alice@example.com', '', '', 10, API_KEY)
+    yield
+    _reset_state()
+
+
+@pytest.fixture
+def client(app, db):
+    return app.test_client()
+
+
+@pytest.fixture
+def owner_client(client):
+    with client.session_transaction() as session:
+        session['username'], session['role'] = 'owner', 'owner'
+    return client
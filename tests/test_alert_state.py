@@ -0,0 +1,96 @@
+# Alert state machine: alert, suppressed repeats, digest, recovery, batches
+import pytest
+
+import alert_state
+from config import ALERT_DIGEST_COOLDOWN
+
+CLIENT = {'email_enabled': 1, 'email': 'alice@example.com'}
+T0 = 1_700_000_000
+
+
+@pytest.fixture
+def emails(db, monkeypatch):
+    sent = []
+    monkeypatch.setattr(alert_state, 'send_alert_email', lambda *a: sent.append(('alert', a[4])))
+    monkeypatch.setattr(alert_state, 'send_alert_digest_email', lambda *a: sent.append(('digest', a[5])))
+    monkeypatch.setattr(alert_state, 'send_recovery_email', lambda *a: sent.append(('recovered', a[4])))
+    return sent
+
+
+def reading(warning, now, client=CLIENT, client_place='alice_lab'):
+    return alert_state.process_reading(client, 'alice', client_place, 'lab', 30.0, 50.0, warning, now=now)
+
+
+def test_first_warning_alerts_then_repeats_are_suppressed(emails):
+    assert reading('too hot', T0) == 'alert'
+    assert [reading('too hot', T0 + i) for i in range(1, 4)] == [None, None, None]
+    assert emails == [('alert', 'too hot')]
+
+
+def test_digest_after_cooldown_counts_the_suppressed_repeats(emails):
+    reading('too hot', T0)
+    for i in range(1, 4):
+        reading('too hot', T0 + i)
+    assert reading('still hot', T0 + ALERT_DIGEST_COOLDOWN) == 'digest'
+    assert emails[-1] == ('digest', 4)  # three suppressed plus this one
+    assert reading('still hot', T0 + ALERT_DIGEST_COOLDOWN + 1) is None
+
+
+def test_recovery_and_a_new_episode(emails):
+    reading('too hot', T0)
+    assert reading('', T0 + 60) == 'recovered'
+    assert reading('', T0 + 61) is None
+    assert reading('too hot', T0 + 120) == 'alert'
+    assert [e[0] for e in emails] == ['alert', 'recovered', 'alert']
+
+
+def test_in_range_readings_do_nothing(emails):
+    assert reading('', T0) is None
+    assert emails == []
+
+
+def test_state_is_mirrored_to_the_database(emails):
+    reading('too hot', T0)
+    reading('too hot', T0 + 1)
+    reading('too hot', T0 + ALERT_DIGEST_COOLDOWN)
+    mirrored = alert_state._load('alice_lab')
+    assert (mirrored.state, mirrored.since, mirrored.last_sent) == ('warning', T0, T0 + ALERT_DIGEST_COOLDOWN)
+
+
+def test_state_survives_losing_the_shared_store(emails):
+    import shared_state
+
+    reading('too hot', T0)
+    shared_state._state = None  # e.g. restart with the 'local' backend
+    assert reading('too hot', T0 + 1) is None  # reloaded from the mirror: no second alert
+    assert emails == [('alert', 'too hot')]
+
+
+def test_disabled_alerts_change_state_without_email(emails):
+    quiet = dict(CLIENT, email_enabled=0)
+    assert reading('too hot', T0, client=quiet) == 'alert'
+    assert emails == []
+
+
+def test_batch_advances_each_sensor_once(emails):
+    rows = [('alice_lab', 'lab', 21.0, 50.0, ''),
+            ('alice_lab', 'lab', 30.0, 50.0, 'Temperature too high'),
+            ('alice_lab', 'lab', 31.0, 70.0, 'Temperature too high; Humidity too high'),
+            ('alice_lab', 'lab', 30.5, 50.0, 'Temperature too high'),
+            ('alice_hall', 'hall', 21.0, 50.0, '')]
+    events = alert_state.process_batch(CLIENT, 'alice', rows, now=T0)
+    assert events == {'alice_lab': 'alert', 'alice_hall': None}
+    assert emails == [('alert', 'Temperature too high; Humidity too high')]  # the worst reading
+    assert alert_state._get('alice_lab').suppressed == 2
+
+    events = alert_state.process_batch(CLIENT, 'alice', rows[1:4], now=T0 + 1)
+    assert events == {'alice_lab': None}
+    events = alert_state.process_batch(CLIENT, 'alice', rows[1:2], now=T0 + ALERT_DIGEST_COOLDOWN)
+    assert events == {'alice_lab': 'digest'}
+    assert emails[-1] == ('digest', 6)  # 2 + 3 suppressed, plus this one
+
+
+def test_batch_recovers_when_no_reading_warns(emails):
+    alert_state.process_batch(CLIENT, 'alice', [('alice_lab', 'lab', 30.0, 50.0, 'too hot')], now=T0)
+    events = alert_state.process_batch(CLIENT, 'alice', [('alice_lab', 'lab', 21.0, 50.0, '')] * 3, now=T0 + 60)
+    assert events == {'alice_lab': 'recovered'}
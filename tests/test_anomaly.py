@@ -0,0 +1,79 @@
+# Streaming anomaly checks: warm-up, spikes, fast changes, flatlines, per-sensor state
+import pytest
+
+import anomaly
+
+
+@pytest.fixture(autouse=True)
+def detector(monkeypatch):
+    monkeypatch.setattr(anomaly, 'ANOMALY_ENABLED', True)
+    monkeypatch.setattr(anomaly, 'ANOMALY_WARMUP', 20)
+    monkeypatch.setattr(anomaly, 'ANOMALY_FLATLINE', 30)
+    monkeypatch.setattr(anomaly, '_stats', {})
+    monkeypatch.setattr(anomaly, '_counts', {'spike': 0, 'rate': 0, 'flatline': 0})
+
+
+def _feed(client_place, count, start=0, ts0=0):
+    """count readings alternating 20 / 21 °C, one a minute; returns their warnings"""
+    return [anomaly.check_reading(client_place, 20.0 + i % 2, 50.0 + i % 2, ts0 + (start + i) * 60)
+            for i in range(count)]
+
+
+def test_no_spikes_during_warm_up():
+    _feed('s1', 5)
+    # Far off, but slowly enough that only the spike check could fire
+    assert anomaly.check_reading('s1', 30.0, 50.0, 60 * 60) == ''
+    assert anomaly._stats['s1'].count == 6
+
+
+def test_spike_after_warm_up():
+    assert set(_feed('s1', 25)) == {''}
+    warning = anomaly.check_reading('s1', 30.0, 50.0, 60 * 60)
+    assert warning.startswith('Temperature spike (30.0°C')
+    assert anomaly.get_stats()['spike'] == 1
+
+
+def test_fast_change():
+    _feed('s1', 3)
+    warning = anomaly.check_reading('s1', 35.0, 50.0, 3 * 60)
+    assert 'Temperature changing fast (+15.0°C/min)' in warning
+    assert anomaly.get_stats()['rate'] == 1
+
+
+def test_flatline(monkeypatch):
+    monkeypatch.setattr(anomaly, 'ANOMALY_FLATLINE', 5)
+    warnings = [anomaly.check_reading('s1', 20.0, 50.0, i * 60) for i in range(5)]
+    assert warnings[:4] == [''] * 4
+    assert warnings[4] == 'Sensor flatlined (5 identical readings)'
+
+
+def test_sensors_are_tracked_separately():
+    _feed('s1', 25)
+    _feed('s2', 3)
+    assert anomaly.check_reading('s2', 30.0, 50.0, 60 * 60) == ''  # s2 is still warming up
+    assert 'spike' in anomaly.check_reading('s1', 30.0, 50.0, 60 * 60)
+    assert anomaly._stats['s1'].count == 26 and anomaly._stats['s2'].count == 4
+
+
+def test_non_finite_readings_leave_the_statistics_alone():
+    _feed('s1', 25)
+    before = anomaly._stats['s1'].t_mean
+    for value in (float('nan'), float('inf')):
+        assert anomaly.check_reading('s1', value, 50.0, 26 * 60) == ''
+    assert anomaly._stats['s1'].t_mean == before
+    assert anomaly.check_reading('new', float('nan'), 50.0) == ''
+    assert 'new' not in anomaly._stats
+    assert 'spike' in anomaly.check_reading('s1', 30.0, 50.0, 60 * 60)
+
+
+def test_oldest_sensor_is_forgotten_at_the_limit(monkeypatch):
+    monkeypatch.setattr(anomaly, 'ANOMALY_MAX_SENSORS', 2)
+    for name in ('s1', 's2', 's3'):
+        anomaly.check_reading(name, 20.0, 50.0, 0)
+    assert list(anomaly._stats) == ['s2', 's3']
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setattr(anomaly, 'ANOMALY_ENABLED', False)
+    assert anomaly.check_reading('s1', 20.0, 50.0) == ''
+    assert anomaly._stats == {}
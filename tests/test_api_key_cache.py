@@ -0,0 +1,90 @@
+# API key cache: positive / negative caching and invalidation on client changes
+import api_key_cache
+import database
+from conftest import API_KEY
+
+READING = {'place': 'lab', 'temperature': 21, 'humidity': 50}
+
+
+def _lookups(monkeypatch):
+    calls = []
+    real = database.get_client_by_api_key
+
+    def counting(api_key):
+        calls.append(api_key)
+        return real(api_key)
+    monkeypatch.setattr(database, 'get_client_by_api_key', counting)
+    return calls
+
+
+def test_valid_keys_are_cached(db, monkeypatch):
+    calls = _lookups(monkeypatch)
+    assert api_key_cache.lookup(API_KEY)['username'] == 'alice'
+    assert api_key_cache.lookup(API_KEY)['username'] == 'alice'
+    assert calls == [API_KEY]
+
+
+def test_rejected_keys_are_cached_too(db, monkeypatch):
+    calls = _lookups(monkeypatch)
+    assert api_key_cache.lookup('WRONG') is None
+    assert api_key_cache.lookup('WRONG') is None
+    assert calls == ['WRONG']
+
+
+def test_entries_expire(db, monkeypatch):
+    calls = _lookups(monkeypatch)
+    monkeypatch.setattr(api_key_cache, 'API_KEY_NEGATIVE_TTL', 0)
+    api_key_cache.lookup('WRONG')
+    api_key_cache.lookup('WRONG')
+    assert calls == ['WRONG', 'WRONG']
+
+
+def test_new_key_authenticates_right_after_a_miss(client):
+    headers = {'X-API-Key': 'BOB-KEY'}
+    assert client.post('/submit-data', json=READING, headers=headers).status_code == 401
+    database.add_client('bob', 'secret2', 'lab', 'bob@example.com', '', '', 10, 'BOB-KEY')
+    assert client.post('/submit-data', json=READING, headers=headers).status_code == 200
+
+
+def test_deleted_client_key_is_rejected(client):
+    headers = {'X-API-Key': API_KEY}
+    assert client.post('/submit-data', json=READING, headers=headers).status_code == 200
+    database.delete_client('alice')
+    assert client.post('/submit-data', json=READING, headers=headers).status_code == 401
+
+
+def test_email_toggle_refreshes_the_record(db):
+    assert api_key_cache.lookup(API_KEY)['email_enabled'] == 1
+    database.update_user_email_enabled('alice', 0)
+    assert api_key_cache.lookup(API_KEY)['email_enabled'] == 0
+
+
+def test_invalidating_one_client_keeps_the_others(db, monkeypatch):
+    database.add_client('bob', 'secret2', 'lab', 'bob@example.com', '', '', 10, 'BOB-KEY')
+    api_key_cache.lookup(API_KEY)
+    api_key_cache.lookup('BOB-KEY')
+    api_key_cache.lookup('WRONG')
+    calls = _lookups(monkeypatch)
+    api_key_cache.invalidate('bob')
+    for key in (API_KEY, 'BOB-KEY', 'WRONG'):
+        api_key_cache.lookup(key)
+    assert calls == ['BOB-KEY', 'WRONG']  # rejected keys go too - one of them may be bob's new key
+
+
+def test_other_workers_invalidations_are_applied(db, monkeypatch):
+    api_key_cache.lookup(API_KEY)
+    calls = _lookups(monkeypatch)
+    api_key_cache._forget('alice')  # what the 'api_keys' subscription runs for another worker's invalidate()
+    api_key_cache.lookup(API_KEY)
+    api_key_cache._forget(None)  # missed messages: forget everything
+    api_key_cache.lookup(API_KEY)
+    assert calls == [API_KEY, API_KEY]
+
+
+def test_full_cache_drops_rejected_keys_first(db, monkeypatch):
+    monkeypatch.setattr(api_key_cache, 'API_KEY_CACHE_MAX', 3)
+    api_key_cache.lookup(API_KEY)
+    api_key_cache.lookup('WRONG-1')
+    api_key_cache.lookup('WRONG-2')
+    api_key_cache.lookup('WRONG-3')
+    assert set(api_key_cache._cache) == {API_KEY, 'WRONG-3'}
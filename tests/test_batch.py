@@ -0,0 +1,133 @@
+# Batch ingestion (/submit-data/batch): validation, partial failures, atomic saves
+import database
+import routes
+from conftest import API_KEY
+
+HEADERS = {'X-API-Key': API_KEY}
+
+
+def _count():
+    conn = database.get_db_connection()
+    count = conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_batch_saves_every_reading(client):
+    readings = [{'place': 'lab', 'temperature': 21, 'humidity': 50},
+                {'place': 'hall', 'temperature': 30, 'humidity': 50}]
+    response = client.post('/submit-data/batch', json={'readings': readings}, headers=HEADERS)
+    body = response.get_json()
+    assert response.status_code == 200
+    assert (body['accepted'], body['rejected']) == (2, 0)
+    assert body['results'][0]['warning'] == ''
+    assert 'Temperature' in body['results'][1]['warning']
+    assert _count() == 2
+
+
+def test_bare_list_is_accepted(client):
+    response = client.post('/submit-data/batch', json=[{'place': 'lab', 'temperature': 21, 'humidity': 50}], headers=HEADERS)
+    assert response.status_code == 200
+    assert _count() == 1
+
+
+def test_invalid_rows_are_reported_and_the_rest_saved(client):
+    readings = [{'place': 'lab', 'temperature': 21, 'humidity': 50},
+                {'place': 'lab', 'temperature': 21},
+                {'place': 'lab', 'temperature': 'warm', 'humidity': 50},
+                'not a reading',
+                {'place': 'lab', 'temperature': 22, 'humidity': 51}]
+    body = client.post('/submit-data/batch', json=readings, headers=HEADERS).get_json()
+    assert (body['accepted'], body['rejected']) == (2, 3)
+    assert [r['status'] for r in body['results']] == ['success', 'error', 'error', 'error', 'success']
+    assert body['results'][1]['error'] == 'Missing fields'
+    assert body['results'][2]['error'] == 'Invalid number format'
+    assert [r['index'] for r in body['results']] == [0, 1, 2, 3, 4]
+    assert _count() == 2
+
+
+def test_batch_with_no_valid_rows_is_rejected(client):
+    response = client.post('/submit-data/batch', json=[{'place': 'lab'}], headers=HEADERS)
+    assert response.status_code == 400
+    assert response.get_json()['accepted'] == 0
+    assert _count() == 0
+
+
+def test_malformed_and_oversized_batches(client, monkeypatch):
+    assert client.post('/submit-data/batch', json=[], headers=HEADERS).status_code == 400
+    assert client.post('/submit-data/batch', json={'readings': 'x'}, headers=HEADERS).status_code == 400
+    monkeypatch.setattr(routes, 'MAX_BATCH_SIZE', 2)
+    reading = {'place': 'lab', 'temperature': 21, 'humidity': 50}
+    assert client.post('/submit-data/batch', json=[reading] * 3, headers=HEADERS).status_code == 413
+    assert _count() == 0
+
+
+def test_api_key_is_required(client):
+    reading = [{'place': 'lab', 'temperature': 21, 'humidity': 50}]
+    assert client.post('/submit-data/batch', json=reading).status_code == 401
+    assert client.post('/submit-data/batch', json=reading, headers={'X-API-Key': 'nope'}).status_code == 401
+
+
+def test_failed_save_stores_nothing(client, monkeypatch):
+    def fail(rows):
+        raise RuntimeError("disk full")
+    monkeypatch.setattr(routes, 'save_sensor_data_batch', fail)
+    response = client.post('/submit-data/batch', json=[{'place': 'lab', 'temperature': 21, 'humidity': 50}], headers=HEADERS)
+    assert response.status_code == 500
+    assert _count() == 0
+
+
+def test_batch_is_all_or_nothing_in_the_database(db, monkeypatch):
+    # A failure part-way through the transaction rolls back the rows already inserted
+    calls = []
+
+    def fail_after_insert(conn, rows):
+        calls.append(len(rows))
+        raise RuntimeError("rollup failed")
+    monkeypatch.setattr(database, 'update_rollups', fail_after_insert)
+    try:
+        database.save_sensor_data_batch([('c_lab', 'lab', 21.0, 50.0, ''), ('c_lab', 'lab', 22.0, 50.0, '')])
+    except RuntimeError:
+        pass
+    assert calls == [2]
+    assert _count() == 0
+
+
+def test_alert_failure_does_not_fail_the_batch(client, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("alert backend down")
+    monkeypatch.setattr(routes, 'process_batch', fail)
+    response = client.post('/submit-data/batch', json=[{'place': 'lab', 'temperature': 40, 'humidity': 50}], headers=HEADERS)
+    assert response.status_code == 200
+    assert _count() == 1
+
+
+def test_blank_places_are_rejected(client):
+    readings = [{'place': '', 'temperature': 21, 'humidity': 50},
+                {'place': None, 'temperature': 21, 'humidity': 50},
+                {'place': '!!', 'temperature': 21, 'humidity': 50},
+                {'place': 'lab', 'temperature': 21, 'humidity': 50}]
+    body = client.post('/submit-data/batch', json=readings, headers=HEADERS).get_json()
+    assert [r['status'] for r in body['results']] == ['error', 'error', 'error', 'success']
+    assert body['results'][0]['error'] == 'Missing place'
+    assert _count() == 1
+
+
+def test_single_and_batch_endpoints_share_validation(client):
+    cases = [({'place': '', 'temperature': 21, 'humidity': 50}, 'Missing place'),
+             ({'temperature': 21, 'humidity': 50}, 'Missing fields'),
+             ({'place': 'lab', 'temperature': 'warm', 'humidity': 50}, 'Invalid number format'),
+             ({'place': 'lab', 'temperature': None, 'humidity': 50}, 'Invalid number format'),
+             ({'place': 'lab', 'temperature': 'nan', 'humidity': 50}, 'Invalid number format')]
+    for reading, error in cases:
+        single = client.post('/submit-data', json=reading, headers=HEADERS)
+        assert (single.status_code, single.get_json()['error']) == (400, error)
+        batch = client.post('/submit-data/batch', json=[reading], headers=HEADERS).get_json()
+        assert batch['results'][0]['error'] == error
+    assert client.post('/submit-data', data='not json', headers=HEADERS).status_code == 400
+    assert _count() == 0
+    ok = client.post('/submit-data', json={'place': 'Lab 2', 'temperature': 21, 'humidity': 50}, headers=HEADERS)
+    assert ok.status_code == 200
+    conn = database.get_db_connection()
+    assert conn.execute("SELECT client_place, place FROM sensor_data").fetchone()[1] == 'lab_2'
+    conn.close()
@@ -0,0 +1,72 @@
+# Vectorised range checks (helpers.classify_readings) against the scalar check_sensor_ranges
+import itertools
+import random
+
+import database
+import reclassify
+import thresholds
+from helpers import check_sensor_ranges, classify_readings, render_warnings, WARN_OK, WARN_TEMPERATURE, WARN_HUMIDITY
+from config import TEMP_RANGE, HUM_RANGE
+
+
+def _scalar(temperatures, humidities, temp_ranges, hum_ranges):
+    return [check_sensor_ranges(t, h, tr, hr) or '' for t, h, tr, hr in zip(temperatures, humidities, temp_ranges, hum_ranges)]
+
+
+def _boundaries(low, high):
+    step = 1e-9
+    return [low - 1, low - step, low, low + step, (low + high) / 2, high - step, high, high + step, high + 1]
+
+
+def test_matches_the_scalar_check_on_the_boundaries():
+    pairs = list(itertools.product(_boundaries(*map(float, TEMP_RANGE)), _boundaries(*map(float, HUM_RANGE))))
+    temperatures, humidities = [p[0] for p in pairs], [p[1] for p in pairs]
+    codes = classify_readings(temperatures, humidities)
+    assert render_warnings(codes, temperatures, humidities) == _scalar(
+        temperatures, humidities, [TEMP_RANGE] * len(pairs), [HUM_RANGE] * len(pairs))
+    assert codes[len(pairs) // 2] == WARN_OK  # the middle of both ranges
+    assert set(codes.tolist()) == {WARN_OK, WARN_TEMPERATURE, WARN_HUMIDITY, WARN_TEMPERATURE | WARN_HUMIDITY}
+
+
+def test_matches_the_scalar_check_with_per_row_ranges():
+    rng = random.Random(7)
+    temp_ranges = [(rng.choice([-20.0, 0.0, 15.5]), rng.choice([20.0, 25.25, 40.0])) for _ in range(500)]
+    hum_ranges = [(rng.choice([0.0, 30.0, 45.5]), rng.choice([55.0, 60.0, 100.0])) for _ in range(500)]
+    # Mostly random values, plus each row's exact bounds
+    temperatures = [rng.choice([rng.uniform(-30, 50), tr[0], tr[1]]) for tr in temp_ranges]
+    humidities = [rng.choice([rng.uniform(-5, 105), hr[0], hr[1]]) for hr in hum_ranges]
+    temp_bounds = ([r[0] for r in temp_ranges], [r[1] for r in temp_ranges])
+    hum_bounds = ([r[0] for r in hum_ranges], [r[1] for r in hum_ranges])
+    warnings = render_warnings(classify_readings(temperatures, humidities, temp_bounds, hum_bounds), temperatures, humidities)
+    assert warnings == _scalar(temperatures, humidities, temp_ranges, hum_ranges)
+    assert 0 < sum(map(bool, warnings)) < len(warnings)
+
+
+def test_matches_the_scalar_check_with_threshold_profiles(db):
+    thresholds.save_profile('', 'lab', 10, 20, 30, 40)
+    thresholds.save_profile('alice', 'hall', 0, 5, 0, 100)
+    client_places = ['alice_lab_RESILIENT_lab', 'alice_lab_RESILIENT_hall', 'bob_x_cellar'] * 4
+    places = ['lab', 'hall', 'cellar'] * 4
+    temperatures = [10.0, 5.0, 18.0, 20.0, 5.1, 25.0, 9.9, 0.0, 17.9, 20.1, -0.1, 25.1]
+    humidities = [30.0, 100.0, 40.0, 40.0, 50.0, 60.0, 29.9, 0.0, 39.9, 40.1, 100.1, 60.1]
+    temp_range, hum_range = thresholds.lookup_many(client_places, places)
+    warnings = render_warnings(classify_readings(temperatures, humidities, temp_range, hum_range), temperatures, humidities)
+    ranges = [thresholds.lookup(cp, p) for cp, p in zip(client_places, places)]
+    assert warnings == _scalar(temperatures, humidities, [r[0] for r in ranges], [r[1] for r in ranges])
+
+
+def test_reclassify_agrees_with_the_scalar_check(db):
+    stale = 'Temperature out of range (99.0°C)'  # computed under older ranges
+    rows = [('alice_lab_RESILIENT_lab', 'lab', t, h, stale if i % 2 else '', 19700 * 86400 + i)
+            for i, (t, h) in enumerate([(10.0, 30.0), (20.0, 40.0), (20.5, 35.0), (9.0, 41.0), (15.0, 35.0)])]
+    rows.append(('alice_lab_RESILIENT_lab', 'lab', 25.0, 35.0, stale + '; Sensor flatlined (30 identical readings)', 19700 * 86400 + 9))
+    database.save_sensor_data_batch(rows)
+    thresholds.save_profile('', 'lab', 10, 20, 30, 40)
+    reclassify.reclassify_all(include_archives=False, chunk_size=4)
+    conn = database.get_db_connection()
+    stored = [row[0] for row in conn.execute("SELECT warning FROM sensor_data ORDER BY id")]
+    warnings_1m = conn.execute("SELECT SUM(warnings) FROM sensor_rollup_1m").fetchone()[0]
+    conn.close()
+    expected = [check_sensor_ranges(t, h, (10, 20), (30, 40)) or '' for _, _, t, h, _, _ in rows[:5]]
+    assert stored == expected + ['Temperature out of range (25.0°C); Sensor flatlined (30 identical readings)']
+    assert warnings_1m == sum(map(bool, stored))
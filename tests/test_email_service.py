@@ -0,0 +1,178 @@
+# Alert dispatcher: queueing, SMTP retries and shutdown draining, against a stub SMTP class
+import smtplib
+import time
+from email.mime.text import MIMEText
+
+import pytest
+
+import email_service
+
+
+class StubSMTP:
+    """Stands in for smtplib.SMTP; class attributes script failures and record what happened"""
+
+    instances = []
+    sent = []
+    failures = []   # exceptions raised by the next send_message calls, in order
+    send_delay = 0.0
+    noop_fails = False
+
+    def __init__(self, server, port, timeout=None):
+        self.closed = False
+        StubSMTP.instances.append(self)
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def noop(self):
+        if StubSMTP.noop_fails:
+            raise smtplib.SMTPServerDisconnected("idle timeout")
+        return (250, b'OK')
+
+    def send_message(self, msg):
+        time.sleep(StubSMTP.send_delay)
+        if StubSMTP.failures:
+            raise StubSMTP.failures.pop(0)
+        StubSMTP.sent.append(msg['To'])
+
+    def quit(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def stub_smtp(monkeypatch):
+    monkeypatch.setattr(email_service.smtplib, 'SMTP', StubSMTP)
+    monkeypatch.setattr(StubSMTP, 'instances', [])
+    monkeypatch.setattr(StubSMTP, 'sent', [])
+    monkeypatch.setattr(StubSMTP, 'failures', [])
+
+
+def _message(to='alice@example.com'):
+    msg = MIMEText('body')
+    msg['Subject'], msg['From'], msg['To'] = 'Alert', 'alerts@localhost', to
+    return msg
+
+
+def _settle(dispatcher, count, timeout=5):
+    """Wait until count messages were sent or gave up - stop() would cut retries short"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = dispatcher.get_stats()
+        if stats['sent'] + stats['failed'] >= count:
+            return
+        time.sleep(0.01)
+
+
+def _dispatcher(**kwargs):
+    kwargs.setdefault('backoff', 0.001)
+    return email_service.AlertDispatcher(server='stub', port=25, use_tls=False, **kwargs)
+
+
+def test_queued_messages_share_one_session():
+    dispatcher = _dispatcher()
+    dispatcher.start()
+    for i in range(3):
+        assert dispatcher.enqueue(_message(f"user{i}@example.com"))
+    dispatcher.stop()
+    assert StubSMTP.sent == ['user0@example.com', 'user1@example.com', 'user2@example.com']
+    stats = dispatcher.get_stats()
+    assert (stats['enqueued'], stats['sent'], stats['connects'], stats['queue_depth']) == (3, 3, 1, 0)
+    assert StubSMTP.instances[0].closed  # session closed on shutdown
+
+
+def test_transient_failures_reconnect_and_retry():
+    StubSMTP.failures.extend([smtplib.SMTPServerDisconnected("dropped"), ConnectionResetError("reset")])
+    dispatcher = _dispatcher()
+    dispatcher.start()
+    dispatcher.enqueue(_message())
+    _settle(dispatcher, 1)
+    dispatcher.stop()
+    stats = dispatcher.get_stats()
+    assert StubSMTP.sent == ['alice@example.com']
+    assert (stats['sent'], stats['retries'], stats['failed'], stats['connects']) == (1, 2, 0, 3)
+
+
+def test_retries_give_up_after_max_retries():
+    StubSMTP.failures.extend([smtplib.SMTPServerDisconnected("down")] * 10)
+    dispatcher = _dispatcher(max_retries=2)
+    dispatcher.start()
+    dispatcher.enqueue(_message())
+    dispatcher.enqueue(_message('bob@example.com'))
+    _settle(dispatcher, 2)
+    dispatcher.stop()
+    stats = dispatcher.get_stats()
+    assert (stats['failed'], stats['retries'], stats['sent']) == (2, 4, 0)
+
+
+def test_permanent_errors_are_not_retried():
+    StubSMTP.failures.append(smtplib.SMTPRecipientsRefused({'alice@example.com': (550, b'no such user')}))
+    dispatcher = _dispatcher()
+    dispatcher.start()
+    dispatcher.enqueue(_message())
+    dispatcher.enqueue(_message('bob@example.com'))
+    dispatcher.stop()
+    stats = dispatcher.get_stats()
+    assert StubSMTP.sent == ['bob@example.com']
+    assert (stats['failed'], stats['retries'], stats['sent']) == (1, 0, 1)
+
+
+def test_idle_session_is_probed_and_replaced(monkeypatch):
+    monkeypatch.setattr(email_service, 'SMTP_IDLE_CHECK', 0)
+    monkeypatch.setattr(StubSMTP, 'noop_fails', True)
+    dispatcher = _dispatcher()
+    dispatcher.start()
+    dispatcher.enqueue(_message())
+    dispatcher.enqueue(_message('bob@example.com'))
+    dispatcher.stop()
+    assert StubSMTP.sent == ['alice@example.com', 'bob@example.com']
+    assert dispatcher.get_stats()['connects'] == 2
+
+
+def test_full_queue_drops_and_senderless_messages_are_refused():
+    dispatcher = _dispatcher(max_queue=1)  # not started, so nothing drains
+    assert dispatcher.enqueue(_message())
+    assert not dispatcher.enqueue(_message('bob@example.com'))
+    no_sender = _message()
+    del no_sender['From']
+    assert not dispatcher.enqueue(no_sender)
+    stats = dispatcher.get_stats()
+    assert (stats['enqueued'], stats['dropped_full'], stats['rejected'], stats['queue_depth']) == (1, 1, 1, 1)
+
+
+def test_stop_drains_the_queue():
+    dispatcher = _dispatcher()
+    for i in range(5):
+        dispatcher.enqueue(_message(f"user{i}@example.com"))
+    dispatcher.start()
+    dispatcher.stop()
+    assert len(StubSMTP.sent) == 5
+    assert dispatcher.get_stats()['queue_depth'] == 0
+
+
+def test_stop_does_not_wait_out_retry_backoff():
+    StubSMTP.failures.extend([smtplib.SMTPServerDisconnected("down")] * 10)
+    dispatcher = _dispatcher(backoff=30)
+    dispatcher.start()
+    dispatcher.enqueue(_message())
+    dispatcher.enqueue(_message('bob@example.com'))
+    time.sleep(0.2)  # first attempt failed, now waiting to retry
+    started = time.monotonic()
+    dispatcher.stop()
+    assert time.monotonic() - started < 5
+    stats = dispatcher.get_stats()
+    # Each queued message still gets one attempt; none waits for a retry
+    assert (stats['failed'], stats['sent'], stats['queue_depth']) == (2, 0, 0)
+
+
+def test_send_email_queues_on_the_process_dispatcher(monkeypatch):
+    dispatcher = _dispatcher()
+    monkeypatch.setattr(email_service, '_dispatcher', dispatcher)
+    monkeypatch.setattr(email_service, 'EMAIL_SENDER', 'alerts@localhost')
+    assert email_service.send_alert_email('alice', 'lab', 30.0, 50.0, 'Temperature out of range', 'alice@example.com')
+    assert not email_service.send_email('', 'subject', 'body')
+    dispatcher.start()
+    dispatcher.stop()
+    assert StubSMTP.sent == ['alice@example.com']
@@ -0,0 +1,70 @@
+# Conditional GET: ETag / Last-Modified validators and 304s on the data endpoints
+import pytest
+
+import data_versions
+import database
+from conftest import API_KEY
+
+
+@pytest.mark.parametrize('url', ['/api/data', '/latest-data', '/dashboard'])
+def test_repeat_request_is_304_until_new_data(owner_client, url):
+    first = owner_client.get(url)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+
+    cached = owner_client.get(url, headers={'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.headers['ETag'] == etag
+    assert cached.data == b''
+
+    database.save_sensor_data('alice_lab', 'lab', 21.0, 50.0, '')
+    fresh = owner_client.get(url, headers={'If-None-Match': etag})
+    assert fresh.status_code == 200
+    assert fresh.headers['ETag'] != etag
+
+
+def test_place_filter_ignores_other_places(owner_client):
+    etag = owner_client.get('/api/data?place=lab').headers['ETag']
+    database.save_sensor_data('alice_hall', 'hall', 21.0, 50.0, '')
+    assert owner_client.get('/api/data?place=lab', headers={'If-None-Match': etag}).status_code == 304
+    database.save_sensor_data('alice_lab', 'lab', 21.0, 50.0, '')
+    assert owner_client.get('/api/data?place=lab', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_query_parameters_are_part_of_the_etag(owner_client):
+    etag = owner_client.get('/api/data?limit=5').headers['ETag']
+    assert owner_client.get('/api/data?limit=6', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_batch_ingest_changes_the_etag(owner_client, client):
+    etag = owner_client.get('/latest-data').headers['ETag']
+    response = client.post('/submit-data/batch', json={'readings': [{'place': 'lab', 'temperature': 21, 'humidity': 50}]},
+                           headers={'X-API-Key': API_KEY})
+    assert response.status_code == 200
+    assert owner_client.get('/latest-data', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_if_modified_since(owner_client):
+    database.save_sensor_data('alice_lab', 'lab', 21.0, 50.0, '')
+    first = owner_client.get('/latest-data')
+    last_modified = first.headers['Last-Modified']
+    assert owner_client.get('/latest-data', headers={'If-Modified-Since': last_modified}).status_code == 304
+    # If-None-Match wins over If-Modified-Since
+    assert owner_client.get('/latest-data', headers={
+        'If-Modified-Since': last_modified, 'If-None-Match': '"stale"'}).status_code == 200
+
+
+def test_signals_do_not_change_data_versions(owner_client):
+    etag = owner_client.get('/api/data').headers['ETag']
+    version = data_versions.get_version()
+    data_versions.touch('thresholds')
+    data_versions.touch('shared_state')
+    assert data_versions.get_version() == version
+    assert owner_client.get('/api/data', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_history_rewrite_changes_every_etag(owner_client):
+    etag = owner_client.get('/api/data?place=lab').headers['ETag']
+    data_versions.bump_all()
+    assert owner_client.get('/api/data?place=lab', headers={'If-None-Match': etag}).status_code == 200
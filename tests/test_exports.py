@@ -0,0 +1,121 @@
+# Exports: chunked reads, place / time filters, partition pruning, formats and the closed-range cache
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+
+import pytest
+
+import config
+import database
+import exporters
+import storage
+
+DAY = 86400
+T0 = 19700 * DAY  # 2023-12-09, a closed range
+
+
+@pytest.fixture(params=['single', 'partitioned'])
+def readings(request, db, monkeypatch):
+    """Seven readings a day over three days, alternating places; returns (ts, place) newest first"""
+    monkeypatch.setattr(storage, '_storage', storage.PartitionedStorage() if request.param == 'partitioned'
+                        else storage.SingleTableStorage())
+    rows = [('alice_lab' if i % 2 else 'alice_hall', 'lab' if i % 2 else 'hall', 20.0 + i, 50.0, '', T0 + day * DAY + i * 60)
+            for day in range(3) for i in range(7)]
+    database.save_sensor_data_batch(rows)
+    yield sorted(((row[5], row[1]) for row in rows), reverse=True)
+    shutil.rmtree(config.EXPORT_CACHE_DIR, ignore_errors=True)
+
+
+def _chunks(**kwargs):
+    return [[tuple(row) for row in chunk] for chunk in database.iter_sensor_data(**kwargs)]
+
+
+def test_chunks_cover_every_row_once_newest_first(readings):
+    for chunk_size in (1, 3, 7, 8, 100):
+        chunks = _chunks(chunk_size=chunk_size)
+        assert all(0 < len(chunk) <= chunk_size for chunk in chunks)
+        rows = [row for chunk in chunks for row in chunk]
+        assert [row[2] for row in rows] == [place for _, place in readings]
+        assert [row[0] for row in rows] == sorted((row[0] for row in rows), reverse=True)
+
+
+def test_place_filter(readings):
+    rows = [row for chunk in _chunks(place='lab', chunk_size=2) for row in chunk]
+    assert len(rows) == 9 and {row[2] for row in rows} == {'lab'}
+    assert len([row for chunk in _chunks(place='All') for row in chunk]) == 21
+
+
+def test_time_range_reads_only_the_days_it_covers(readings, monkeypatch):
+    read = []
+    real = storage.iter_tables
+
+    def spy(conn, tables, *args, **kwargs):
+        read.append(list(tables))
+        return real(conn, tables, *args, **kwargs)
+    monkeypatch.setattr(storage, 'iter_tables', spy)
+    rows = [row for chunk in _chunks(start_ts=T0 + DAY, end_ts=T0 + 2 * DAY) for row in chunk]
+    assert len(rows) == 7
+    if storage.get_storage().name == 'partitioned':
+        assert read == [[storage._day_name(19701), 'sensor_data']]
+    else:
+        assert read == [['sensor_data']]
+
+
+def _export(owner_client, fmt, **params):
+    response = owner_client.get('/export', query_string=dict(params, format=fmt))
+    assert response.status_code == 200
+    return response.data
+
+
+def test_formats_carry_the_same_rows(owner_client, readings):
+    params = {'place': 'lab', 'start_date': '2023-12-10', 'end_date': '2023-12-10'}
+    text = _export(owner_client, 'csv', **params).decode('utf-8')
+    header, *rows = list(csv.reader(io.StringIO(text)))
+    assert header == exporters.CSV_HEADER
+    assert len(rows) == 3 and {row[2] for row in rows} == {'lab'}
+    assert gzip.decompress(_export(owner_client, 'csv.gz', **params)).decode('utf-8') == text
+    lines = [json.loads(line) for line in _export(owner_client, 'ndjson', **params).decode('utf-8').splitlines()]
+    assert [(line['client_place'], line['temperature']) for line in lines] == [(row[1], float(row[3])) for row in rows]
+
+
+def test_parquet(owner_client, readings, monkeypatch):
+    pq = pytest.importorskip('pyarrow.parquet')
+    monkeypatch.setattr(exporters, 'EXPORT_PARQUET_ROW_GROUP', 5)
+    table = pq.read_table(io.BytesIO(_export(owner_client, 'parquet')))
+    assert table.num_rows == 21
+    assert table.column('temperature').to_pylist()[:2] == [26.0, 25.0]
+    # Groups are cut at the first chunk boundary past EXPORT_PARQUET_ROW_GROUP rows
+    data = b''.join(exporters.iter_parquet(database.iter_sensor_data(place='hall', chunk_size=2)))
+    hall = pq.ParquetFile(io.BytesIO(data))
+    assert hall.metadata.num_rows == 12
+    assert [hall.metadata.row_group(i).num_rows for i in range(hall.metadata.num_row_groups)] == [6, 6]
+    assert set(hall.read().column('place').to_pylist()) == {'hall'}
+
+
+def test_unknown_format(owner_client, readings):
+    assert owner_client.get('/export?format=xml').status_code == 400
+
+
+def test_closed_ranges_are_cached(owner_client, readings, monkeypatch):
+    params = {'start_date': '2023-12-09', 'end_date': '2023-12-11'}
+    first = _export(owner_client, 'csv', **params)
+    assert exporters.cached_export('csv', None, T0, T0 + 3 * DAY) is not None
+    monkeypatch.setattr(database, 'iter_sensor_data', lambda *args, **kwargs: pytest.fail("read the database"))
+    assert _export(owner_client, 'csv', **params) == first
+    # Open-ended ranges can still change, so they are never cached
+    _export(owner_client, 'ndjson')
+    assert not [name for name in os.listdir(config.EXPORT_CACHE_DIR) if name.endswith('.ndjson')]
+
+
+def test_failed_export_leaves_no_cache_file(readings):
+    def broken():
+        yield [('2023-12-09 00:00:00', 'alice_lab', 'lab', 20.0, 50.0, '')]
+        raise RuntimeError("query failed")
+    stream = exporters.export_stream('csv', broken(), None, T0, T0 + DAY)
+    with pytest.raises(RuntimeError):
+        list(stream)
+    assert os.listdir(config.EXPORT_CACHE_DIR) == []
+    assert exporters.cached_export('csv', None, T0, T0 + DAY) is None
@@ -0,0 +1,126 @@
+# Write-behind ingestion: group commits by size and delay, shutdown flush, what gets lost
+import time
+
+import pytest
+
+import database
+import ingest_buffer
+import routes
+from conftest import API_KEY
+
+
+def _reading(i=0):
+    return ('alice_lab', 'lab', 20.0 + i, 50.0, '')
+
+
+def _count():
+    conn = database.get_db_connection()
+    count = conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0]
+    conn.close()
+    return count
+
+
+def _wait_for(condition, timeout=3):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and not condition():
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.fixture
+def make_buffer(db):
+    buffers = []
+
+    def make(**kwargs):
+        buffer = ingest_buffer.IngestBuffer(**kwargs)
+        buffer.start()
+        buffers.append(buffer)
+        return buffer
+    yield make
+    for buffer in buffers:
+        buffer.stop()
+
+
+def test_flushes_as_soon_as_a_group_is_full(make_buffer):
+    buffer = make_buffer(max_rows=5, max_delay=30)
+    for i in range(5):
+        assert buffer.submit(_reading(i))
+    assert _wait_for(lambda: _count() == 5, timeout=2)
+    stats = buffer.get_stats()
+    assert (stats['flushes'], stats['rows_flushed'], stats['queue_depth']) == (1, 5, 0)
+
+
+def test_flushes_a_partial_group_after_max_delay(make_buffer):
+    buffer = make_buffer(max_rows=1000, max_delay=0.1)
+    for i in range(3):
+        buffer.submit(_reading(i))
+    assert _count() == 0  # acknowledged, not committed yet
+    assert _wait_for(lambda: _count() == 3)
+    assert buffer.get_stats()['flushes'] == 1
+
+
+def test_rows_keep_their_receive_time(make_buffer):
+    buffer = make_buffer(max_rows=1, max_delay=0.05)
+    before = int(time.time())
+    buffer.submit(_reading())
+    assert _wait_for(lambda: _count() == 1)
+    conn = database.get_db_connection()
+    ts = conn.execute("SELECT ts FROM sensor_data").fetchone()[0]
+    conn.close()
+    assert before <= ts <= int(time.time())
+
+
+def test_stop_flushes_what_is_queued(make_buffer):
+    buffer = make_buffer(max_rows=1000, max_delay=0.3)
+    for i in range(7):
+        buffer.submit(_reading(i))
+    buffer.stop()
+    assert _count() == 7
+    assert buffer.get_stats()['queue_depth'] == 0
+
+
+def test_nothing_is_accepted_after_stop(make_buffer):
+    buffer = make_buffer()
+    buffer.stop()
+    assert not buffer.submit(_reading())
+    assert buffer.get_stats()['enqueued'] == 0
+
+
+def test_full_queue_refuses(make_buffer):
+    buffer = ingest_buffer.IngestBuffer(max_queue=2)  # no writer, so nothing drains
+    assert buffer.submit(_reading()) and buffer.submit(_reading())
+    assert not buffer.submit(_reading())
+    assert buffer.get_stats()['rejected_full'] == 1
+
+
+def test_a_group_that_keeps_failing_is_dropped(make_buffer, monkeypatch):
+    monkeypatch.setattr(ingest_buffer, 'WRITE_RETRIES', 2)
+
+    def fail(rows):
+        raise RuntimeError("database is locked")
+    monkeypatch.setattr(database, 'save_sensor_data_batch', fail)
+    buffer = make_buffer(max_rows=3, max_delay=0.05)
+    for i in range(3):
+        buffer.submit(_reading(i))
+    assert _wait_for(lambda: buffer.get_stats()['rows_dropped'] == 3)
+    assert buffer.get_stats()['rows_flushed'] == 0
+
+
+def test_submit_data_goes_through_the_buffer(client, make_buffer, monkeypatch):
+    buffer = make_buffer(max_rows=1000, max_delay=0.1)
+    monkeypatch.setattr(routes, 'get_ingest_buffer', lambda: buffer)
+    response = client.post('/submit-data', json={'place': 'lab', 'temperature': 21, 'humidity': 50},
+                           headers={'X-API-Key': API_KEY})
+    assert response.status_code == 200
+    assert buffer.get_stats()['enqueued'] == 1
+    assert _wait_for(lambda: _count() == 1)
+
+
+def test_submit_data_writes_directly_when_the_buffer_refuses(client, make_buffer, monkeypatch):
+    buffer = make_buffer()
+    buffer.stop()
+    monkeypatch.setattr(routes, 'get_ingest_buffer', lambda: buffer)
+    response = client.post('/submit-data', json={'place': 'lab', 'temperature': 21, 'humidity': 50},
+                           headers={'X-API-Key': API_KEY})
+    assert response.status_code == 200
+    assert _count() == 1
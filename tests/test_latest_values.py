@@ -0,0 +1,91 @@
+# /latest-data last-value map: record, batches, other workers' rows and resyncs
+import database
+import data_versions
+import latest_values
+
+T0 = 19700 * 86400
+
+
+def _row(client_place, place, temperature, ts, warning=''):
+    return (client_place, place, temperature, 50.0, warning, database._utc_stamp(ts)[0], ts)
+
+
+def _latest(place=None):
+    return [(r['client_place'], r['temperature']) for r in latest_values.get_latest(place)]
+
+
+def test_saved_readings_are_served_newest_first(db):
+    database.save_sensor_data_batch([('alice_lab', 'lab', 20.0, 50.0, '', T0 + 10),
+                                     ('alice_hall', 'hall', 21.0, 50.0, '', T0 + 20)])
+    assert _latest() == [('alice_hall', 21.0), ('alice_lab', 20.0)]
+    database.save_sensor_data('alice_lab', 'lab', 22.0, 50.0, '')
+    assert _latest() == [('alice_lab', 22.0), ('alice_hall', 21.0)]
+
+
+def test_newest_reading_of_a_batch_wins_in_any_order(db):
+    latest_values.get_latest()  # first sync done, from here on only record() feeds the map
+    database.save_sensor_data_batch([('alice_lab', 'lab', 23.0, 50.0, '', T0 + 30),
+                                     ('alice_lab', 'lab', 21.0, 50.0, '', T0 + 10),
+                                     ('alice_lab', 'lab', 22.0, 50.0, '', T0 + 20)])
+    assert _latest() == [('alice_lab', 23.0)]
+    # A late reading older than the one held doesn't replace it
+    database.save_sensor_data_batch([('alice_lab', 'lab', 19.0, 50.0, '', T0 + 5)])
+    assert _latest() == [('alice_lab', 23.0)]
+
+
+def test_place_filter_matches_place_or_client_place(db):
+    database.save_sensor_data_batch([('alice_lab', 'lab', 20.0, 50.0, '', T0 + 10),
+                                     ('bob_lab', 'lab', 21.0, 50.0, '', T0 + 20),
+                                     ('alice_hall', 'hall', 22.0, 50.0, '', T0 + 30)])
+    assert _latest('lab') == [('bob_lab', 21.0), ('alice_lab', 20.0)]
+    assert _latest('alice_hall') == [('alice_hall', 22.0)]
+    assert len(_latest('All')) == 3
+
+
+def test_first_poll_loads_the_database(db):
+    database.save_sensor_data_batch([('alice_lab', 'lab', 20.0, 50.0, '', T0 + 10),
+                                     ('alice_lab', 'lab', 24.0, 50.0, '', T0 + 40)])
+    latest_values._latest.clear()
+    latest_values._synced_at = None  # as in a freshly started worker
+    assert _latest() == [('alice_lab', 24.0)]
+
+
+def test_rows_published_by_another_worker_are_merged(db):
+    latest_values.get_latest()
+    latest_values._on_published([list(_row('bob_lab', 'lab', 25.0, T0 + 50)),
+                                 list(_row('bob_lab', 'lab', 24.0, T0 + 40))])
+    assert _latest() == [('bob_lab', 25.0)]
+
+
+def test_missed_messages_force_a_resync(db):
+    latest_values.get_latest()
+    conn = database.get_db_connection()
+    database.get_storage().insert(conn, [_row('alice_lab', 'lab', 30.0, T0 + 60)])
+    conn.execute("INSERT OR IGNORE INTO known_client_places (client_place) VALUES ('alice_lab')")
+    conn.commit()
+    conn.close()
+    assert _latest() == []  # written behind the cache's back, nothing announced it
+    latest_values._on_published(None)
+    assert _latest() == [('alice_lab', 30.0)]
+
+
+def test_history_rewrite_forces_a_resync(db):
+    database.save_sensor_data_batch([('alice_lab', 'lab', 20.0, 50.0, '', T0 + 10)])
+    assert _latest() == [('alice_lab', 20.0)]
+    conn = database.get_db_connection()
+    conn.execute("UPDATE sensor_data SET temperature = 26.0")
+    conn.commit()
+    conn.close()
+    data_versions.bump_all()
+    assert _latest() == [('alice_lab', 26.0)]
+
+
+def test_local_backend_notices_other_workers_writes(db):
+    latest_values.get_latest()
+    conn = database.get_db_connection()
+    database.get_storage().insert(conn, [_row('alice_lab', 'lab', 31.0, T0 + 70)])
+    conn.execute("INSERT OR IGNORE INTO known_client_places (client_place) VALUES ('alice_lab')")
+    conn.commit()
+    conn.close()
+    data_versions.bump(['alice_lab', 'lab'])  # the other worker's bump, shared through the mmap file
+    assert _latest() == [('alice_lab', 31.0)]
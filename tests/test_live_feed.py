@@ -0,0 +1,98 @@
+# Live feed (/stream): subscriber cap, per-client / per-place filtering, slow-tab resync
+import json
+
+import pytest
+
+import config
+import live_feed
+
+
+@pytest.fixture
+def broker(db, monkeypatch):
+    fresh = live_feed.LiveFeedBroker()
+    monkeypatch.setattr(live_feed, '_broker', fresh)
+    return fresh
+
+
+def _row(client_place, place, temperature=21.0, warning=''):
+    return (client_place, place, temperature, 50.0, warning, '2024-01-01 12:00:00', 1704110400)
+
+
+def _events(subscriber):
+    events = []
+    while not subscriber.queue.empty():
+        event, data = subscriber.queue.get_nowait().decode().strip().split('\n')
+        events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return events
+
+
+def test_default_cap_leaves_threads_for_ingestion():
+    assert config.SSE_MAX_SUBSCRIBERS <= config.WEB_THREADS - config.SSE_RESERVED_THREADS
+
+
+def test_streams_above_the_cap_are_refused(broker, monkeypatch):
+    monkeypatch.setattr(live_feed, 'SSE_MAX_SUBSCRIBERS', 2)
+    first, second = broker.subscribe(), broker.subscribe()
+    assert first and second
+    assert broker.subscribe() is None
+    assert broker.get_stats()['refused'] == 1
+    broker.unsubscribe(first)
+    assert broker.subscribe() is not None
+
+
+def test_stream_route_answers_503_at_the_cap(owner_client, broker, monkeypatch):
+    monkeypatch.setattr(live_feed, 'SSE_MAX_SUBSCRIBERS', 1)
+    opened = owner_client.get('/stream')
+    assert opened.status_code == 200
+    assert opened.mimetype == 'text/event-stream'
+    refused = owner_client.get('/stream')
+    assert refused.status_code == 503
+    opened.close()
+
+
+def test_stream_route_filters_by_the_logged_in_client(client, broker):
+    with client.session_transaction() as session:
+        session['username'], session['role'] = 'alice', 'client'
+    response = client.get('/stream?place=lab')
+    assert response.status_code == 200
+    (subscriber,) = broker._subscribers
+    assert subscriber.client_prefix == 'alice_lab_RESILIENT_'
+    assert subscriber.place == 'lab'
+    response.close()
+
+
+def test_clients_only_receive_their_own_sensors(broker):
+    alice = broker.subscribe(client_prefix='alice_')
+    owner = broker.subscribe()
+    broker.publish([_row('alice_lab', 'lab'), _row('bob_lab', 'lab'), _row('alice_hall', 'hall')])
+    assert [data['client_place'] for _, data in _events(alice)] == ['alice_lab', 'alice_hall']
+    assert [data['client_place'] for _, data in _events(owner)] == ['alice_lab', 'bob_lab', 'alice_hall']
+
+
+def test_place_filter_matches_place_or_client_place(broker):
+    by_place = broker.subscribe(place='lab')
+    by_client_place = broker.subscribe(place='alice_hall')
+    everything = broker.subscribe(place='All')
+    broker.publish([_row('alice_lab', 'lab'), _row('bob_lab', 'lab'), _row('alice_hall', 'hall')])
+    assert [data['client_place'] for _, data in _events(by_place)] == ['alice_lab', 'bob_lab']
+    assert [data['client_place'] for _, data in _events(by_client_place)] == ['alice_hall']
+    assert len(_events(everything)) == 3
+
+
+def test_warnings_and_range_flags(broker):
+    subscriber = broker.subscribe()
+    broker.publish([_row('alice_lab', 'lab', 30.0, 'Temperature high'), _row('alice_lab', 'lab')])
+    (warning_event, warning), (reading_event, reading) = _events(subscriber)
+    assert (warning_event, warning['temp_alert']) == ('warning', True)
+    assert (reading_event, reading['temp_alert'], reading['hum_alert']) == ('reading', False, False)
+
+
+def test_a_full_queue_resyncs_that_tab_only(broker, monkeypatch):
+    monkeypatch.setattr(live_feed, 'SSE_QUEUE_SIZE', 2)
+    slow, other = broker.subscribe(client_prefix='alice_'), broker.subscribe(client_prefix='bob_')
+    broker.publish([_row('alice_lab', 'lab')] * 3 + [_row('bob_lab', 'lab')])
+    assert slow.dropped and not other.dropped
+    frames = list(broker.stream(slow))
+    assert frames[0].startswith(b'retry:')
+    assert frames[-1].startswith(b'event: resync')
+    assert slow not in broker._subscribers
@@ -0,0 +1,69 @@
+# Schema migrations: fresh databases, legacy databases, and running them again
+import sqlite3
+
+import pytest
+
+import migrations
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'migrate.db')
+    yield conn
+    conn.close()
+
+
+def _schema(conn):
+    return conn.execute("SELECT type, name, sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_%' ORDER BY name").fetchall()
+
+
+def _legacy_database(conn):
+    # What the app created before migrations existed: no ts column, no registries
+    conn.executescript("""
+        CREATE TABLE clients (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL,
+                              places TEXT, email TEXT);
+        CREATE TABLE sensor_data (id INTEGER PRIMARY KEY AUTOINCREMENT, place TEXT, client_place TEXT,
+                                  temperature REAL, humidity REAL, warning TEXT, timestamp DATETIME);
+        INSERT INTO clients (username, places) VALUES ('alice', 'lab');
+        INSERT INTO sensor_data (place, client_place, temperature, humidity, warning, timestamp) VALUES
+            ('lab', 'alice_lab', 21.0, 50.0, '', '2024-01-01 10:00:00'),
+            ('lab', 'alice_lab', 30.0, 50.0, 'Temperature too high', '2024-01-01 10:00:30'),
+            ('hall', 'alice_hall', 20.0, 45.0, '', '2024-01-02 08:00:00');
+    """)
+    conn.commit()
+
+
+def test_fresh_database_reaches_latest_version(conn):
+    assert migrations.migrate(conn) == migrations.LATEST_VERSION
+    assert migrations.get_schema_version(conn) == migrations.LATEST_VERSION
+
+
+def test_migrating_again_changes_nothing(conn):
+    migrations.migrate(conn)
+    schema = _schema(conn)
+    assert migrations.migrate(conn) == migrations.LATEST_VERSION
+    assert _schema(conn) == schema
+
+
+def test_legacy_database_is_upgraded_in_place(conn):
+    _legacy_database(conn)
+    migrations.migrate(conn)
+    assert {'password_hash', 'role', 'api_key', 'formatted_name'} <= migrations._columns(conn, 'clients')
+    assert conn.execute("SELECT ts FROM sensor_data ORDER BY id").fetchall() == [(1704103200,), (1704103230,), (1704182400,)]
+    assert conn.execute("SELECT place FROM known_places ORDER BY place").fetchall() == [('hall',), ('lab',)]
+    assert conn.execute("SELECT client_place FROM known_client_places ORDER BY 1").fetchall() == [('alice_hall',), ('alice_lab',)]
+    assert conn.execute("SELECT SUM(count), SUM(warnings) FROM sensor_rollup_1d").fetchone() == (3, 1)
+
+
+def test_every_migration_can_be_reapplied(conn):
+    # A crash between a migration's work and its version bump means it runs again
+    _legacy_database(conn)
+    migrations.migrate(conn)
+    schema = _schema(conn)
+    for number, _, _ in migrations.MIGRATIONS[1:]:
+        conn.execute(f"PRAGMA user_version = {number - 1}")
+        assert migrations.migrate(conn) == migrations.LATEST_VERSION
+        assert _schema(conn) == schema
+    assert conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0] == 3
+    assert conn.execute("SELECT COUNT(*) FROM known_places").fetchone()[0] == 2
+    assert conn.execute("SELECT SUM(count) FROM sensor_rollup_1m").fetchone()[0] == 3  # rebuilt, not added twice
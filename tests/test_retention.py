@@ -0,0 +1,102 @@
+# Retention: archiving expired readings to monthly files and reading them back
+import os
+import shutil
+import sqlite3
+from datetime import datetime, timezone
+
+import pytest
+
+import config
+import database
+import retention
+import rollups
+import storage
+
+DAY = 86400
+NOW = int(datetime(2023, 12, 9, tzinfo=timezone.utc).timestamp())
+OCT = int(datetime(2023, 10, 15, tzinfo=timezone.utc).timestamp())
+NOV = int(datetime(2023, 11, 1, tzinfo=timezone.utc).timestamp())
+
+
+@pytest.fixture(params=['single', 'partitioned'])
+def readings(request, db, monkeypatch):
+    """Ten readings in each of October, November and the last week (newest ts first)"""
+    monkeypatch.setattr(storage, '_storage', storage.PartitionedStorage() if request.param == 'partitioned'
+                        else storage.SingleTableStorage())
+    monkeypatch.setattr(retention, 'RETENTION_RAW_DAYS', 30)
+    monkeypatch.setattr(retention, 'RETENTION_MODE', 'archive')
+    monkeypatch.setattr(retention, 'RETENTION_PAUSE', 0)
+    monkeypatch.setattr(retention, 'RETENTION_BATCH_SIZE', 4)  # several batches per month
+    rows = [('alice_lab' if i % 2 else 'alice_hall', 'lab' if i % 2 else 'hall', 20.0 + i, 50.0, '', start + i * 600)
+            for start in (OCT, NOV, NOW - 7 * DAY) for i in range(10)]
+    database.save_sensor_data_batch(rows)
+    yield sorted((row[5] for row in rows), reverse=True)
+    shutil.rmtree(config.ARCHIVE_DIR, ignore_errors=True)
+
+
+def _live_count():
+    conn = database.get_db_connection()
+    count = sum(conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in storage.get_storage().tables(conn))
+    conn.close()
+    return count
+
+
+def test_sweep_moves_expired_rows_to_monthly_archives(readings):
+    assert retention.run_sweep(now=NOW)['raw'] == 20
+    assert _live_count() == 10
+    assert retention.list_archive_months() == ['202310', '202311']
+    for month in ('202310', '202311'):
+        conn = sqlite3.connect(retention.archive_path(month))
+        assert conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0] == 10
+        conn.close()
+    # A second sweep finds nothing left to do
+    assert retention.run_sweep(now=NOW)['raw'] == 0
+
+
+def test_exports_include_archived_months(readings):
+    retention.run_sweep(now=NOW)
+    exported = [row for chunk in database.iter_sensor_data(chunk_size=7) for row in chunk]
+    assert len(exported) == 30
+    october = [row for chunk in database.iter_sensor_data(start_ts=OCT, end_ts=NOV) for row in chunk]
+    assert len(october) == 10
+    lab = [row for chunk in database.iter_sensor_data(place='lab') for row in chunk]
+    assert len(lab) == 15
+
+
+def test_pages_continue_into_archived_months(readings):
+    retention.run_sweep(now=NOW)
+    seen, cursor = [], None
+    while True:
+        rows, cursor = database.get_sensor_page(cursor=cursor, limit=7)
+        seen.extend(row[1] for row in rows)
+        if cursor is None:
+            break
+    assert seen == readings
+    rows, _ = database.get_sensor_page(place='lab', start_ts=OCT, end_ts=NOV, limit=100)
+    assert len(rows) == 5
+
+
+def test_dashboard_api_reads_archives(owner_client, readings):
+    retention.run_sweep(now=NOW)
+    body = owner_client.get('/api/data?start_date=2023-10-01&end_date=2023-10-31').get_json()
+    assert len(body['rows']) == 10
+
+
+def test_rollups_outlive_the_raw_readings(readings, monkeypatch):
+    before = rollups.query_rollups(start_ts=OCT, end_ts=OCT + DAY)
+    retention.run_sweep(now=NOW)
+    assert rollups.query_rollups(start_ts=OCT, end_ts=OCT + DAY) == before
+    monkeypatch.setattr(retention, 'RETENTION_ROLLUP_1M_DAYS', 30)
+    monkeypatch.setattr(rollups, 'RETENTION_ROLLUP_1M_DAYS', 30)
+    retention.run_sweep(now=NOW)
+    name, buckets = rollups.query_rollups(start_ts=OCT, end_ts=OCT + 3 * 3600)
+    assert name == '1h'
+    assert sum(b['count'] for b in buckets) == 10
+
+
+def test_rollup_mode_deletes_without_archiving(readings, monkeypatch):
+    monkeypatch.setattr(retention, 'RETENTION_MODE', 'rollup')
+    assert retention.run_sweep(now=NOW)['raw'] == 20
+    assert _live_count() == 10
+    assert retention.list_archive_months() == []
+    assert not os.path.exists(retention.archive_path('202310'))
@@ -0,0 +1,91 @@
+# Rollup tables: incremental buckets, queries, rebuilds and non-finite readings
+import database
+import rollups
+from conftest import API_KEY
+
+T0 = 19700 * 86400  # a UTC midnight
+
+
+def _bucket(name, client_place='alice_lab'):
+    conn = database.get_db_connection()
+    rows = conn.execute(f"""
+        SELECT bucket, count, warnings, temp_sum, temp_min, temp_max, hum_sum, hum_min, hum_max
+        FROM {rollups.ROLLUP_TABLES[name]} WHERE client_place = ? ORDER BY bucket
+    """, (client_place,)).fetchall()
+    conn.close()
+    return [tuple(row) for row in rows]
+
+
+def _save(readings):
+    database.save_sensor_data_batch([('alice_lab', 'lab', t, h, w, ts) for t, h, w, ts in readings])
+
+
+def test_readings_fold_into_every_resolution(db):
+    _save([(20.0, 40.0, '', T0 + 5), (22.0, 50.0, 'high', T0 + 50), (24.0, 60.0, '', T0 + 65)])
+    assert _bucket('1m') == [(T0, 2, 1, 42.0, 20.0, 22.0, 90.0, 40.0, 50.0),
+                             (T0 + 60, 1, 0, 24.0, 24.0, 24.0, 60.0, 60.0, 60.0)]
+    assert _bucket('1h') == _bucket('1d') == [(T0, 3, 1, 66.0, 20.0, 24.0, 150.0, 40.0, 60.0)]
+
+
+def test_later_saves_merge_into_existing_buckets(db):
+    _save([(20.0, 40.0, '', T0 + 5)])
+    _save([(18.0, 70.0, '', T0 + 10)])
+    assert _bucket('1m') == [(T0, 2, 0, 38.0, 18.0, 20.0, 110.0, 40.0, 70.0)]
+
+
+def test_a_null_value_does_not_wipe_a_bucket(db):
+    _save([(20.0, 40.0, '', T0 + 5)])
+    conn = database.get_db_connection()
+    with conn:
+        rollups.update_rollups(conn, [('alice_lab', 'lab', None, None, '', T0 + 6)])
+    conn.close()
+    assert _bucket('1m') == [(T0, 2, 0, 20.0, 20.0, 20.0, 40.0, 40.0, 40.0)]
+
+
+def test_non_finite_readings_are_rejected(client):
+    headers = {'X-API-Key': API_KEY}
+    for value in ('nan', 'inf', '-Infinity'):
+        response = client.post('/submit-data', json={'place': 'lab', 'temperature': value, 'humidity': 50},
+                               headers=headers)
+        assert response.status_code == 400
+    response = client.post('/submit-data/batch', headers=headers, json={'readings': [
+        {'place': 'lab', 'temperature': 21, 'humidity': 50},
+        {'place': 'lab', 'temperature': 'nan', 'humidity': 50}]})
+    body = response.get_json()
+    assert (body['accepted'], body['rejected']) == (1, 1)
+    assert body['results'][1]['status'] == 'error'
+    conn = database.get_db_connection()
+    assert conn.execute("SELECT COUNT(*) FROM sensor_rollup_1m WHERE temp_sum IS NULL").fetchone()[0] == 0
+    assert conn.execute("SELECT SUM(count) FROM sensor_rollup_1m").fetchone()[0] == 1
+    conn.close()
+
+
+def test_query_merges_sensors_and_picks_a_resolution(db):
+    database.save_sensor_data_batch([('alice_lab', 'lab', 20.0, 40.0, '', T0 + 5),
+                                     ('bob_lab', 'lab', 30.0, 60.0, 'high', T0 + 10),
+                                     ('alice_hall', 'hall', 10.0, 50.0, '', T0 + 15)])
+    name, buckets = rollups.query_rollups(place='lab', start_ts=T0, end_ts=T0 + 3600)
+    assert name == '1m'
+    assert buckets == [{'bucket': T0, 'count': 2, 'warnings': 1, 'temp_mean': 25.0, 'temp_min': 20.0,
+                        'temp_max': 30.0, 'hum_mean': 50.0, 'hum_min': 40.0, 'hum_max': 60.0}]
+    name, buckets = rollups.query_rollups(client_place='alice_hall', start_ts=T0, end_ts=T0 + 30 * 86400)
+    assert name == '1d'
+    assert [(b['bucket'], b['count']) for b in buckets] == [(T0, 1)]
+
+
+def test_rebuild_matches_incremental_buckets(db):
+    _save([(20.0 + i, 45.0, '' if i % 3 else 'x', T0 + i * 37) for i in range(200)])
+    incremental = {name: _bucket(name) for name in rollups.ROLLUP_TABLES}
+    conn = database.get_db_connection()
+    with conn:
+        rollups.rebuild_rollups(conn)
+    conn.close()
+    assert {name: _bucket(name) for name in rollups.ROLLUP_TABLES} == incremental
+
+
+def test_rollups_api(owner_client):
+    _save([(20.0, 40.0, '', T0 + 5)])
+    body = owner_client.get('/api/rollups?client_place=alice_lab&start_date=2023-12-09&end_date=2023-12-10').get_json()
+    assert body['resolution'] == '1h'
+    assert [(b['bucket'], b['count']) for b in body['buckets']] == [(T0, 1)]
+    assert owner_client.get('/api/rollups?max_points=x').status_code == 400
@@ -0,0 +1,148 @@
+# Shared state backends: local, sqlite and (fake) redis run through the same contract
+import os
+import threading
+import time
+
+import pytest
+
+import shared_state
+from fake_redis import FakeRedisServer
+
+_redis = None
+
+
+def _fake_redis():
+    """One server for the session - listener threads keep reconnecting to it until exit"""
+    global _redis
+    if _redis is None:
+        _redis = FakeRedisServer().start()
+    return _redis
+
+
+def _make(kind, tmp_path, prefix):
+    if kind == 'local':
+        return shared_state.LocalState()
+    if kind == 'sqlite':
+        return shared_state.SQLiteState(str(tmp_path / 'state.db'))
+    return shared_state.RedisState(f"redis://127.0.0.1:{_fake_redis().port}/0", prefix)
+
+
+@pytest.fixture(params=['local', 'sqlite', 'redis'])
+def backend(request, tmp_path):
+    """factory() -> a backend instance; instances of one test share the store (like two workers).
+
+    'local' only exists within one process, so there the factory returns the same instance.
+    """
+    prefix = f"test-{os.urandom(4).hex()}:"
+    if request.param == 'local':
+        local = shared_state.LocalState()
+        return lambda: local
+    return lambda: _make(request.param, tmp_path, prefix)
+
+
+@pytest.fixture
+def state(backend):
+    return backend()
+
+
+def test_get_set_and_delete(state):
+    assert state.get('missing') is None
+    state.set('a', {'n': 1, 'items': [1, 'x']})
+    state.set('b', 'text')
+    assert state.get('a') == {'n': 1, 'items': [1, 'x']}
+    state.set('a', 2)
+    assert state.get('a') == 2
+    state.delete('a', 'b', 'missing')
+    assert state.get('a') is None and state.get('b') is None
+
+
+def test_ttl_expires(state):
+    state.set('short', 1, ttl=0.05)
+    state.set('long', 1, ttl=60)
+    time.sleep(0.1)
+    assert state.get('short') is None
+    assert state.get('long') == 1
+
+
+def test_add_only_sets_absent_or_expired_keys(state):
+    assert state.add('k', 'first', ttl=0.05)
+    assert not state.add('k', 'second')
+    assert state.get('k') == 'first'
+    time.sleep(0.1)
+    assert state.add('k', 'third')
+    assert state.get('k') == 'third'
+
+
+def test_incr(state):
+    assert state.incr('n') == 1
+    assert state.incr('n', 5) == 6
+    assert state.incr('n', -6) == 0
+    assert state.incr('n', 0) == 0
+    assert state.incr('t', 1, ttl=0.05) == 1
+    time.sleep(0.1)
+    assert state.incr('t', 1, ttl=0.05) == 1
+
+
+def test_incr_is_atomic_across_threads(backend):
+    instances = [backend() for _ in range(4)]
+
+    def bump(instance):
+        for _ in range(50):
+            instance.incr('shared')
+    threads = [threading.Thread(target=bump, args=(instance,)) for instance in instances]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert instances[0].incr('shared', 0) == 200
+
+
+def test_delete_if_compares_first(state):
+    state.set('k', 'mine')
+    assert not state.delete_if('k', 'theirs')
+    assert state.get('k') == 'mine'
+    assert state.delete_if('k', 'mine')
+    assert state.get('k') is None
+    assert not state.delete_if('k', 'mine')
+
+
+def test_lock_excludes_and_releases(backend):
+    first, second = backend(), backend()
+    with first.lock('job') as held:
+        assert held
+        with second.lock('job', wait=0.05) as other:
+            assert not other
+    with second.lock('job', wait=0.05) as other:
+        assert other
+
+
+def test_expired_lock_is_not_released_by_its_old_holder(backend):
+    first, second, third = backend(), backend(), backend()
+    stale = first.lock('job', ttl=0.05)
+    assert stale.__enter__()
+    time.sleep(0.1)
+    with second.lock('job', ttl=60, wait=0.05) as held:
+        assert held
+        stale.__exit__(None, None, None)  # the old holder finishes late
+        with third.lock('job', wait=0.05) as other:
+            assert not other
+    with third.lock('job', wait=0.05) as other:
+        assert other
+
+
+def test_publish_reaches_other_instances_only(backend, monkeypatch, request):
+    kind = request.node.callspec.params['backend']
+    channel = f"test-{os.urandom(4).hex()}"
+    received = []
+    monkeypatch.setitem(shared_state._subscriptions, channel, [received.append])
+    publisher, listener = backend(), backend()
+    listener.start_listener()
+    time.sleep(0.2)  # listener is subscribed / has read the current message id
+    publisher.publish(channel, {'rows': [[1, 'a']]})
+    listener.publish(channel, 'own message')
+    deadline = time.monotonic() + 2
+    while kind != 'local' and not received and time.monotonic() < deadline:
+        time.sleep(0.02)
+    time.sleep(0.1)
+    # local has nobody to tell; the others deliver exactly the other instance's message
+    assert received == ([] if kind == 'local' else [{'rows': [[1, 'a']]}])
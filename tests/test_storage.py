@@ -0,0 +1,63 @@
+# Partitioned storage: routing into day tables and partition id seeds
+import pytest
+
+import database
+import storage
+
+DAY = 86400
+T0 = 19700 * DAY
+
+
+@pytest.fixture
+def partitioned(db, monkeypatch):
+    backend = storage.PartitionedStorage()
+    monkeypatch.setattr(storage, '_storage', backend)
+    return backend
+
+
+def _row(ts):
+    return ('alice_lab', 'lab', 21.0, 50.0, '', database._utc_stamp(ts)[0], ts)
+
+
+def test_rows_go_to_their_day(partitioned):
+    conn = database.get_db_connection()
+    with conn:
+        partitioned.insert(conn, [_row(T0 + 10), _row(T0 + DAY + 10), _row(T0 + DAY + 20)])
+    counts = {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in partitioned.tables(conn)}
+    assert counts == {storage._day_name(19701): 2, storage._day_name(19700): 1, 'sensor_data': 0}
+    assert partitioned.tables(conn, T0 + DAY, T0 + 2 * DAY) == [storage._day_name(19701), 'sensor_data']
+    conn.close()
+
+
+def test_partition_ids_start_at_the_day_seed(partitioned):
+    conn = database.get_db_connection()
+    with conn:
+        partitioned.insert(conn, [_row(T0 + 10)])
+    assert conn.execute(f"SELECT id FROM {storage._day_name(19700)}").fetchone()[0] == 19700 * storage.ID_SPAN + 1
+    conn.close()
+
+
+def test_seed_survives_a_rolled_back_first_insert(partitioned):
+    conn = database.get_db_connection()
+    with pytest.raises(RuntimeError):
+        with conn:
+            partitioned.insert(conn, [_row(T0 + 10)])
+            raise RuntimeError("batch failed")
+    with conn:
+        partitioned.insert(conn, [_row(T0 + 20)])
+    assert conn.execute(f"SELECT id FROM {storage._day_name(19700)}").fetchone()[0] == 19700 * storage.ID_SPAN + 1
+    conn.close()
+
+
+def test_lost_seed_is_repaired(partitioned):
+    conn = database.get_db_connection()
+    with conn:
+        partitioned.insert(conn, [_row(T0 + 10)])
+    conn.execute("DELETE FROM sqlite_sequence WHERE name = ?", (storage._day_name(19700),))
+    conn.commit()
+    fresh = storage.PartitionedStorage()  # another process, first write to this day
+    with conn:
+        fresh.insert(conn, [_row(T0 + 20)])
+    ids = [row[0] for row in conn.execute(f"SELECT id FROM {storage._day_name(19700)} ORDER BY id")]
+    assert ids == [19700 * storage.ID_SPAN + 1, 19700 * storage.ID_SPAN + 2]
+    conn.close()
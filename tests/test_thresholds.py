@@ -0,0 +1,114 @@
+# Threshold profiles: precedence, cache invalidation and the owner's edit forms
+import pytest
+
+import database
+import thresholds
+from config import TEMP_RANGE, HUM_RANGE
+from conftest import API_KEY
+
+ALICE_LAB = ('alice_lab_RESILIENT_lab', 'lab')  # alice's client_place is built from her formatted_name
+ALICE_HALL = ('alice_lab_RESILIENT_hall', 'hall')
+DEFAULT = (TEMP_RANGE, HUM_RANGE)
+
+
+def _ranges(t_min, t_max):
+    return ((t_min, t_max), (30.0, 70.0))
+
+
+def _save(client, place, t_min, t_max):
+    thresholds.save_profile(client, place, t_min, t_max, 30, 70)
+
+
+def test_without_profiles_the_config_ranges_apply(db):
+    assert thresholds.lookup(*ALICE_LAB) == DEFAULT
+
+
+def test_most_specific_profile_wins(db):
+    database.add_client('bob', 'secret2', 'lab', 'bob@example.com', '', '', 10, 'BOB-KEY')
+    _save('', 'lab', 10, 20)
+    assert thresholds.lookup(*ALICE_LAB) == _ranges(10.0, 20.0)
+    assert thresholds.lookup('bob_lab_RESILIENT_lab', 'lab') == _ranges(10.0, 20.0)
+    assert thresholds.lookup(*ALICE_HALL) == DEFAULT
+
+    _save('alice', '', 11, 21)  # client beats place
+    assert thresholds.lookup(*ALICE_LAB) == _ranges(11.0, 21.0)
+    assert thresholds.lookup(*ALICE_HALL) == _ranges(11.0, 21.0)
+    assert thresholds.lookup('bob_lab_RESILIENT_lab', 'lab') == _ranges(10.0, 20.0)
+
+    _save('alice', 'lab', 12, 22)  # client + place beats both
+    assert thresholds.lookup(*ALICE_LAB) == _ranges(12.0, 22.0)
+    assert thresholds.lookup(*ALICE_HALL) == _ranges(11.0, 21.0)
+
+
+def test_saving_again_replaces_the_profile(db):
+    _save('', 'lab', 10, 20)
+    _save('', 'lab', 15, 25)
+    assert len(thresholds.get_profiles()) == 1
+    assert thresholds.lookup(*ALICE_LAB) == _ranges(15.0, 25.0)
+
+
+def test_edits_rebuild_the_compiled_table(db):
+    assert thresholds.lookup(*ALICE_LAB) == DEFAULT  # memoised in the current table
+    _save('alice', 'lab', 10, 20)
+    assert thresholds.lookup(*ALICE_LAB) == _ranges(10.0, 20.0)
+    (profile,) = thresholds.get_profiles()
+    assert thresholds.delete_profile(profile['id'])
+    assert thresholds.lookup(*ALICE_LAB) == DEFAULT
+    assert not thresholds.delete_profile(profile['id'])
+
+
+def test_client_changes_refresh_the_name_map(db):
+    _save('carol', '', 10, 20)
+    database.add_client('carol', 'secret3', 'lab', 'carol@example.com', '', '', 10, 'CAROL-KEY')
+    assert thresholds.lookup('carol_lab_RESILIENT_lab', 'lab') == _ranges(10.0, 20.0)
+    database.delete_client('carol')
+    assert thresholds.lookup('carol_lab_RESILIENT_lab', 'lab') == DEFAULT
+
+
+@pytest.mark.parametrize('values, error', [
+    (('', '', 10, 20, 30, 70), 'Pick a client'),
+    (('alice', '', 'x', 20, 30, 70), 'must be numbers'),
+    (('alice', '', 'nan', 20, 30, 70), 'must be numbers'),
+    (('alice', '', 20, 10, 30, 70), 'below its maximum'),
+])
+def test_invalid_profiles_are_refused(db, values, error):
+    with pytest.raises(thresholds.ThresholdError, match=error):
+        thresholds.save_profile(*values)
+    assert thresholds.get_profiles() == []
+
+
+def test_ingestion_uses_the_profiles(client):
+    headers = {'X-API-Key': API_KEY}
+    reading = {'place': 'lab', 'temperature': 28, 'humidity': 50}
+    assert client.post('/submit-data', json=reading, headers=headers).get_json()['warning']
+    _save('alice', 'lab', 20, 30)
+    assert client.post('/submit-data', json=reading, headers=headers).get_json()['warning'] == ''
+    batch = client.post('/submit-data/batch', json=[reading, dict(reading, temperature=31)], headers=headers).get_json()
+    assert [bool(r['warning']) for r in batch['results']] == [False, True]
+
+
+def _flashes(client):
+    with client.session_transaction() as session:
+        return session.pop('_flashes', [])
+
+
+def test_delete_form_validates_the_id(owner_client):
+    for form in ({}, {'id': 'abc'}, {'id': ''}):
+        response = owner_client.post('/thresholds/delete', data=form)
+        assert response.status_code == 302
+        assert _flashes(owner_client) == [('error', 'Invalid threshold profile')]
+    assert owner_client.post('/thresholds/delete', data={'id': '999'}).status_code == 302
+    assert _flashes(owner_client) == [('error', 'Threshold profile not found')]
+    _save('', 'lab', 10, 20)
+    (profile,) = thresholds.get_profiles()
+    owner_client.post('/thresholds/delete', data={'id': str(profile['id'])})
+    assert _flashes(owner_client) == [('success', 'Threshold profile deleted')]
+    assert thresholds.get_profiles() == []
+
+
+def test_profile_forms_are_owner_only(client):
+    with client.session_transaction() as session:
+        session['username'], session['role'] = 'alice', 'client'
+    client.post('/thresholds', data={'place': 'lab', 'temp_min': 1, 'temp_max': 2, 'hum_min': 1, 'hum_max': 2})
+    assert thresholds.get_profiles() == []
+    assert _flashes(client) == [('error', 'Access denied')]
@@ -0,0 +1,170 @@
+# thresholds.py - Per-client / per-place temperature and humidity ranges
+# Profiles live in threshold_profiles; client (a username) and place may each be
+# NULL, and the most specific one wins:
+#
+#   (client, place) > (client, any place) > (any client, place) > config TEMP_RANGE / HUM_RANGE
+#
+# All profiles are compiled into one immutable ThresholdTable whose lookups are
+# memoised per client_place, so ingestion never queries per reading. A reload
+# builds a complete new table and then swaps the module reference, so a lookup
+# sees either the old set or the new one, never a mix. Edits touch the shared
+# data_versions 'thresholds' signal, which makes every worker rebuild on its next lookup.
+import math
+import threading
+import time
+from config import TEMP_RANGE, HUM_RANGE
+import data_versions
+
+SIGNAL = 'thresholds'  # data_versions.SIGNAL_SLOTS entry
+
+
+class ThresholdError(ValueError):
+    """Profile values that can't be saved"""
+
+
+class ThresholdTable:
+    """Compiled profiles for one version of threshold_profiles"""
+
+    __slots__ = ('version', '_pairs', '_clients', '_places', '_names', '_memo')
+
+    def __init__(self, version, profiles, names):
+        self.version = version
+        self._pairs, self._clients, self._places = {}, {}, {}
+        for client, place, temp_min, temp_max, hum_min, hum_max in profiles:
+            ranges = ((temp_min, temp_max), (hum_min, hum_max))
+            if client and place:
+                self._pairs[(client, place)] = ranges
+            elif client:
+                self._clients[client] = ranges
+            elif place:
+                self._places[place] = ranges
+        self._names = names  # client name used in client_place -> username
+        self._memo = {}
+
+    def ranges(self, client_place, place):
+        """(temp_range, hum_range) that apply to one sensor"""
+        ranges = self._memo.get(client_place)
+        if ranges is None:
+            ranges = self._memo[client_place] = self._resolve(client_place, place)
+        return ranges
+
+    def _resolve(self, client_place, place):
+        # client_place is f"{client_name}_{place}", where client_name is formatted_name or username
+        suffix = f"_{place}"
+        client_name = client_place[:-len(suffix)] if place and client_place.endswith(suffix) else None
+        username = self._names.get(client_name)
+        if username is not None:
+            if (username, place) in self._pairs:
+                return self._pairs[(username, place)]
+            if username in self._clients:
+                return self._clients[username]
+        return self._places.get(place, (TEMP_RANGE, HUM_RANGE))
+
+
+_table = None
+_lock = threading.Lock()
+
+
+def _compile(version):
+    # Import inside function to avoid circular import
+    from database import get_db_connection
+
+    conn = get_db_connection()
+    profiles = conn.execute(
+        "SELECT client, place, temp_min, temp_max, hum_min, hum_max FROM threshold_profiles"
+    ).fetchall()
+    names = {row[0] or row[1]: row[1] for row in conn.execute(
+        "SELECT formatted_name, username FROM clients WHERE role = 'client'")}
+    conn.close()
+    return ThresholdTable(version, [tuple(p) for p in profiles], names)
+
+
+def get_table():
+    """Current compiled table, rebuilt when any worker changed profiles or clients"""
+    global _table
+    version = data_versions.counter(SIGNAL)
+    table = _table
+    if table is None or table.version != version:
+        with _lock:
+            table = _table
+            if table is None or table.version != version:
+                table = _compile(version)
+                _table = table  # atomic swap
+    return table
+
+
+def lookup(client_place, place):
+    """(temp_range, hum_range) for a sensor"""
+    return get_table().ranges(client_place, place)
+
+
+def lookup_many(client_places, places):
+    """Per-row ranges for classify_readings: ((temp_mins, temp_maxs), (hum_mins, hum_maxs))"""
+    table = get_table()
+    rows = [table.ranges(cp, p) for cp, p in zip(client_places, places)]
+    return (([r[0][0] for r in rows], [r[0][1] for r in rows]),
+            ([r[1][0] for r in rows], [r[1][1] for r in rows]))
+
+
+def invalidate():
+    """Clients were added, renamed or removed - rebuild the name map on next lookup"""
+    data_versions.touch(SIGNAL)
+
+
+# ------------------ profile editing (owner) ------------------
+def get_profiles():
+    from database import get_db_connection
+
+    conn = get_db_connection()
+    rows = conn.execute("""
+        SELECT id, client, place, temp_min, temp_max, hum_min, hum_max, updated_at
+        FROM threshold_profiles ORDER BY client IS NULL, client, place IS NULL, place
+    """).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+def save_profile(client, place, temp_min, temp_max, hum_min, hum_max):
+    """Create or replace the profile for (client, place); either may be None for 'any'"""
+    from database import get_db_connection
+
+    client, place = client or None, place or None
+    if client is None and place is None:
+        raise ThresholdError("Pick a client, a place or both (the default ranges live in config.py)")
+    try:
+        temp_min, temp_max, hum_min, hum_max = (float(v) for v in (temp_min, temp_max, hum_min, hum_max))
+    except (TypeError, ValueError):
+        raise ThresholdError("Ranges must be numbers")
+    if not all(math.isfinite(v) for v in (temp_min, temp_max, hum_min, hum_max)):
+        raise ThresholdError("Ranges must be numbers")
+    if temp_min >= temp_max or hum_min >= hum_max:
+        raise ThresholdError("Each minimum must be below its maximum")
+    conn = get_db_connection()
+    with conn:
+        conn.execute("""
+            DELETE FROM threshold_profiles WHERE IFNULL(client, '') = IFNULL(?, '') AND IFNULL(place, '') = IFNULL(?, '')
+        """, (client, place))
+        conn.execute("""
+            INSERT INTO threshold_profiles (client, place, temp_min, temp_max, hum_min, hum_max, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (client, place, temp_min, temp_max, hum_min, hum_max, time.strftime("%Y-%m-%d %H:%M:%S")))
+    conn.close()
+    _changed()
+
+
+def delete_profile(profile_id):
+    """Remove one profile; False if there was no such profile"""
+    from database import get_db_connection
+
+    conn = get_db_connection()
+    with conn:
+        deleted = conn.execute("DELETE FROM threshold_profiles WHERE id = ?", (profile_id,)).rowcount
+    conn.close()
+    if deleted:
+        _changed()
+    return bool(deleted)
+
+
+def _changed():
+    data_versions.touch(SIGNAL)
+    data_versions.bump_all()  # dashboards colour readings by these ranges